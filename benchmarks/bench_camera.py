@@ -0,0 +1,57 @@
+"""sCMOS flash correction and bad pixel filtering (CPU only)."""
+
+import tempfile
+
+from llspy import camera, synthetic
+
+from . import common
+
+
+class CorrectStacksSuite:
+    """CameraParameters.correct_stacks on one timepoint of all channels."""
+
+    params = ["cpu", "numpy"]
+    param_names = ["target"]
+
+    def setup(self, target):
+        _, ny, nx = common.shape()
+        with tempfile.TemporaryDirectory() as tmp:
+            params = camera.CameraParameters(synthetic.make_camparams(tmp, ny, nx))
+        self.camparams = params.get_subroi(
+            camera.CameraROI(synthetic.camera_roi(ny, nx))
+        )
+        self.stacks = common.stacks()
+        self.nbytes = sum(s.nbytes for s in self.stacks)
+        # compile the numba kernel outside of the timing
+        self.camparams.correct_stacks(self.stacks, flashCorrectTarget=target)
+
+    def time_correct_stacks(self, target):
+        self.camparams.correct_stacks(self.stacks, flashCorrectTarget=target)
+
+    def track_correct_stacks_throughput(self, target):
+        return common.rate(
+            lambda: self.camparams.correct_stacks(
+                self.stacks, flashCorrectTarget=target
+            ),
+            self.nbytes / 1e6,
+        )
+
+    track_correct_stacks_throughput.unit = "MB/s"
+
+
+class SelectiveMedianFilterSuite:
+    """Bad pixel correction of a single stack."""
+
+    def setup(self):
+        self.stack = common.stacks(nc=1)[0]
+
+    def time_selective_median_filter(self):
+        camera.selectiveMedianFilter(self.stack, common.OFFSET)
+
+    def track_selective_median_filter_throughput(self):
+        return common.rate(
+            lambda: camera.selectiveMedianFilter(self.stack, common.OFFSET),
+            self.stack.nbytes / 1e6,
+        )
+
+    track_selective_median_filter_throughput.unit = "MB/s"
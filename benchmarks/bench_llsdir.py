@@ -0,0 +1,108 @@
+"""Experiment discovery, file filtering, MIP merging and compression."""
+
+import os
+import shutil
+import tempfile
+
+from llspy import compress, llsdir, parse, synthetic
+
+from . import common
+
+
+class LLSdirSuite:
+    """Parsing an experiment folder with many timepoints."""
+
+    timeout = 300
+
+    def setup_cache(self):
+        return common.experiment(
+            "many_timepoints", nt=common.SIZE["nt"] * 50, nz=4, ny=16, nx=16, nbeads=0
+        )
+
+    def time_llsdir(self, path):
+        llsdir.LLSdir(path)
+
+    def track_llsdir_files_per_second(self, path):
+        nfiles = len(os.listdir(path))
+        return common.rate(lambda: llsdir.LLSdir(path), nfiles)
+
+    track_llsdir_files_per_second.unit = "files/s"
+
+
+class FilterFilesSuite:
+    """Selecting files by timepoint, channel and relative time."""
+
+    def setup(self):
+        self.files = [
+            synthetic.FPATTERN.format(
+                name="cell", c=c, t=t, wave=wave, reltime=t * 2000, abstime=t * 2000
+            )
+            + ".tif"
+            for t in range(2000)
+            for c, wave in enumerate(common.WAVES)
+        ]
+
+    def time_filter_t_c(self):
+        parse.filter_files(self.files, t=range(0, 2000, 10), c=1)
+
+    def time_filter_reltime(self):
+        parse.filter_files(self.files, reltime=(100000, 200000))
+
+
+class MergeMIPsSuite:
+    """Merging the per-stack MIPs of an experiment into a comboMIP."""
+
+    timeout = 300
+
+    def setup_cache(self):
+        return common.experiment("mips", nt=common.SIZE["nt"] * 5, mips=True)
+
+    def time_mergemips(self, path):
+        llsdir.mergemips(os.path.join(path, "MIPs"), "z", delete=False)
+
+    def track_mergemips_throughput(self, path):
+        folder = os.path.join(path, "MIPs")
+        nbytes = sum(
+            os.path.getsize(os.path.join(folder, f))
+            for f in os.listdir(folder)
+            if f.endswith("MIP_z.tif") and "comboMIP" not in f
+        )
+        func = lambda: llsdir.mergemips(folder, "z", delete=False)  # noqa: E731
+        return common.rate(func, nbytes / 1e6)
+
+    track_mergemips_throughput.unit = "MB/s"
+
+
+class CompressSuite:
+    """Compressing the raw tiffs of an experiment (on a fresh copy each run)."""
+
+    params = list(compress.available_compression())
+    param_names = ["compression"]
+    number = 1
+    repeat = 3
+    timeout = 300
+
+    def setup_cache(self):
+        return common.experiment("compress")
+
+    def setup(self, path, compression):
+        self.tmp = tempfile.mkdtemp()
+        self.path = shutil.copytree(path, os.path.join(self.tmp, "exp"))
+        self.nbytes = sum(
+            os.path.getsize(os.path.join(path, f))
+            for f in os.listdir(path)
+            if f.endswith(".tif")
+        )
+
+    def teardown(self, path, compression):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def time_compress(self, path, compression):
+        compress.compress(self.path, compression)
+
+    def track_compress_throughput(self, path, compression):
+        return common.rate(
+            lambda: compress.compress(self.path, compression), self.nbytes / 1e6, 1
+        )
+
+    track_compress_throughput.unit = "MB/s"
@@ -0,0 +1,66 @@
+"""Fiducial bead detection and registration transforms (CPU only)."""
+
+import numpy as np
+
+from fiducialreg.fiducialreg import CloudSet, FiducialCloud
+from llspy import synthetic
+
+from . import common
+
+# channel 1 is displaced by this many voxels (z, y, x) relative to channel 0
+SHIFT = (0.5, 0.8, -0.6)
+
+
+def bead_volumes(nbeads=40, seed=0):
+    rng = np.random.default_rng(seed)
+    positions = synthetic.bead_positions(common.shape(), nbeads, seed=seed)
+    return [
+        rng.poisson(
+            synthetic.render_beads(common.shape(), positions + c * np.array(SHIFT)) + 5
+        ).astype("f")
+        + common.OFFSET
+        for c in range(2)
+    ]
+
+
+class FiducialCloudSuite:
+    """Detecting and gaussian fitting the beads of one channel."""
+
+    timeout = 300
+
+    def setup(self):
+        self.data = bead_volumes()[0]
+
+    def time_fiducialcloud(self):
+        FiducialCloud(self.data, dx=common.DX, dz=common.DZ, filtertype="log")
+
+    def track_fiducialcloud_beads_per_second(self):
+        fc = FiducialCloud(self.data, dx=common.DX, dz=common.DZ, filtertype="log")
+        return common.rate(
+            lambda: FiducialCloud(
+                self.data, dx=common.DX, dz=common.DZ, filtertype="log"
+            ),
+            fc.count,
+        )
+
+    track_fiducialcloud_beads_per_second.unit = "beads/s"
+
+
+class CloudSetTformSuite:
+    """Matching the bead clouds of two channels and fitting a transform."""
+
+    params = ["translation", "rigid", "similarity", "affine", "2step"]
+    param_names = ["mode"]
+    timeout = 300
+
+    def setup_cache(self):
+        return CloudSet(
+            bead_volumes(),
+            labels=["488", "560"],
+            dx=common.DX,
+            dz=common.DZ,
+            filtertype="log",
+        )
+
+    def time_tform(self, cloudset, mode):
+        cloudset.tform("560", "488", mode=mode)
@@ -0,0 +1,53 @@
+"""Shared helpers for the benchmark suite.
+
+Dataset sizes come from the preset named by $LLSPY_BENCH_PRESET ("default",
+or "quick" for a fast smoke run of every benchmark).
+"""
+
+import os
+import time
+
+import numpy as np
+
+from llspy import synthetic
+
+PRESETS = {
+    "quick": {"nz": 32, "ny": 128, "nx": 64, "nt": 2},
+    "default": {"nz": 64, "ny": 256, "nx": 128, "nt": 4},
+}
+
+SIZE = PRESETS[os.environ.get("LLSPY_BENCH_PRESET", "default")]
+
+WAVES = (488, 560)
+DX = 0.104
+DZ = 0.4
+OFFSET = 100
+
+
+def shape():
+    return (SIZE["nz"], SIZE["ny"], SIZE["nx"])
+
+
+def experiment(path, **kwargs):
+    """Write a synthetic experiment of the current size to path."""
+    options = {**SIZE, "waves": WAVES, "dx": DX, "dz": DZ, "offset": OFFSET}
+    options.update(kwargs)
+    return str(synthetic.make_experiment(path, **options))
+
+
+def stacks(nc=len(WAVES), seed=0):
+    """In-memory uint16 bead stacks, one per channel."""
+    rng = np.random.default_rng(seed)
+    positions = synthetic.bead_positions(shape(), 30, seed=seed)
+    beads = synthetic.render_beads(shape(), positions) + 5
+    return [(rng.poisson(beads) + OFFSET).astype(np.uint16) for _ in range(nc)]
+
+
+def rate(func, amount, repeat=3):
+    """Best rate of func over repeat calls, in amount (e.g. MB) per second."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return amount / best
@@ -39,15 +39,9 @@ import json
 import logging
 from os import path as osp
 
-# using Qt5Agg causes "window focus loss" in interpreter for some reason
-import matplotlib
 import numpy as np
 from scipy import ndimage, optimize, stats
 
-matplotlib.use("Qt5Agg")
-
-import matplotlib.pyplot as plt
-
 logger = logging.getLogger(__name__)
 np.seterr(divide="ignore", invalid="ignore")
 
@@ -56,6 +50,17 @@ class RegistrationError(Exception):
     """Base class for fiducialreg errors"""
 
 
+def _pyplot():
+    """Import pyplot for the show* methods, only when something is plotted."""
+    # using Qt5Agg causes "window focus loss" in interpreter for some reason
+    import matplotlib
+
+    matplotlib.use("Qt5Agg")
+    import matplotlib.pyplot as plt
+
+    return plt
+
+
 # TODO: try seperable gaussian filter instead for speed
 def log_filter(img, blurxysigma=1, blurzsigma=2.5, mask=None):
     # sigma that works for 2 or 3 dimensional img
@@ -630,6 +635,7 @@ class FiducialCloud:
         return intrinsicToWorld(self.coords.T, self.dx, self.dz).T
 
     def show(self, withimage=True, filtered=True):
+        plt = _pyplot()
         if withimage and self.filtered is not None:
             im = self.filtered.max(0) if filtered else self.data.max(0)
             plt.imshow(im, cmap="gray", vmax=im.max() * 0.7)
@@ -987,6 +993,7 @@ class CloudSet:
     def show(self, matching=False, withimage=True, filtered=True):
         """show points in clouds overlaying image, if matching is true, only
         show matching points from all sets"""
+        plt = _pyplot()
         if withimage:
             if not self.has_data():
                 raise AttributeError(
@@ -1014,6 +1021,7 @@ class CloudSet:
         self.show(matching=True, **kwargs)
 
     def show_tformed(self, movingLabel=None, fixedLabel=None, matching=False, **kwargs):
+        plt = _pyplot()
         T = self.tform(movingLabel, fixedLabel, **kwargs)
         if matching:
             movingpoints = self.matching()[self.labels.index(movingLabel)]
@@ -1067,6 +1075,7 @@ def imoverlay(im1, im2, method=None, mip=False):
 
 
 def imshowpair(im1, im2, method=None, mip=False, **kwargs):
+    plt = _pyplot()
     # normalize
     if im1.shape != im2.shape:
         raise ValueError("images must be same shape")
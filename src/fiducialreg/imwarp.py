@@ -4,11 +4,14 @@ from scipy.ndimage.interpolation import map_coordinates
 from .imref import imref3d
 
 try:
-    from numba import njit
+    from llspy.kernels import kernel
 except ImportError:
 
-    def njit(f):
-        return f
+    def kernel(*_, **__):
+        def deco(f):
+            return f
+
+        return deco
 
 
 def imwarp(inputImage, tform, R_A=None, outputRef=None):
@@ -141,9 +144,9 @@ def transformPackedPointsInverse(tform, x, y, z):
     return xt, yt, zt
 
 
-@njit
+@kernel("(f8[:, :], f8[:, :, :], f8[:, :, :], f8[:, :, :], b1)")
 def transformPoints(M, x, y, z, inverse=False):
-    if not len({A.shape for A in (x, y, z)}):
+    if not (x.shape == y.shape == z.shape):
         raise ValueError("coordinate lists must all be the same size")
     if not M.shape == (4, 4):
         raise ValueError("transformation expects a 4x4 tform matrix")
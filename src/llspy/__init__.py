@@ -5,11 +5,19 @@ except ImportError:
 import logging
 import sys
 
-from .llsdir import LLSdir
-
 __all__ = ["LLSdir"]
 
 
+def __getattr__(name):
+    # llsdir pulls in numpy, tifffile and the processing modules, so it is only
+    # imported on first use and `import llspy` (e.g. for the CLI) stays cheap
+    if name == "LLSdir":
+        from .llsdir import LLSdir
+
+        return LLSdir
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(format="%(levelname)s:%(name)s | %(message)s")
 
@@ -1,6 +1,4 @@
 import numpy as np
-from scipy.ndimage import gaussian_filter
-from scipy.stats import mode
 
 from .libcudawrapper import deskewGPU as deskew
 from .util import imread
@@ -94,6 +92,8 @@ def cropX(im, width=0, shift=0):
 
 def imcontentbounds(im, sigma=2):
     """Get image content bounding box via gaussian filter and threshold."""
+    from scipy.ndimage import gaussian_filter
+
     # get rid of the first two planes in case of high dark noise
     if im.ndim == 3:
         im = np.squeeze(np.max(im[2:], 0))
@@ -144,6 +144,8 @@ def feature_width(E, background=None, pad=50, t=0):
 
 def detect_background(im):
     """get mode of the first plane"""
+    from scipy.stats import mode
+
     if im.ndim == 4:
         im = im[0][2]
     if im.ndim == 3:
@@ -0,0 +1,189 @@
+"""Concurrent processing of many LLS experiments.
+
+:class:`BatchScheduler` runs the stages of :class:`~llspy.llsdir.ProcessJob`
+for several experiments at once, with separate worker pools for the CPU
+stages (decompression, flash correction, median filter and trimming,
+registration, MIP merging and compression) and for deconvolution.  This way
+experiment N+1 can be corrected while experiment N is being deconvolved and
+experiment N-1 is being compressed.
+
+>>> with BatchScheduler(jobs=3, ram_budget=32e9) as scheduler:
+...     for folder in folders:
+...         scheduler.submit(folder, nIters=10, correctFlash=True)
+>>> errors = scheduler.errors
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from multiprocessing import cpu_count
+
+from .llsdir import ProcessJob
+
+logger = logging.getLogger(__name__)
+
+#: rough peak memory use of each stage, in multiples of the raw timepoint size
+STAGE_MEMORY = {
+    "correct": 6,  # prefetched timepoints, corrected copies and write queue
+    "deconvolve": 8,  # float32 raw and decon results
+    "finish": 4,  # registration read/warp/write queues
+}
+
+
+class MemoryBudget:
+    """Counting semaphore over a number of bytes.
+
+    A reservation larger than the whole budget is allowed to run once
+    nothing else is reserved, rather than blocking forever.
+    """
+
+    def __init__(self, nbytes=None):
+        self.total = nbytes
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes):
+        if not self.total:
+            return 0
+        nbytes = int(min(nbytes, self.total))
+        with self._cond:
+            while self.used + nbytes > self.total:
+                self._cond.wait()
+            self.used += nbytes
+        return nbytes
+
+    def release(self, nbytes):
+        if not self.total:
+            return
+        with self._cond:
+            self.used -= nbytes
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes):
+        nbytes = self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+
+class BatchScheduler:
+    """Process multiple experiments concurrently.
+
+    Args:
+        jobs (int): max number of experiments in progress at once
+        cpu_workers (int): max number of CPU stages running at once
+        decon_workers (int): max number of deconvolution stages running at
+            once (usually the number of GPUs)
+        ram_budget (float): approximate max memory (bytes) used by all running
+            stages, estimated from the raw tiff sizes.  None means no limit
+        binary: cudaDeconv binary passed to each :class:`ProcessJob`
+
+    The flash correction and median filter stages use a multiprocessing
+    pool.  Each of the ``cpu_workers`` stages that can run at once gets an
+    equal share of the CPUs for its pool.  Because these pools are created
+    from worker threads, they use the "spawn" start method (see
+    :func:`llspy.llsdir.cpu_pool`).
+    """
+
+    def __init__(
+        self, jobs=2, cpu_workers=None, decon_workers=1, ram_budget=None, binary=None
+    ):
+        if cpu_workers is None:
+            cpu_workers = max(1, min(jobs, cpu_count() // 2))
+        self.jobs = jobs
+        self.binary = binary
+        self.processes = max(1, cpu_count() // cpu_workers)
+        self.memory = MemoryBudget(ram_budget)
+        self._drivers = ThreadPoolExecutor(jobs, thread_name_prefix="batch")
+        self._pools = {
+            "cpu": ThreadPoolExecutor(cpu_workers, thread_name_prefix="batch-cpu"),
+            "decon": ThreadPoolExecutor(decon_workers, thread_name_prefix="batch-gpu"),
+        }
+        self.futures = {}
+        self.errors = {}
+
+    def submit(self, exp, **kwargs):
+        """Queue an experiment (path or LLSdir) to be processed with kwargs.
+
+        Returns a Future that resolves when the experiment is finished.
+        """
+        future = self._drivers.submit(self._drive, exp, kwargs)
+        self.futures[future] = str(getattr(exp, "path", exp))
+        return future
+
+    def _run(self, pool, stage, name, tpbytes, func, *args, **kwargs):
+        """run func in the given pool, holding this stage's memory estimate"""
+
+        def run():
+            with self.memory.reserve(STAGE_MEMORY.get(stage, 0) * tpbytes):
+                t0 = time.time()
+                result = func(*args, **kwargs)
+            logger.info(f"Batch {stage} of {name} took {time.time() - t0:.1f} s")
+            return result
+
+        return self._pools[pool].submit(run).result()
+
+    def _drive(self, exp, kwargs):
+        """run the stages of one experiment in their pools"""
+        name = str(getattr(exp, "path", exp))
+        job = self._run(
+            "cpu",
+            "prepare",
+            name,
+            0,
+            ProcessJob,
+            exp,
+            self.binary,
+            processes=self.processes,
+            **kwargs,
+        )
+        if not job.ready:
+            return job
+        tpbytes = _timepoint_bytes(job)
+        try:
+            if job.needs_correction:
+                self._run("cpu", "correct", name, tpbytes, job.correct)
+            if job.needs_decon:
+                self._run("decon", "deconvolve", name, tpbytes, job.deconvolve)
+        except Exception:
+            job.abort()
+            raise
+        self._run("cpu", "finish", name, tpbytes, job.finish)
+        return job
+
+    def wait(self):
+        """Block until every submitted experiment is done.
+
+        Returns a dict of {path: exception} for the experiments that failed.
+        """
+        wait(list(self.futures))
+        for future, path in self.futures.items():
+            error = future.exception()
+            if error is not None:
+                logger.error(f"Processing {path} failed: {error}")
+                self.errors[path] = error
+        return self.errors
+
+    def shutdown(self):
+        self._drivers.shutdown(wait=True)
+        for pool in self._pools.values():
+            pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.wait()
+        finally:
+            self.shutdown()
+
+
+def _timepoint_bytes(job):
+    """size of one raw timepoint of the experiment being processed"""
+    E = job.exp
+    return (E.tiff.size_raw or 0) * len(list(job.P.cRange))
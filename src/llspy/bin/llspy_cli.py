@@ -16,7 +16,18 @@ import sys
 import click
 import voluptuous
 
-from llspy import exceptions, libinstall, llsdir, otf, schema, util
+# llsdir, batch and otf pull in the processing stack, they are imported by the
+# commands that need them so that e.g. `lls --help` starts quickly
+from llspy import (
+    catalog,
+    exceptions,
+    kernels,
+    libinstall,
+    scan,
+    schema,
+    scratch,
+    util,
+)
 
 if "--debug" in sys.argv:
     logging.basicConfig(level=logging.DEBUG)
@@ -223,13 +234,29 @@ def cli():
 @click.option("--showsize/--hidesize", "-s/-h", "showsize", is_flag=True, default=True)
 @click.option("--recurse", "-r", is_flag=True)
 @click.option("--depth", "-d", type=int, default=1)
+@click.option(
+    "--catalog",
+    "use_catalog",
+    is_flag=True,
+    help="Read experiments below LLSDIR from the catalog (see lls index) "
+    "instead of the filesystem",
+)
+@click.option("--older", type=int, help="Minimum age in days (with --catalog)")
+@click.option("--larger", type=float, help="Minimum size in GB (with --catalog)")
+@click.option(
+    "--compressed/--uncompressed",
+    default=None,
+    help="Only (un)compressed experiments (with --catalog)",
+)
 @click.option(
     "-v",
     "--verbose",
     count=True,
     help="Increase verbosity with additional -v flags, e.g. -vv",
 )
-def info(paths, verbose, recurse, depth, showsize):
+def info(
+    paths, verbose, recurse, depth, showsize, use_catalog, older, larger, compressed
+):
     """Get info on an LLSDIR.  Change verbosity with -v"""
     logging.getLogger("llspy.llsdir").setLevel("CRITICAL")
     paths = list(paths)
@@ -237,14 +264,29 @@ def info(paths, verbose, recurse, depth, showsize):
     if recurse:
         depth = 1000
 
-    for i, path in enumerate(paths):
-        if not util.pathHasPattern(path, pattern="*Settings.txt"):
-            paths.pop(i)
-            subf = sorted(util.get_subfolders_containing_filepattern(path, level=depth))
-            [paths.insert(i, s) for s in reversed(subf)]
+    rows = None
+    if use_catalog:
+        rows = {}
+        with catalog.Catalog() as cat:
+            for path in paths:
+                rows.update(
+                    (r["path"], r)
+                    for r in cat.query(
+                        path,
+                        min_age=older,
+                        min_size=larger * 1e9 if larger else None,
+                        compressed=compressed,
+                    )
+                )
+        paths = sorted(rows)
+    elif older or larger or compressed is not None:
+        raise click.UsageError("--older, --larger and --compressed need --catalog")
+    else:
+        from llspy import llsdir
 
-    # remove duplicates
-    paths = sorted(set(paths))
+        # experiment folders (and their sizes) in one concurrent pass
+        found = scan.expand_paths(paths, level=depth, sizes=showsize)
+        paths = list(found)
 
     if verbose == 0 and len(paths):
         click.echo()
@@ -265,23 +307,40 @@ def info(paths, verbose, recurse, depth, showsize):
             row_format = row_format + "{:>7}"
         for path in paths:
             try:
-                E = llsdir.LLSdir(path)
-                infolist = [
-                    E.parameters.nc,
-                    E.parameters.nt,
-                    E.parameters.nz,
-                    E.parameters.ny,
-                    E.parameters.nx,
-                    f"{E.parameters.angle:2.1f}" if E.parameters.samplescan else "0",
-                    f"{E.parameters.dz:0.3f}",
-                    f"{E.parameters.dx:0.3f}",
-                    "Yes" if E.is_compressed() else "No",
-                ]
+                if rows is not None:
+                    row = rows[path]
+                    infolist = [
+                        row["nc"],
+                        row["nt"],
+                        row["nz"],
+                        row["ny"],
+                        row["nx"],
+                        f"{row['angle']:2.1f}" if row["angle"] else "0",
+                        f"{row['dz']:0.3f}",
+                        f"{row['dx']:0.3f}",
+                        "Yes" if row["compressed"] else "No",
+                    ]
+                    size = row["size"]
+                else:
+                    E = llsdir.LLSdir(path)
+                    infolist = [
+                        E.parameters.nc,
+                        E.parameters.nt,
+                        E.parameters.nz,
+                        E.parameters.ny,
+                        E.parameters.nx,
+                        f"{E.parameters.angle:2.1f}"
+                        if E.parameters.samplescan
+                        else "0",
+                        f"{E.parameters.dz:0.3f}",
+                        f"{E.parameters.dx:0.3f}",
+                        "Yes" if E.is_compressed() else "No",
+                    ]
+                    size = found[path].size
                 if showsize:
-                    foldersize = util.getfoldersize(path, recurse=True)
-                    infolist.append(util.format_size(foldersize))
+                    infolist.append(util.format_size(size))
                 f = "{:<%d}" % maxPathLen
-                short = f.format(util.shortname(str(E.path), 3))
+                short = f.format(util.shortname(path, 3))
                 click.secho(
                     os.path.split(short)[0] + os.path.sep,
                     nl=False,
@@ -295,6 +354,34 @@ def info(paths, verbose, recurse, depth, showsize):
     click.echo()
 
 
+@cli.command()
+@click.argument(
+    "paths",
+    metavar="DIR",
+    nargs=-1,
+    type=click.Path(exists=True, file_okay=False, resolve_path=True),
+)
+@click.option(
+    "--depth", "-d", type=int, default=1000, help="How deep to search below DIR"
+)
+@click.option(
+    "--force", is_flag=True, help="Re-read every experiment, even if unchanged"
+)
+def index(paths, depth, force):
+    """Add the LLSDIRs below DIR to the catalog used by --catalog.
+
+    Only folders that changed since the last run are read again.  The catalog
+    location can be set with the LLSPY_CATALOG environment variable.
+    """
+    logging.getLogger("llspy.llsdir").setLevel("CRITICAL")
+    with catalog.Catalog() as cat:
+        for path in paths:
+            counts = cat.update(path, level=depth, force=force)
+            click.secho(f"{path}: ", nl=False, fg="yellow")
+            click.echo(", ".join(f"{n} {status}" for status, n in counts.items()))
+        click.echo(f"{len(cat)} experiments in {cat.path}")
+
+
 def check_iters(ctx, param, value):
     if value == 0:
         click.echo(
@@ -319,6 +406,8 @@ def check_iters(ctx, param, value):
         elif cfg["otfDir"] is not None:
             otfdir = cfg["otfDir"]
 
+        from llspy import otf
+
         if otfdir is not None and not otf.dir_has_otfs(otfdir):
             click.secho(
                 "\nOTF directory has no OTFs! -> %s" % otfdir, bold=True, fg="red"
@@ -529,6 +618,32 @@ def check_iters(ctx, param, value):
     help="Process even if the folder already has a processingLog JSON file, "
     "(otherwise skip)",
 )
+@click.option(
+    "--stream",
+    "streamPipeline",
+    is_flag=True,
+    default=DEFAULTS["streamPipeline"][0],
+    show_default=True,
+    help="Correct, deskew/deconvolve and save one timepoint at a time in "
+    "memory, without writing corrected files to disk first",
+)
+@click.option(
+    "--scratch",
+    "scratchDir",
+    type=click.Path(exists=True, file_okay=False, resolve_path=True),
+    default=DEFAULTS["scratchDir"][0],
+    help="Fast local directory (e.g. SSD or /dev/shm) for intermediate files. "
+    "Outputs are copied back to the data folder when each folder is done",
+)
+@click.option(
+    "--format",
+    "outputFormat",
+    type=click.Choice(["tiff", "zarr", "hdf5"]),
+    default=None,
+    help="Save processed stacks as tiff files, or in one chunked OME-Zarr "
+    "store or HDF5 file per folder (uses the streaming pipeline)  "
+    "[default: tiff]",
+)
 @click.option(
     "-z",
     "--compress",
@@ -554,6 +669,38 @@ def check_iters(ctx, param, value):
     help="batch process folder: Recurse through all subfolders with a "
     "Settings.txt file",
 )
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(1, None),
+    default=1,
+    show_default=True,
+    help="Number of experiments to process concurrently with --batch. "
+    "Experiments are corrected, deconvolved and compressed in separate pools",
+)
+@click.option(
+    "--cpu-workers",
+    "cpuWorkers",
+    type=click.IntRange(1, None),
+    default=None,
+    help="Max number of CPU stages (correction, registration, compression) "
+    "running at once with --jobs",
+)
+@click.option(
+    "--decon-workers",
+    "deconWorkers",
+    type=click.IntRange(1, None),
+    default=1,
+    show_default=True,
+    help="Max number of deconvolution stages running at once with --jobs",
+)
+@click.option(
+    "--ram-budget",
+    "ramBudget",
+    type=click.FloatRange(0, None),
+    default=None,
+    help="Approximate memory limit (GB) for all stages running at once with --jobs",
+)
 @click.option(
     "--yes/--no",
     "useAlreadyCorrected",
@@ -564,6 +711,10 @@ def check_iters(ctx, param, value):
 @pass_config
 def decon(config, path, **kwargs):
     """Deskew and deconvolve data in LLSDIR."""
+    from llspy import batch, llsdir
+
+    kernels.start_warm_up()
+
     # update config with relevant values from
 
     # raw deskewed MIPs imply saving Deskewed Raw files
@@ -591,7 +742,7 @@ def decon(config, path, **kwargs):
     # elif options.otfdir is None:
     #     options.otfdir = default_otfdir
 
-    def procfolder(dirpath, options):
+    def procfolder(dirpath, options, scheduler=None):
         E = llsdir.LLSdir(dirpath)
 
         # check whether folder has already been processed by the presence of a
@@ -641,6 +792,10 @@ def decon(config, path, **kwargs):
                 else:
                     click.echo("recreating corrected files...")
 
+        if scheduler is not None:
+            scheduler.submit(E, **options)
+            return
+
         try:
             # try:
             E.autoprocess(**options)
@@ -652,21 +807,35 @@ def decon(config, path, **kwargs):
 
     if kwargs["batch"]:
         try:
-            subfolders = util.get_subfolders_containing_filepattern(
-                path, filepattern="*Settings.txt"
-            )
+            subfolders = [e.path for e in scan.find_experiments(path)]
             click.secho("found the following LLS data folders:", fg="magenta")
             for folder in subfolders:
                 click.secho(folder.split(path)[1], fg="yellow")
+            scheduler = None
+            if kwargs["jobs"] > 1:
+                ram = kwargs["ramBudget"]
+                scheduler = batch.BatchScheduler(
+                    jobs=kwargs["jobs"],
+                    cpu_workers=kwargs["cpuWorkers"],
+                    decon_workers=kwargs["deconWorkers"],
+                    ram_budget=ram * 1e9 if ram else None,
+                )
             for folder in subfolders:
                 try:
-                    procfolder(folder, config)
+                    # each folder may change the options (e.g. correctFlash)
+                    procfolder(folder, dict(config), scheduler)
                 except voluptuous.error.MultipleInvalid as e:
                     e = str(e).replace("@ data['", "for ")
                     e = e.strip("'][0]")
                     click.secho("VALIDATION ERROR: %s" % e, fg="red")
                 except exceptions.LLSpyError as e:
                     click.secho("ERROR: %s" % e, fg="red")
+            if scheduler is not None:
+                with scheduler:
+                    pass  # wait for all experiments to finish
+                for folder, e in scheduler.errors.items():
+                    click.secho(f"ERROR processing {folder}: {e}", fg="red")
+            scratch.wait_for_copies()
             click.echo("\n\nDone batch processing!")
             sys.exit(0)
         except Exception:
@@ -674,6 +843,7 @@ def decon(config, path, **kwargs):
     else:
         try:
             procfolder(path, config)
+            scratch.wait_for_copies()
             click.echo("Done!")
             sys.exit(0)
         except voluptuous.error.MultipleInvalid as e:
@@ -686,6 +856,57 @@ def decon(config, path, **kwargs):
     sys.exit(0)
 
 
+@cli.command()
+@click.argument(
+    "path",
+    metavar="ROOT",
+    type=click.Path(exists=True, file_okay=False, resolve_path=True),
+)
+@click.option(
+    "--workers",
+    "-w",
+    type=int,
+    default=None,
+    help="number of timepoints processed at once (default: half the CPUs)",
+)
+@click.option(
+    "--timeout",
+    type=int,
+    default=600,
+    show_default=True,
+    help="seconds without new files before an experiment is considered done",
+)
+@click.option(
+    "--settle",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="seconds a file size must be stable to be considered complete "
+    "(when the filesystem has no close events)",
+)
+@pass_config
+def watch(config, path, workers, timeout, settle):
+    """Process LLS acquisitions in ROOT live, as they are written.
+
+    Every timepoint is processed (like the GUI preview, using the options in
+    the config file) as soon as all of its channels are written.  Stop with
+    Ctrl-C; processing resumes where it left off when restarted.
+    """
+    from llspy.watch import WatchDaemon
+
+    kernels.start_warm_up()
+
+    with WatchDaemon(
+        path, dict(config), workers=workers, timeout=timeout, settle=settle
+    ) as daemon:
+        click.secho(f"Watching {path} ... (Ctrl-C to stop)", fg="cyan")
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            click.echo("\nFinishing submitted timepoints...")
+    click.echo(f"Processed {daemon.nprocessed} timepoints")
+
+
 @cli.command()
 def deskew():
     """Deskewing only (no decon) of LLS data"""
@@ -825,8 +1046,24 @@ def camera(calibrate):
     help="Minimum age (days) of LLSdir to act on",
     show_default=True,
 )
+@click.option(
+    "--catalog",
+    "use_catalog",
+    is_flag=True,
+    help="Select the LLSdirs below PATHS (and their age) from the catalog "
+    "(see lls index) instead of the filesystem",
+)
 def compress(
-    paths, freeze, _reduce, decompress, recurse, minage, keepmips, depth, dryrun
+    paths,
+    freeze,
+    _reduce,
+    decompress,
+    recurse,
+    minage,
+    keepmips,
+    depth,
+    dryrun,
+    use_catalog,
 ):
     """Compression & decompression of LLSdir"""
     exclusive(
@@ -841,19 +1078,18 @@ def compress(
     if recurse:
         depth = 1000
 
-    # recurse and restrict to LLSdirs
-    for i, path in enumerate(paths):
-        if not util.pathHasPattern(path, pattern="*Settings.txt"):
-            paths.pop(i)
-            subf = sorted(util.get_subfolders_containing_filepattern(path, level=depth))
-            [paths.insert(i, s) for s in reversed(subf)]
-
-    # remove duplicates
-    paths = sorted(set(paths))
+    if use_catalog:
+        with catalog.Catalog() as cat:
+            paths = sorted({r["path"] for p in paths for r in cat.query(p, minage)})
+    else:
+        # recurse and restrict to LLSdirs
+        paths = list(scan.expand_paths(paths, level=depth))
 
     if dryrun:
         click.secho("DRY RUN: NOTHING PERFORMED!", fg="red", underline=True)
 
+    from llspy import llsdir
+
     for path in paths:
         try:
             E = llsdir.LLSdir(path)
@@ -965,6 +1201,7 @@ def show(config, path, stack, timepoint):
     import numpy as np
     from qtpy import QtWidgets
 
+    from llspy import llsdir
     from llspy.gui.img_dialog import ImgDialog
 
     logging.getLogger("llspy.llsdir").setLevel("CRITICAL")
@@ -1006,6 +1243,115 @@ def show(config, path, stack, timepoint):
     sys.exit(APP.exec_())
 
 
+def parse_range(ctx, param, value):
+    if value is None or value.lower() == "all":
+        return None
+    try:
+        return util.string_to_iterable(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+@cli.command()
+@click.argument(
+    "path",
+    metavar="LLSDIR",
+    type=click.Path(exists=True, file_okay=False, resolve_path=True),
+)
+@click.option(
+    "-c",
+    "--config",
+    type=click.Path(exists=True, dir_okay=False),
+    callback=read_config,
+    expose_value=False,
+    multiple=True,
+    is_eager=True,
+    help="Overwrite defaults with values in specified file.",
+)
+@click.option(
+    "--mode",
+    type=click.Choice(["preview", "process"]),
+    default="preview",
+    show_default=True,
+    help="preview processes in memory, process writes the outputs like decon",
+)
+@click.option(
+    "-t",
+    "--tRange",
+    "tRange",
+    default="0",
+    show_default=True,
+    callback=parse_range,
+    help="Timepoints to process, e.g. 0-3,8 ('all' for every timepoint)",
+)
+@click.option(
+    "--cRange",
+    "cRange",
+    default="all",
+    show_default=True,
+    callback=parse_range,
+    help="Channels to process, e.g. 0,2 ('all' for every channel)",
+)
+@click.option(
+    "--sampling/--deterministic",
+    default=True,
+    show_default=True,
+    help="Estimate the time per function from stack samples, or measure "
+    "it with cProfile (slower, exact call counts)",
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(0.0005, None),
+    default=0.005,
+    show_default=True,
+    help="Seconds between stack samples",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(resolve_path=True),
+    help="Bundle folder, or zip file if it ends with .zip "
+    "(default: LLSDIR_profile_DATE.zip in the working directory)",
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, resolve_path=True),
+    help="Earlier bundle to compare this profile with",
+)
+@pass_config
+def profile(config, path, mode, tRange, cRange, sampling, interval, output, baseline):
+    """Profile processing of (part of) LLSDIR and write a profile bundle.
+
+    The bundle holds the time per stage and per function, sampled stacks for
+    flame graphs (stacks.folded) and the machine, package versions and
+    parameters of the run, so that profiles can be compared across runs and
+    upgrades (see --baseline).
+    """
+    from llspy import profiling
+
+    options = dict(config)
+    options.update(tRange=tRange, cRange=cRange)
+    try:
+        bundle = profiling.profile(
+            path, output, mode=mode, sampling=sampling, interval=interval, **options
+        )
+    except voluptuous.error.MultipleInvalid as e:
+        e = str(e).replace("@ data['", "for ")
+        e = e.strip("'][0]")
+        click.secho(f"VALIDATION ERROR: {e}", fg="red")
+        sys.exit(1)
+    except exceptions.LLSpyError as e:
+        click.secho(f"ERROR: {e}", fg="red")
+        sys.exit(1)
+
+    functions = profiling.load_bundle(bundle)["functions"]
+    click.echo(profiling.format_functions(functions, limit=20))
+    if baseline:
+        click.echo()
+        click.echo(profiling.compare(baseline, bundle))
+    click.secho(f"\nProfile written to {bundle}", fg="cyan")
+
+
 @cli.command(short_help="Install cudaDeconv libraries and binaries")
 @click.argument("path", type=click.Path(exists=True, file_okay=True, resolve_path=True))
 @click.option(
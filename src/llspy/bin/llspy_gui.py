@@ -18,6 +18,7 @@ from distutils.version import StrictVersion
 from qtpy import QtGui, QtWidgets
 
 import llspy.gui.exceptions as err
+import llspy.kernels
 from llspy.gui.mainwindow import main_GUI, sessionSettings
 from llspy.gui.qtlogger import LogFileHandler
 
@@ -69,6 +70,9 @@ def main():
     fh.setLevel(logging.DEBUG)
     logger.info(">" * 10 + "  LLSpy STARTUP  " + "<" * 10)
 
+    # compile the numba kernels while the window comes up
+    llspy.kernels.start_warm_up()
+
     # instantiate the main window widget
     mainGUI = main_GUI()
     mainGUI.setWindowIcon(appicon)
@@ -132,7 +136,7 @@ def main():
     # check to see if the cudaDeconv binary is valid, and alert if not
     try:
         binary = llspy.cudabinwrapper.get_bundled_binary()
-        logger.info(llspy.cudabinwrapper.CUDAbin(binary).list_gpus())
+        logger.info(llspy.cudabinwrapper.get_cudabin(binary).list_gpus())
         # if not llspy.nGPU() > 0:
         #     QtWidgets.QMessageBox.warning(mainGUI, "No GPUs detected!",
         #         "cudaDeconv found no "
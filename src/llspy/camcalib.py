@@ -9,17 +9,7 @@ import tifffile as tf
 from scipy.optimize import least_squares
 
 from . import llsdir, util
-
-try:
-    from numba import jit
-except ImportError:
-
-    def jit(**_):
-        def deco(f):
-            return f
-
-        return deco
-
+from .kernels import kernel, pool_initializer
 
 logger = logging.getLogger(__name__)
 
@@ -35,14 +25,14 @@ def get_channel_list(folder):
     ch0list = [f for f in ch0list if "dark" not in f]  # remove dark images
     ch1list = sorted(glob.glob(os.path.join(folder, "*_ch1_*tif")))
     ch1list = [f for f in ch1list if "dark" not in f]  # remove dark images
-    assert len(ch0list) == len(
-        ch1list
-    ), "The number of stacks in ch0 and ch1 must be the same"
+    assert len(ch0list) == len(ch1list), (
+        "The number of stacks in ch0 and ch1 must be the same"
+    )
 
     shapes = [tf.TiffFile(f).series[0].shape for f in (ch0list + ch1list)]
-    assert (
-        len(set(shapes)) == 1
-    ), "All stacks must have the same number of pixels and planes"
+    assert len(set(shapes)) == 1, (
+        "All stacks must have the same number of pixels and planes"
+    )
 
     return ch0list, ch1list
 
@@ -63,7 +53,7 @@ def combine_stacks(ch0, ch1, darkavg):
     return pre, post
 
 
-@jit(nopython=True, nogil=True)
+@kernel("(f8[::1], f8[:], f8[:])")
 def fun(p, x, y):
     """single phase exponential association curve"""
     return p[0] * (1 - np.exp(-p[1] * x)) - y
@@ -88,7 +78,7 @@ def parallel_fit(xdata, ydata, callback=None):
     first plane = paramater a = plateau of exponential association
     second plane = parameter b = rate of exponential association
     """
-    pool = multiprocessing.Pool()
+    pool = multiprocessing.Pool(initializer=pool_initializer, initargs=([fun.name],))
     M = xdata.shape[1]
     N = xdata.shape[2]
     imap_iter = pool.imap(
@@ -7,21 +7,15 @@ import numpy as np
 
 from . import arrayfun, config
 from . import libcudawrapper as libcu
+from .kernels import kernel
 from .util import imread
 
-try:
-    from numba import jit
-except ImportError:
-
-    def jit(**_):
-        def deco(f):
-            return f
-
-        return deco
-
 
 # #THIS ONE WORKS BEST SO FAR
-@jit(nopython=True, nogil=True)
+@kernel(
+    "(u2[:, :, ::1], f4[:, ::1], f4[:, ::1], f4[:, ::1])",
+    "(u2[:, :, ::1], f8[:, ::1], f8[:, ::1], f8[:, ::1])",
+)
 def calc_correction(stack, a, b, offset):
     res = np.empty_like(stack)
     for i in range(stack.shape[0]):
@@ -47,7 +41,7 @@ def selectiveMedianFilter(
     HHMI/Janelia Research Campus, 2011-2014
 
     """
-    from scipy.ndimage.filters import median_filter
+    from scipy.ndimage import median_filter
 
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
@@ -92,7 +86,7 @@ def selectiveMedianFilter(
         out = np.zeros(stack.shape, dt)
         # apply pixelMatrix to correct insensitive pixels
         for z in range(stack.shape[0]):
-            frame = np.asarray(stack[z], "Float32")
+            frame = np.asarray(stack[z], np.float32)
             filteredFrame = median_filter(frame, medianRange)
             frame[pixelMatrix == 1] = filteredFrame[pixelMatrix == 1]
             out[z] = np.asarray(frame, dt)
@@ -0,0 +1,229 @@
+"""SQLite catalog of LLS experiments for fast queries across large archives.
+
+The catalog is filled by ``lls index`` (:meth:`Catalog.update`) and stores the
+fields shown by ``lls info`` for every experiment folder.  Folders are only
+parsed again when their modification time changes (sizes are refreshed on
+every update, as they come for free from the directory scan), so queries like
+"uncompressed experiments older than 30 days over 100 GB" never touch the
+filesystem.
+"""
+
+import datetime
+import logging
+import os
+import sqlite3
+import time
+
+from . import scan
+from .exceptions import LLSpyError
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS experiments (
+    path TEXT PRIMARY KEY,
+    mtime REAL,
+    size INTEGER,
+    date TEXT,
+    nc INTEGER,
+    nt INTEGER,
+    nz INTEGER,
+    ny INTEGER,
+    nx INTEGER,
+    angle REAL,
+    dz REAL,
+    dx REAL,
+    compressed INTEGER,
+    indexed REAL
+);
+CREATE INDEX IF NOT EXISTS experiments_date ON experiments (date);
+CREATE INDEX IF NOT EXISTS experiments_size ON experiments (size);
+"""
+
+FIELDS = (
+    "path",
+    "mtime",
+    "size",
+    "date",
+    "nc",
+    "nt",
+    "nz",
+    "ny",
+    "nx",
+    "angle",
+    "dz",
+    "dx",
+    "compressed",
+    "indexed",
+)
+
+
+def default_path():
+    """Location of the catalog, $LLSPY_CATALOG or catalog.db in the app dir."""
+    if os.environ.get("LLSPY_CATALOG"):
+        return os.environ["LLSPY_CATALOG"]
+    from click import get_app_dir
+
+    return os.path.join(get_app_dir("LLSpy"), "catalog.db")
+
+
+def _under(root):
+    """SQL condition (and args) selecting root and every path below it."""
+    root = os.path.abspath(root).rstrip(os.path.sep)
+    prefix = root + os.path.sep
+    return "(path = ? OR substr(path, 1, ?) = ?)", [root, len(prefix), prefix]
+
+
+class Catalog:
+    """A catalog of experiment folders stored in an SQLite database.
+
+    Args:
+        path (str): database file, created if necessary.  Defaults to
+            :func:`default_path`.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM experiments").fetchone()[0]
+
+    def get(self, path):
+        """Return the catalog row for path, or None if it is not indexed."""
+        cur = self.db.execute(
+            "SELECT * FROM experiments WHERE path = ?", (os.path.abspath(path),)
+        )
+        return cur.fetchone()
+
+    def record(self, E, size=None, mtime=None):
+        """Add or replace the row of an LLSdir."""
+        from .llsdir import LLSdir
+
+        if not isinstance(E, LLSdir):
+            E = LLSdir(E)
+        path = str(E.path.absolute())
+        if mtime is None:
+            mtime = os.stat(path).st_mtime
+        P = E.parameters
+        row = {
+            "path": path,
+            "mtime": mtime,
+            "size": size,
+            "date": E.date.isoformat() if E.date else None,
+            "nc": P.nc,
+            "nt": P.nt,
+            "nz": P.nz,
+            "ny": P.ny,
+            "nx": P.nx,
+            "angle": P.angle if P.samplescan else 0,
+            "dz": P.dz,
+            "dx": P.dx,
+            "compressed": E.is_compressed(),
+            "indexed": time.time(),
+        }
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO experiments ({}) VALUES ({})".format(
+                    ", ".join(FIELDS), ", ".join("?" * len(FIELDS))
+                ),
+                [row[f] for f in FIELDS],
+            )
+
+    def update(self, root, level=1000, force=False, callback=None):
+        """Index all experiments below root, refreshing changed folders.
+
+        Experiments whose folder mtime is unchanged since the last update are
+        not parsed again (only their size is updated) unless ``force``, and
+        rows for folders that disappeared from below root are removed.
+
+        Args:
+            root (str): directory to index.
+            level (int): how deep to search below root.
+            force (bool): re-parse every experiment.
+            callback (callable): called with (path, status) for every
+                experiment, where status is "added", "updated", "unchanged"
+                or "failed".
+
+        Returns:
+            dict: number of experiments per status, plus "removed".
+        """
+        counts = dict.fromkeys(("added", "updated", "unchanged", "failed"), 0)
+        cond, args = _under(root)
+        known = {
+            r["path"]: r["mtime"]
+            for r in self.db.execute(
+                f"SELECT path, mtime FROM experiments WHERE {cond}", args
+            )
+        }
+        for exp in scan.find_experiments(root, level=level, sizes=True):
+            if not force and known.get(exp.path) == exp.mtime:
+                status = "unchanged"
+                with self.db:
+                    self.db.execute(
+                        "UPDATE experiments SET size = ? WHERE path = ?",
+                        (exp.size, exp.path),
+                    )
+            else:
+                status = "updated" if exp.path in known else "added"
+                try:
+                    self.record(exp.path, size=exp.size, mtime=exp.mtime)
+                except (LLSpyError, OSError, ValueError) as e:
+                    logger.warning(f"Could not index {exp.path}: {e}")
+                    status = "failed"
+            known.pop(exp.path, None)
+            counts[status] += 1
+            if callback is not None:
+                callback(exp.path, status)
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM experiments WHERE path = ?", [(p,) for p in known]
+            )
+        counts["removed"] = len(known)
+        return counts
+
+    def query(self, root=None, min_age=None, min_size=None, compressed=None):
+        """Return catalog rows matching all of the given criteria.
+
+        Args:
+            root (str): only experiments in or below this folder.
+            min_age (int): minimum experiment age in days (from Settings.txt).
+            min_size (int): minimum folder size in bytes.
+            compressed (bool): only compressed (True) or uncompressed (False).
+
+        Returns:
+            list: sqlite3.Row objects (indexable by field name), sorted by path.
+        """
+        conds, args = [], []
+        if root is not None:
+            cond, cargs = _under(root)
+            conds.append(cond)
+            args.extend(cargs)
+        if min_age:
+            cutoff = datetime.datetime.now() - datetime.timedelta(days=min_age)
+            conds.append("date <= ?")
+            args.append(cutoff.isoformat())
+        if min_size:
+            conds.append("size >= ?")
+            args.append(min_size)
+        if compressed is not None:
+            conds.append("compressed = ?")
+            args.append(int(compressed))
+        sql = "SELECT * FROM experiments"
+        if conds:
+            sql += " WHERE " + " AND ".join(conds)
+        return self.db.execute(sql + " ORDER BY path", args).fetchall()
+
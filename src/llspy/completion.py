@@ -0,0 +1,149 @@
+"""Detect when files that are being acquired have been completely written.
+
+>>> tracker = CompletionTracker(on_complete, expected_size=E.tiff.size_raw)
+>>> tracker.start()
+>>> tracker.watch(path)  # e.g. from a watchdog on_created handler
+>>> tracker.closed(path)  # from a watchdog on_closed handler, if available
+"""
+
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CompletionTracker:
+    """Report files as complete once they have been completely written.
+
+    Files are added with :meth:`watch`, and ``callback(path)`` is called once
+    for each of them when it is complete:
+
+    * if the expected size of the file is known (e.g. ``LLSdir.tiff.size_raw``
+      for raw stacks), as soon as that many bytes are present;
+    * otherwise on a close-write event, reported with :meth:`closed` (inotify
+      ``IN_CLOSE_WRITE``, watchdog's ``on_closed``), or once the size of the
+      file has not changed for ``settle`` seconds on filesystems without
+      close events.
+
+    Files that stay smaller than their expected size are reported anyway,
+    with a warning, after not changing for ``partial_timeout`` seconds, so
+    that an interrupted acquisition doesn't stall.
+
+    All pending files are checked by a single poller thread (:meth:`start`),
+    so nothing waits on a file in the thread reporting the events.
+
+    Args:
+        callback (callable): called with the path of each complete file, from
+            the poller thread or from the thread calling :meth:`closed`
+        expected_size (int, callable): expected size in bytes, or a function
+            returning it (or None if not known) for a path
+        settle (float): seconds a file size must be stable without a close
+            event (when the expected size is not known)
+        interval (float): seconds between polls of the pending files
+        partial_timeout (float): seconds after which a stable file smaller
+            than its expected size is reported
+    """
+
+    def __init__(
+        self, callback, expected_size=None, settle=1.0, interval=0.1, partial_timeout=30
+    ):
+        self.callback = callback
+        self.expected_size = expected_size
+        self.settle = settle
+        self.interval = interval
+        self.partial_timeout = partial_timeout
+        self._pending = {}  # path -> (size, time of last size change)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _expected(self, path):
+        if callable(self.expected_size):
+            return self.expected_size(path) or None
+        return self.expected_size or None
+
+    def watch(self, path):
+        """Start tracking a file that is (or may still be) being written."""
+        with self._lock:
+            self._pending.setdefault(path, (-1, time.time()))
+
+    def discard(self, path):
+        """Stop tracking path (e.g. it was deleted)."""
+        with self._lock:
+            self._pending.pop(path, None)
+
+    def closed(self, path):
+        """Handle a close-write event.  Untracked paths are ignored."""
+        with self._lock:
+            if path not in self._pending:
+                return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            self.discard(path)
+            return
+        expected = self._expected(path)
+        if expected is None or size >= expected:
+            self._complete(path)
+
+    def poll(self):
+        """Check every pending file once."""
+        now = time.time()
+        with self._lock:
+            pending = list(self._pending.items())
+        for path, (size, since) in pending:
+            try:
+                newsize = os.path.getsize(path)
+            except OSError:
+                self.discard(path)
+                continue
+            expected = self._expected(path)
+            if expected is not None and newsize >= expected:
+                self._complete(path)
+            elif newsize != size:
+                with self._lock:
+                    if path in self._pending:
+                        self._pending[path] = (newsize, now)
+            elif expected is None:
+                if newsize > 0 and now - since >= self.settle:
+                    self._complete(path)
+            elif now - since >= self.partial_timeout:
+                logger.warning(
+                    f"File stopped growing at {newsize} of {expected} bytes: {path}"
+                )
+                self._complete(path)
+
+    def _complete(self, path):
+        with self._lock:
+            if self._pending.pop(path, None) is None:
+                return  # already reported
+        try:
+            self.callback(path)
+        except Exception as e:
+            logger.error(f"Error handling completed file {path}: {e}")
+
+    def start(self):
+        """Start the poller thread."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="CompletionTracker", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+    def stop(self):
+        """Stop the poller thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
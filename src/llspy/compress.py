@@ -1,3 +1,4 @@
+import functools
 import logging
 import os
 import subprocess
@@ -22,18 +23,29 @@ archive_extension = {
     "gzip": ".gz",
 }
 
+
 # FIXME: this is mostly duplicated from gui/mainwindow.py...
 # should unify that and get rid of get_platform_compression()
-availableCompression = []
-# get compression options
-for ctype in ("lbzip2", "pbzip2", "pigz", "bzip2", "gzip"):
-    if util.which(ctype) is not None:
-        availableCompression.append(ctype)
+@functools.lru_cache(maxsize=None)
+def available_compression():
+    """Compression programs found on this system, looked up on first use."""
+    return tuple(
+        ctype
+        for ctype in ("lbzip2", "pbzip2", "pigz", "bzip2", "gzip")
+        if util.which(ctype) is not None
+    )
+
+
+def __getattr__(name):
+    # availableCompression used to be a list filled at import time
+    if name == "availableCompression":
+        return list(available_compression())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_platform_compression():
     # return 'pigz' if sys.platform.startswith("win32") else 'lbzip2'
-    return availableCompression[0]
+    return available_compression()[0]
 
 
 def tartiffs(path, delete=True):
@@ -15,6 +15,7 @@ thisDirectory = os.path.dirname(os.path.abspath(__file__))
 parentDirectory = os.path.abspath(os.path.join(thisDirectory, os.pardir))
 
 __CONFIGFILE__ = os.path.expanduser("~/.llspy")
+__CACHEDIR__ = os.environ.get("LLSPY_CACHE_DIR", os.path.expanduser("~/.cache/llspy"))
 
 defaults = {
     "cudadeconv": "cudaDeconv",
@@ -24,6 +25,7 @@ defaults = {
     ),
     "otf_path": "/Users/talley/Dropbox (HMS)/CBMF/lattice_sample_data/lls_PSFs/",
     "output_log": "ProcessingLog.txt",
+    "metrics_log": "ProcessingMetrics.jsonl",
 }
 
 config = configparser.ConfigParser()
@@ -55,3 +57,4 @@ __RADIALFT__ = _get_param("radialft", str)
 __CAMPARAMS__ = _get_param("camera_parameters", str)
 __OTFPATH__ = plib.Path(_get_param("otf_path", str))
 __OUTPUTLOG__ = _get_param("output_log", str)
+__METRICSLOG__ = _get_param("metrics_log", str)
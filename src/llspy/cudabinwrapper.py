@@ -1,8 +1,10 @@
+import json
 import logging
 import os
 import re
 import subprocess
 import sys
+import threading
 
 from voluptuous import (
     REMOVE_EXTRA,
@@ -17,7 +19,7 @@ from voluptuous import (
 )
 from voluptuous.humanize import validate_with_humanized_errors
 
-from . import util
+from . import config, util
 from .exceptions import CUDAbinException, CUDAProcessError
 
 logger = logging.getLogger(__name__)
@@ -30,6 +32,13 @@ elif PLAT == "cygwin":
 
 intbool = Schema(lambda x: int(bool(x)))
 
+#: help text and version of each binary, keyed by path and checked against
+#: the size and mtime of the file, so that cudaDeconv is not re-run to probe
+#: its options every time a CUDAbin is created
+PROBE_CACHE = os.path.join(config.__CACHEDIR__, "cudabin.json")
+_probe_lock = threading.Lock()
+_instances = {}
+
 
 def dirpath(v):
     if not os.path.isdir(str(v)):
@@ -54,11 +63,67 @@ def nGPU(binary=None):
 
 
 def gpulist():
-    return re.findall(r'(?<=Device \d: ").*(?=")', CUDAbin().list_gpus())
+    return re.findall(r'(?<=Device \d: ").*(?=")', get_cudabin().list_gpus())
 
 
 def get_version():
-    return CUDAbin().get_version()
+    return get_cudabin().get_version()
+
+
+def get_cudabin(binPath=None):
+    """Return a CUDAbin for binPath that is shared by the whole process.
+
+    A new instance is only created if the binary changed on disk.
+    """
+    if binPath is None:
+        binPath = get_bundled_binary()
+    with _probe_lock:
+        binary = _instances.get(binPath)
+    if binary is None or binary._probe.get("stat") != _file_stat(binary.path):
+        binary = CUDAbin(binPath)
+        with _probe_lock:
+            _instances[binPath] = binary
+    return binary
+
+
+def _file_stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _read_probe_cache():
+    try:
+        with open(PROBE_CACHE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _load_probe(path):
+    """return the cached probe results for path, if the file is unchanged"""
+    with _probe_lock:
+        probe = _read_probe_cache().get(os.path.realpath(path))
+    if probe and probe.get("stat") == _file_stat(path):
+        return probe
+    return None
+
+
+def _save_probe(path, probe):
+    probe["stat"] = _file_stat(path)
+    with _probe_lock:
+        cache = _read_probe_cache()
+        cache[os.path.realpath(path)] = probe
+        tmp = f"{PROBE_CACHE}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(PROBE_CACHE), exist_ok=True)
+            with open(tmp, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp, PROBE_CACHE)
+        except OSError as e:
+            logger.debug(f"Could not write cudaDeconv probe cache: {e}")
 
 
 def is_cudaDeconv(path):
@@ -248,11 +313,13 @@ class CUDAbin:
         """
         if self._self_test(path):
             self.path = path
+            self.options = self._get_options()
 
     def _self_test(self, binPath):
         """
         test to check if the executable exists and run the '-h' command
-        for verification.
+        for verification.  The '-h' output is cached on disk, so the binary
+        is only run again when it changes.
 
         binPath -- Absolute path to binary
 
@@ -262,7 +329,12 @@ class CUDAbin:
         If the 'cudaDeconv -h' command failed
         """
         if os.path.isfile(binPath) and os.access(binPath, os.X_OK):
-            self._run_command([binPath, "-h"])
+            probe = _load_probe(binPath)
+            if probe is None:
+                output = self._run_command([binPath, "-h"]).output
+                probe = {"help": output.decode("utf-8")}
+                _save_probe(binPath, probe)
+            self._probe = probe
             return True
         else:
             raise CUDAbinException(
@@ -282,7 +354,10 @@ class CUDAbin:
         return self.run("-Q")
 
     def get_version(self):
-        return self.run("-v")
+        if "version" not in self._probe:
+            self._probe["version"] = self.run("-v")
+            _save_probe(self.path, self._probe)
+        return self._probe["version"]
 
     # FIXME: combine this with _run_command
     def run(self, cmd):
@@ -325,11 +400,10 @@ class CUDAbin:
 
     def _get_options(self):
         """
-        query the binary help output and output a list of possible flags
+        parse the binary help output and output a list of possible flags
         and descriptions
         """
-        h = self._run_command([self.path, "-h"])
-        self.helpstring = h.output.decode("utf-8")
+        self.helpstring = self._probe["help"]
         H = self.helpstring.splitlines()
         options = [re.findall("[^A-Za-z1-9]-[1-9a-zA-Z-]+", i) for i in H]
         hasarg = [1 if z else 0 for z in options]
@@ -21,6 +21,13 @@ class CompressionError(LLSpyError):
     """
 
 
+class ScratchError(LLSpyError):
+    """
+    Exception indicating that a scratch directory can't be used for processing
+    (e.g. because it doesn't exist or has too little free space).
+    """
+
+
 class CUDAbinException(LLSpyError):
     """
     Generic exception indicating anything relating to the execution
@@ -1,12 +1,13 @@
 import inspect
 import logging
 import os
-import re
 import sys
 import time
 
 from qtpy import QtCore, QtWidgets
 
+from llspy.util import string_to_iterable  # noqa: F401
+
 
 # TODO: add timer?
 def newWorkerThread(workerClass, *args, **kwargs):
@@ -49,21 +50,6 @@ def wait_for_file_close(file, delay=0.05):
     return
 
 
-def wait_for_folder_finished(path, delay=0.1):
-    size_now = 0
-    while True:
-        # check to see if the file is the same size as it was 30 ms ago
-        # if so... we assume it is done being written
-        size_last = size_now
-        size_now = sum(
-            os.path.getsize(f) for f in os.listdir(path) if os.path.isfile(f)
-        )
-        if size_now == size_last and size_now > 0:
-            break
-        time.sleep(delay)
-    return
-
-
 def byteArrayToString(bytearr):
     if sys.version_info.major < 3:
         return str(bytearr)
@@ -75,29 +61,6 @@ def shortname(path, parents=2):
     return os.path.sep.join(os.path.normpath(path).split(os.path.sep)[-parents:])
 
 
-def string_to_iterable(string):
-    """convert a string into an iterable
-    note: ranges are inclusive
-
-    >>> string_to_iterable('0,3,5-10,15-30-3,40')
-    [0,3,5,6,7,8,9,10,15,18,21,24,27,30,40]
-    """
-    if re.search(r"[^\d^,^-]", string) is not None:
-        raise ValueError("Iterable string must contain only digits, commas, and dashes")
-    it = []
-    splits = [tuple(s.split("-")) for s in string.split(",")]
-    for item in splits:
-        if len(item) == 1:
-            it.append(int(item[0]))
-        elif len(item) == 2:
-            it.extend(list(range(int(item[0]), int(item[1]) + 1)))
-        elif len(item) == 3:
-            it.extend(list(range(int(item[0]), int(item[1]) + 1, int(item[2]))))
-        else:
-            raise ValueError("Iterable string items must be of length <= 3")
-    return sorted(set(it))
-
-
 def guisave(widget, settings):
     print(f"Saving settings: {settings.fileName()}")
     # Save geometry
@@ -1,9 +1,11 @@
 #!/usr/bin/python
 
+import fnmatch
 import json
 import logging
 import os
 import os.path as osp
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import numpy as np
 from qtpy import QtCore, QtGui
@@ -56,6 +58,9 @@ defaultSettings = QtCore.QSettings("llspy", "llspyDefaults")
 defaultINI = llspy.util.getAbsoluteResourcePath("gui/guiDefaults.ini")
 programDefaults = QtCore.QSettings(defaultINI, QtCore.QSettings.IniFormat)
 
+# number of queued items prepared while the current item is being processed
+LOOKAHEAD = 2
+
 _napari = None
 
 try:
@@ -78,6 +83,41 @@ if not sessionSettings.value("disableSpimagineCheckBox", False, type=bool):
         logger.error("could not import spimagine.")
 
 
+def scan_folder(path, allowNoSettings=False):
+    """Do the filesystem work needed to add path to the queue.
+
+    This reads the folder and builds the LLSdir, so it is run in a worker
+    thread by :meth:`LLSDragDropTable.addPath`.  If path has no Settings.txt
+    file, its subfolders that do are returned instead, so that a folder of
+    experiments can be added at once.
+    """
+    names = os.listdir(path)
+
+    def has(pattern):
+        return any(fnmatch.fnmatch(n, pattern) for n in names)
+
+    scan = {
+        "settings": has("*Settings.txt"),
+        "iters": has("*Iter_*"),
+        "tiffs": has("*.tif"),
+        "subfolders": [],
+        "E": None,
+    }
+    if not scan["settings"]:
+        scan["subfolders"] = [
+            d
+            for d in llspy.util.get_subfolders_containing_filepattern(path)
+            if d != path
+        ]
+        if scan["subfolders"] or not allowNoSettings:
+            return scan
+    E = llspy.llsdir.LLSdir(path)
+    scan["E"] = E
+    scan["lls_tiffs"] = E.has_lls_tiffs
+    scan["compressed"] = E.is_compressed()
+    return scan
+
+
 class LLSDragDropTable(QtW.QTableWidget):
     colHeaders = [  # noqa
         "path",
@@ -95,6 +135,8 @@ class LLSDragDropTable(QtW.QTableWidget):
 
     # A signal needs to be defined on class level:
     dropSignal = QtCore.Signal(list, name="dropped")
+    # emitted from the scanning threads with (path, Future of scan_folder)
+    scanFinished = QtCore.Signal(str, object)
 
     # This signal emits when a URL is dropped onto this list,
     # and triggers handler defined in parent widget.
@@ -107,6 +149,10 @@ class LLSDragDropTable(QtW.QTableWidget):
         self.setEditTriggers(QtW.QAbstractItemView.DoubleClicked)
         self.setGridStyle(3)  # dotted grid line
         self.llsObjects = {}  # dict to hold LLSdir Objects when instantiated
+        # folders are scanned in the background: {path: Future}
+        self.scans = {}
+        self.scanPool = ThreadPoolExecutor(4, thread_name_prefix="scan")
+        self.scanFinished.connect(self.onScanFinished)
 
         self.setHorizontalHeaderLabels(self.colHeaders)
         self.hideColumn(0)  # column 0 is a hidden col for the full pathname
@@ -172,17 +218,68 @@ class LLSDragDropTable(QtW.QTableWidget):
                 self.cellChanged.connect(self.onCellChanged)
 
     @QtCore.Slot(str)
-    def addPath(self, path):
+    def addPath(self, path, wait=False):
+        """Add an LLS folder (or a folder of LLS folders) to the queue.
+
+        The folder is scanned in a background thread and its row is added
+        when the scan finishes, unless wait is True.
+        """
+        if not (osp.exists(path) and osp.isdir(path)):
+            return
+        # if it's already on the list or being scanned, don't add it again
+        if path in self.scans or len(self.findItems(path, QtCore.Qt.MatchExactly)):
+            return
+
+        mainGUI = self.parent().parent().parent().parent().parent()
+        allowNoSettings = mainGUI.allowNoSettingsCheckBox.isChecked()
+        if wait:
+            self.addScanned(path, scan_folder(path, allowNoSettings))
+            return
+        future = self.scanPool.submit(scan_folder, path, allowNoSettings)
+        self.scans[path] = future
+        future.add_done_callback(lambda f: self.scanFinished.emit(path, f))
+
+    @QtCore.Slot(str, object)
+    def onScanFinished(self, path, future):
+        if self.scans.get(path) is not future:
+            return  # cancelled
+        del self.scans[path]
+        try:
+            scan = future.result()
+        except Exception as e:
+            logger.error(f"Could not add {path}: {e}")
+            return
+        self.addScanned(path, scan)
+
+    def finishScans(self):
+        """Wait for the pending scans and add their rows, in this thread.
+
+        Scans of the subfolders of a parent folder are waited for as well.
+        """
+        while self.scans:
+            path, future = next(iter(self.scans.items()))
+            wait([future])
+            self.onScanFinished(path, future)
+
+    def cancelScans(self):
+        for future in self.scans.values():
+            future.cancel()
+        self.scans = {}
+
+    def addScanned(self, path, scan):
+        """Add a row for path, given the result of scan_folder(path)"""
         try:
             self.cellChanged.disconnect(self.onCellChanged)
         except TypeError:
             pass
-        if not (osp.exists(path) and osp.isdir(path)):
-            return
 
         mainGUI = self.parent().parent().parent().parent().parent()
         # If this folder is not on the list yet, add it to the list:
-        if not llspy.util.pathHasPattern(path, "*Settings.txt"):
+        if not scan["settings"]:
+            if scan["subfolders"]:
+                for folder in scan["subfolders"]:
+                    self.addPath(folder)
+                return
             if not mainGUI.allowNoSettingsCheckBox.isChecked():
                 logger.warning(f"No Settings.txt! Ignoring: {path}")
                 return
@@ -192,7 +289,7 @@ class LLSDragDropTable(QtW.QTableWidget):
             return
 
         # if it's a folder containing files with "_Iter_"  warn the user...
-        if llspy.util.pathHasPattern(path, "*Iter_*"):
+        if scan["iters"]:
             if sessionSettings.value("warnIterFolder", True, type=bool):
                 box = QtW.QMessageBox()
                 box.setWindowTitle("Note")
@@ -231,9 +328,9 @@ class LLSDragDropTable(QtW.QTableWidget):
                 elif reply == 0:  # process anyway hit
                     pass
 
-        E = llspy.llsdir.LLSdir(path)
-        if E.has_settings and not E.has_lls_tiffs:
-            if not E.is_compressed() and llspy.util.pathHasPattern(path, "*.tif"):
+        E = scan["E"]
+        if E.has_settings and not scan["lls_tiffs"]:
+            if not scan["compressed"] and scan["tiffs"]:
                 if sessionSettings.value("warnOnNoLLStiffs", True, type=bool):
                     box = QtW.QMessageBox()
                     box.setWindowTitle(
@@ -321,6 +418,10 @@ class LLSDragDropTable(QtW.QTableWidget):
 
     @QtCore.Slot(str)
     def removePath(self, path):
+        future = self.scans.pop(path, None)
+        if future is not None:
+            future.cancel()
+            return
         try:
             self.llsObjects.pop(path)
         except KeyError:
@@ -652,11 +753,18 @@ class main_GUI(QtW.QMainWindow, Ui_Main_GUI, RegistrationTab):
         RegistrationTab.__init__(self)
 
         self.LLSItemThreads = []
+        # CPU-only preparation of upcoming items, while the current one
+        # is being deconvolved: {path: Future of workers.prepare_item}
+        self.preparedItems = {}
+        # discarded preparations that may still be writing Corrected folders
+        self.discardedItems = {}
+        self.prepPool = ThreadPoolExecutor(LOOKAHEAD, thread_name_prefix="prepare")
         self.compressionThreads = []
         self.argQueue = []  # holds all argument lists that will be sent to threads
         self.aborted = False  # current abort status
         self.inProcess = False
         self.observer = None  # for watching the watchdir
+        self.watchHandler = None
         self.activeWatchers = {}
         self.spimwins = []
 
@@ -841,13 +949,13 @@ class main_GUI(QtW.QMainWindow, Ui_Main_GUI, RegistrationTab):
         self.watchdir = self.watchDirLineEdit.text()
         if osp.isdir(self.watchdir):
             logger.info(f"Starting watcher on {self.watchdir}")
-            # TODO: check to see if we need to save watchHandler
             self.watcherStatus.setText(f"👁 {osp.basename(self.watchdir)}")
-            watchHandler = MainHandler()
-            watchHandler.foundLLSdir.connect(self.on_watcher_found_item)
-            watchHandler.lostListItem.connect(self.listbox.removePath)
+            self.watchHandler = MainHandler()
+            self.watchHandler.foundLLSdir.connect(self.on_watcher_found_item)
+            self.watchHandler.finishedLLSdir.connect(self.on_watcher_finished_item)
+            self.watchHandler.lostListItem.connect(self.listbox.removePath)
             self.observer = Observer()
-            self.observer.schedule(watchHandler, self.watchdir, recursive=True)
+            self.observer.schedule(self.watchHandler, self.watchdir, recursive=True)
             self.observer.start()
 
     @QtCore.Slot()
@@ -856,6 +964,8 @@ class main_GUI(QtW.QMainWindow, Ui_Main_GUI, RegistrationTab):
             self.observer.stop()
             self.observer.join()
             self.observer = None
+            self.watchHandler.stop()
+            self.watchHandler = None
             logging.info(f"Stopped watcher on {self.watchdir}")
             self.watchdir = None
         if not self.observer:
@@ -865,15 +975,19 @@ class main_GUI(QtW.QMainWindow, Ui_Main_GUI, RegistrationTab):
 
     @QtCore.Slot(str)
     def on_watcher_found_item(self, path):
+        # the settings file of a new folder has been written
         if self.watchModeAcquisitionRadio.isChecked():
             # assume more files are coming (like during live acquisition)
             activeWatcher = ActiveWatcher(path)
             activeWatcher.finished.connect(activeWatcher.deleteLater)
             activeWatcher.status_update.connect(self.statusBar.showMessage)
             self.activeWatchers[path] = activeWatcher
-        elif self.watchModeServerRadio.isChecked():
-            # assumes folders are completely finished when dropped
-            self.listbox.addPath(path)
+
+    @QtCore.Slot(str)
+    def on_watcher_finished_item(self, path):
+        # every file of a new folder has been written
+        if self.watchModeServerRadio.isChecked():
+            self.listbox.addPath(path, wait=True)
             self.onProcess()
 
     @QtCore.Slot()
@@ -1257,39 +1371,39 @@ class main_GUI(QtW.QMainWindow, Ui_Main_GUI, RegistrationTab):
         else:
             logger.warning("Ignoring request to process, already processing...")
 
+    def skip_reason(self, path, opts):
+        """Return why path won't be processed, or None"""
+        if not os.path.exists(path):
+            return f"Skipping! path no longer exists: {path}"
+        # check if already processed
+        if not opts["reprocess"] and llspy.util.pathHasPattern(
+            path, "*" + llspy.config.__OUTPUTLOG__
+        ):
+            return f"Skipping! Path already processed: {path}"
+        return None
+
     def process_next_item(self):
         # get path from first row and create a new LLSdir object
         numskipped = len(self.listbox.skipped_items)
         self.currentItem = self.listbox.item(numskipped, 1).text()
         self.currentPath = self.listbox.getPathByIndex(numskipped)
         obj = self.listbox.getLLSObjectByPath(self.currentPath)
+        prepared = self.preparedItems.pop(self.currentPath, None)
+        after = self.running_discarded_item(self.currentPath)
 
-        def skip():
-            self.listbox.removePath(self.currentPath)
-            self.look_for_next_item()
-            return
+        idx = 0  # might use this later to spawn more threads
+        opts = self.optionsOnProcessClick
 
-        if not os.path.exists(self.currentPath):
-            msg = f"Skipping! path no longer exists: {self.currentPath}"
+        msg = self.skip_reason(self.currentPath, opts)
+        if msg:
             logger.info(msg)
             self.statusBar.showMessage(msg, 5000)
-            skip()
+            if prepared is not None:
+                workers.discard_prepared_item(prepared)
+            self.listbox.removePath(self.currentPath)
+            self.look_for_next_item()
             return
 
-        idx = 0  # might use this later to spawn more threads
-        opts = self.optionsOnProcessClick
-
-        # check if already processed
-        if llspy.util.pathHasPattern(
-            self.currentPath, "*" + llspy.config.__OUTPUTLOG__
-        ):
-            if not opts["reprocess"]:
-                msg = f"Skipping! Path already processed: {self.currentPath}"
-                logger.info(msg)
-                self.statusBar.showMessage(msg, 5000)
-                skip()
-                return
-
         if not len(QtCore.QCoreApplication.instance().gpuset):
             self.on_proc_finished()
             raise err.InvalidSettingsError("No GPUs selected. Check Config Tab")
@@ -1302,6 +1416,8 @@ class main_GUI(QtW.QMainWindow, Ui_Main_GUI, RegistrationTab):
             obj,
             idx,
             opts,
+            prepared=prepared,
+            after=after,
             workerConnect={
                 "finished": self.on_item_finished,
                 "status_update": self.statusBar.showMessage,
@@ -1331,6 +1447,44 @@ class main_GUI(QtW.QMainWindow, Ui_Main_GUI, RegistrationTab):
         self.timer = QtCore.QTime()
         self.timer.restart()
 
+        self.prepare_upcoming_items(numskipped + 1)
+
+    def prepare_upcoming_items(self, firstrow):
+        """Start the CPU-only preparation (decompression, parameters, flash
+        correction...) of the next LOOKAHEAD items in the queue, so that it
+        overlaps with the deconvolution of the current item.  A flash
+        correction on the GPU is left to the item's worker."""
+        opts = self.optionsOnProcessClick
+        lastrow = min(self.listbox.rowCount(), firstrow + LOOKAHEAD)
+        for row in range(firstrow, lastrow):
+            path = self.listbox.getPathByIndex(row)
+            if path in self.preparedItems or self.skip_reason(path, opts):
+                continue
+            if self.running_discarded_item(path):
+                continue  # prepared by its worker, once that one is done
+            obj = self.listbox.getLLSObjectByPath(path)
+            logger.debug(f"Preparing upcoming item: {path}")
+            self.preparedItems[path] = self.prepPool.submit(
+                workers.prepare_item, obj, opts, use_gpu=False
+            )
+
+    def discard_prepared_items(self):
+        for path, future in self.preparedItems.items():
+            workers.discard_prepared_item(future)
+            if not future.done():
+                self.discardedItems[path] = future
+        self.preparedItems = {}
+
+    def running_discarded_item(self, path):
+        """Future of a discarded preparation of path that is still running"""
+        future = self.discardedItems.get(path)
+        if future is not None and future.done():
+            del self.discardedItems[path]
+            future = None
+        return future
+        # discarded preparations that may still be writing Corrected folders
+        self.discardedItems = {}
+
     def disableProcessButton(self):
         # turn Process button into a Cancel button and udpate menu items
         self.processButton.clicked.disconnect()
@@ -1356,6 +1510,7 @@ class main_GUI(QtW.QMainWindow, Ui_Main_GUI, RegistrationTab):
         self.clock.display("00:00:00")
         self.inProcess = False
         self.aborted = False
+        self.discard_prepared_items()
         logger.info("Processing Finished")
         self.enableProcessButton()
 
@@ -1398,6 +1553,7 @@ class main_GUI(QtW.QMainWindow, Ui_Main_GUI, RegistrationTab):
     def abort_workers(self):
         self.statusBar.showMessage("Aborting ...")
         logger.info("Message sent to abort ...")
+        self.discard_prepared_items()
         if len(self.LLSItemThreads):
             self.aborted = True
             self.sig_abort_LLSworkers.emit()
@@ -1889,6 +2045,8 @@ The cudaDeconv deconvolution program was written by Lin Shao and by Dan Milkie a
             guisave(self, sessionSettings)
         sessionSettings.setValue("cleanExit", True)
         sessionSettings.sync()
+        self.listbox.cancelScans()
+        self.discard_prepared_items()
         QtW.QApplication.quit()
 
 
@@ -2,19 +2,16 @@ import fnmatch
 import logging
 import os
 import os.path as osp
-import time
+import threading
 
 import numpy as np
 from qtpy import QtCore
 
 import llspy
+from llspy.completion import CompletionTracker
 from llspy.gui import workers
-from llspy.gui.helpers import (
-    newWorkerThread,
-    shortname,
-    wait_for_file_close,
-    wait_for_folder_finished,
-)
+from llspy.gui.helpers import newWorkerThread, shortname
+from llspy.tiffio import AsyncTiffWriter
 
 _watchdog = False
 ActiveWatcher = None
@@ -52,14 +49,15 @@ if _watchdog:
             self.path = path
             self.timeout = timeout  # seconds to wait for new file before giving up
             self.inProcess = False
-            settext = llspy.util.find_filepattern(path, "*Settings.txt")
-            wait_for_file_close(settext)
-            time.sleep(1)  # give the settings file a minute to write
+            # MainHandler only reports the folder once Settings.txt is written
             self.E = llspy.LLSdir(path, False)
             # TODO:  probably need to check for files that are already there
             self.tQueue = []
             self.allReceived = False
             self.worker = None
+            # processed stacks are written in the background so that the next
+            # timepoint can start processing while the previous one is saved
+            self.writer = AsyncTiffWriter()
 
             try:
                 app = QtCore.QCoreApplication.instance()
@@ -76,22 +74,22 @@ if _watchdog:
             self.timer.start(self.timeout * 1000)
 
             # Too strict?
-            fpattern = r"^.+_ch\d_stack\d{4}_\D*\d+.*_\d{7}msec_\d{10}msecAbs.*.tif"
+            fpattern = r"^.+_ch\d_stack\d{4}_\D*\d+.*_\d{7,10}msec_\d{10}msecAbs.*.tif"
             # fpattern = '.*.tif'
-            handler = ActiveHandler(
+            self.handler = ActiveHandler(
                 str(self.E.path),
                 self.E.parameters.nc,
                 self.E.parameters.nt,
                 regexes=[fpattern],
                 ignore_directories=True,
             )
-            handler.tReady.connect(self.add_ready)
-            handler.allReceived.connect(self.all_received)
-            handler.newfile.connect(self.newfile)
-            handler.check_for_existing_files()
+            self.handler.tReady.connect(self.add_ready)
+            self.handler.allReceived.connect(self.all_received)
+            self.handler.newfile.connect(self.newfile)
+            self.handler.check_for_existing_files()
 
             self.observer = Observer()
-            self.observer.schedule(handler, self.path, recursive=False)
+            self.observer.schedule(self.handler, self.path, recursive=False)
             self.observer.start()
 
             logger.info("New LLS directory now being watched: " + self.path)
@@ -160,7 +158,7 @@ if _watchdog:
                 basename = os.path.basename(self.E.get_files(c=c, t=t)[0])
                 filename = basename.replace(".tif", corstring + proctype + ".tif")
                 outpath = str(self.E.path.joinpath(outfolder, filename))
-                llspy.util.imsave(
+                self.writer.submit(
                     llspy.util.reorderstack(np.squeeze(s), "zyx"),
                     outpath,
                     dx=self.E.parameters.dx,
@@ -198,27 +196,104 @@ if _watchdog:
             logger.debug("TERMINATING WATCHER")
             self.observer.stop()
             self.observer.join()
+            self.handler.tracker.stop()
+            try:
+                self.writer.close()
+            except Exception as e:
+                logger.error(f"Error writing processed files: {e}")
             self.finished.emit()
 
     class MainHandler(events.FileSystemEventHandler, QtCore.QObject):
+        """Report new LLS folders in the watched directory.
+
+        foundLLSdir is emitted as soon as the Settings.txt file of a new
+        folder has been written (i.e. when an acquisition starts).
+        finishedLLSdir is emitted once every file in that folder has been
+        completely written and no new file has appeared for ``settle``
+        seconds (i.e. when a finished folder has been copied in).
+        """
+
         foundLLSdir = QtCore.Signal(str)
+        finishedLLSdir = QtCore.Signal(str)
         lostListItem = QtCore.Signal(str)
 
-        def __init__(self):
+        def __init__(self, settle=2.0):
             super().__init__()
+            self.settle = settle
+            self._lock = threading.Lock()
+            self.pending = {}  # folder -> files not completely written yet
+            self.timers = {}  # folder -> threading.Timer before finishedLLSdir
+            self.tracker = CompletionTracker(self.file_complete)
+            self.tracker.start()
 
         def on_created(self, event):
             # Called when a file or directory is created.
             if event.is_directory:
-                pass
-            else:
-                if "Settings.txt" in event.src_path:
-                    wait_for_folder_finished(osp.dirname(event.src_path))
-                    self.foundLLSdir.emit(osp.dirname(event.src_path))
+                return
+            folder = osp.dirname(event.src_path)
+            if "Settings.txt" in event.src_path:
+                with self._lock:
+                    self.pending.setdefault(folder, set())
+                # files copied in before the settings file count as well
+                for f in os.listdir(folder):
+                    if osp.isfile(osp.join(folder, f)):
+                        self.watch_file(osp.join(folder, f))
+            elif folder in self.pending:
+                self.watch_file(event.src_path)
+
+        def on_closed(self, event):
+            self.tracker.closed(event.src_path)
+
+        def watch_file(self, path):
+            folder = osp.dirname(path)
+            with self._lock:
+                self.pending.setdefault(folder, set()).add(path)
+                timer = self.timers.pop(folder, None)
+            if timer is not None:
+                timer.cancel()
+            self.tracker.watch(path)
+
+        def file_complete(self, path):
+            folder = osp.dirname(path)
+            if "Settings.txt" in path:
+                self.foundLLSdir.emit(folder)
+            self.file_done(path)
+
+        def file_done(self, path):
+            folder = osp.dirname(path)
+            with self._lock:
+                pending = self.pending.get(folder)
+                if pending is None:
+                    return
+                pending.discard(path)
+                if pending or folder in self.timers:
+                    return
+                timer = threading.Timer(self.settle, self.folder_quiet, (folder,))
+                timer.daemon = True
+                self.timers[folder] = timer
+            timer.start()
+
+        def folder_quiet(self, folder):
+            with self._lock:
+                if self.timers.get(folder) is not threading.current_thread():
+                    return  # a new file appeared in the meantime
+                del self.timers[folder]
+                del self.pending[folder]
+            self.finishedLLSdir.emit(folder)
+
+        def stop(self):
+            self.tracker.stop()
+            with self._lock:
+                for timer in self.timers.values():
+                    timer.cancel()
+                self.timers = {}
 
         def on_deleted(self, event):
             # Called when a file or directory is created.
-            if event.is_directory:
+            if not event.is_directory:
+                self.tracker.discard(event.src_path)
+                self.file_done(event.src_path)
+            else:
                 app = QtCore.QCoreApplication.instance()
                 gui = next(
                     w for w in app.topLevelWidgets() if w.objectName == "main_GUI"
@@ -240,6 +315,15 @@ if _watchdog:
             self.nT = nT
             # this assumes the experiment hasn't been stopped mid-stream
             self.counter = np.zeros(self.nT)
+            # raw stacks all have the same size: learned from the first one
+            self.size_raw = None
+            self._lock = threading.Lock()
+            # files are counted once they are completely written, without
+            # blocking the watchdog thread while they are
+            self.tracker = CompletionTracker(
+                self.file_complete, expected_size=lambda path: self.size_raw
+            )
+            self.tracker.start()
 
         def check_for_existing_files(self):
             # this is here in case files already exist in the directory...
@@ -253,20 +337,33 @@ if _watchdog:
             # Called when a file or directory is created.
             self.register_file(event.src_path)
 
+        def on_closed(self, event):
+            # Called when a file opened for writing is closed (inotify only)
+            self.tracker.closed(event.src_path)
+
+        def on_deleted(self, event):
+            self.tracker.discard(event.src_path)
+
         def register_file(self, path):
             self.newfile.emit(path)
+            self.tracker.watch(path)
+
+        def file_complete(self, path):
+            # called from the tracker's poller and from the watchdog thread
             p = llspy.parse.parse_filename(osp.basename(path))
-            self.counter[p["stack"]] += 1
-            ready = np.where(self.counter == self.nC)[0]
-            # break counter for those timepoints
-            self.counter[ready] = np.nan
+            with self._lock:
+                if self.size_raw is None:
+                    self.size_raw = osp.getsize(path)
+                self.counter[p["stack"]] += 1
+                ready = np.where(self.counter == self.nC)[0]
+                # break counter for those timepoints
+                self.counter[ready] = np.nan
+                finished = all(np.isnan(self.counter))
             # can use <100 as a sign of timepoints still not finished
             if len(ready):
-                # try to see if file has finished writing... does this work?
-                wait_for_file_close(path)
                 [self.tReady.emit(t) for t in ready]
 
             # once all nC * nT has been seen emit allReceived
-            if all(np.isnan(self.counter)):
+            if finished:
                 logger.debug("All Timepoints Received")
                 self.allReceived.emit()
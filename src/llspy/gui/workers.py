@@ -1,15 +1,19 @@
-import json
+import copy
 import logging
 import os
 import shutil
 import sys
 import tarfile
+from collections import deque
+from concurrent.futures import wait
 
 import numpy as np
 from qtpy import QtCore
 
 import llspy
 import llspy.gui.exceptions as err
+import llspy.llsdir
+import llspy.metrics
 from llspy.gui.helpers import byteArrayToString, newWorkerThread, shortname
 
 logger = logging.getLogger(__name__)  # set root logger
@@ -290,8 +294,13 @@ class CompressionWorker(SubprocessWorker):
 #         self.finished.emit()
 
 
-def divide_arg_queue(E, n_gpus, binary):
-    """generate all the channel specific cudaDeconv arguments for this item."""
+def divide_arg_queue(E, n_gpus, binary, chunks_per_gpu=4):
+    """generate all the channel specific cudaDeconv arguments for this item.
+
+    With multiple GPUs, the timepoints of each channel are split into
+    ``chunks_per_gpu`` chunks per GPU, so that a :class:`DeviceWorkQueue` can
+    keep faster GPUs busy with more chunks than slower ones.
+    """
     argQueue = []
 
     def split(a, n):
@@ -314,7 +323,10 @@ def divide_arg_queue(E, n_gpus, binary):
         # then split the work across GPUs by processing each channel,
         # diving time across the available GPUS
         if n_gpus <= n_time:
-            tRanges = list(split(P.tRange, n_gpus))
+            # (each chunk is a separate cudaDeconv call, so don't bother
+            # splitting when there is only one GPU)
+            n_chunks = min(n_time, n_gpus * chunks_per_gpu) if n_gpus > 1 else 1
+            tRanges = list(split(P.tRange, n_chunks))
 
             for tRange in tRanges:
                 # filter by channel and trange
@@ -338,6 +350,167 @@ def divide_arg_queue(E, n_gpus, binary):
     return argQueue
 
 
+class DeviceWorkQueue:
+    """Queue of work items, handed to whichever device becomes free first.
+
+    >>> queue = DeviceWorkQueue(argsets, devices=[0, 1])
+    >>> for device, args in queue.start():
+    ...     launch(device, args)
+    >>> # ... later, when the job on a device has finished:
+    >>> args = queue.task_done(device)
+    >>> if args is not None:
+    ...     launch(device, args)
+    """
+
+    def __init__(self, items=(), devices=()):
+        self.pending = deque(items)
+        self.devices = list(devices)
+        self.busy = {}  # device -> item currently running on it
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _assign(self, device):
+        if not self.pending:
+            return None
+        item = self.pending.popleft()
+        self.busy[device] = item
+        return item
+
+    def start(self):
+        """assign an item to every idle device, returns [(device, item), ...]"""
+        started = []
+        for device in self.devices:
+            if device not in self.busy and self.pending:
+                started.append((device, self._assign(device)))
+        return started
+
+    def task_done(self, device):
+        """mark the job on device done, returns the next item for it (or None)"""
+        self.busy.pop(device, None)
+        return self._assign(device)
+
+    def clear(self):
+        """drop all pending items (running ones are unaffected)"""
+        self.pending.clear()
+
+    @property
+    def all_done(self):
+        return not self.pending and not self.busy
+
+
+class PreparedItem:
+    """An LLS folder after the CPU-only steps of processing.
+
+    See :func:`prepare_item`.
+    """
+
+    def __init__(self, E):
+        self.source = E  # the LLSdir in the processing queue
+        self.E = E  # what to process: a copy, or a staged copy with scratch
+        self.metrics = llspy.metrics.Recorder(experiment=getattr(E, "basename", None))
+        self.P = None
+        self.staged = None
+        self.ready = False
+        self.corrected = False
+
+
+def prepare_item(E, opts, status=None, use_gpu=True):
+    """Do the CPU part of processing an LLSdir, before deconvolution.
+
+    Decompresses the raw data, builds the processing parameters, stages the
+    folder in the scratch directory (if any), and does the flash correction or
+    median filter and trimming with :func:`correct_item` (unless they are
+    done by the streaming pipeline).  The correction works on a copy of E
+    (``item.E``), so E itself always keeps pointing at the experiment folder.
+
+    Doesn't touch any Qt objects, so the main window can run it for upcoming
+    items while the current item is deconvolved.  With ``use_gpu=False``, a
+    flash correction on the GPU is left for the worker to do with
+    :func:`correct_item` (libcudaDecon is in use by the current item).
+
+    Args:
+        E (LLSdir): the folder to prepare
+        opts (dict): processing options
+        status (callable): optionally called with status messages
+        use_gpu (bool): whether the flash correction may run on the GPU
+
+    Returns:
+        PreparedItem: with ``ready == False`` if the folder can't be processed
+    """
+    status = status or logger.info
+    item = PreparedItem(E)
+    if E.is_compressed():
+        status(f"Decompressing {E.basename}")
+        with item.metrics.span("decompress"):
+            E.decompress()
+
+    if not E.ready_to_process:
+        if not E.has_lls_tiffs:
+            logger.warning(f"No TIFF files to process in {E.path}")
+        if not E.parameters.isReady():
+            logger.warning(f"Incomplete parameters for: {E.path}")
+        return item
+
+    # this needs to go here instead of __init__ in case folder is compressed
+    item.P = P = E.localParams(**opts)
+    if P.writeLog:
+        item.metrics.set_path(llspy.llsdir.metrics_path(E))
+
+    # stage intermediates in the scratch directory, if there is one
+    item.staged = llspy.scratch.stage(E, P)
+    item.E = item.staged.exp if item.staged else copy.copy(E)
+    item.ready = True
+
+    if P.correctFlash and P.flashCorrectTarget in ("cuda", "gpu") and not use_gpu:
+        return item
+    try:
+        correct_item(item, status)
+    except Exception:
+        discard_prepared_item(item)
+        raise
+    return item
+
+
+def correct_item(item, status=None):
+    """Flash correction or median filter and trimming of a prepared item.
+
+    Writes the Corrected folder and points ``item.E`` to it.
+    """
+    status = status or logger.info
+    P = item.P
+    item.corrected = True
+    if llspy.pipeline.should_stream(P):
+        return  # corrected while streaming
+    if P.correctFlash:
+        status(f"Correcting Flash artifact on {item.E.basename}")
+        with item.metrics.span("correct"):
+            item.E.path = item.E.correct_flash(**P)
+    # if not flash correcting but there is trimming/median filter requested
+    elif P.medianFilter or any(any(i) for i in (P.trimX, P.trimY, P.trimZ)):
+        with item.metrics.span("correct"):
+            item.E.path = item.E.median_and_trim(**P)
+
+
+def discard_prepared_item(item):
+    """Clean up a prepared item that will not be processed.
+
+    Accepts a PreparedItem or a Future of one (which is cancelled, or
+    cleaned up once it is done).
+    """
+    if hasattr(item, "add_done_callback"):
+
+        def discard(future):
+            if future.exception() is None:
+                discard_prepared_item(future.result())
+
+        if not item.cancel():
+            item.add_done_callback(discard)
+    elif item.staged:
+        item.staged.cleanup()
+        item.staged = None
+
+
 class LLSitemWorker(QtCore.QObject):
     sig_starting_item = QtCore.Signal(str, int)  # item path, numfiles
 
@@ -353,7 +526,11 @@ class LLSitemWorker(QtCore.QObject):
     error = QtCore.Signal()
     skipped = QtCore.Signal(str)
 
-    def __init__(self, lls_dir, wid, opts, **kwargs):
+    def __init__(self, lls_dir, wid, opts, prepared=None, after=None, **kwargs):
+        """prepared is an optional Future of :func:`prepare_item` for lls_dir,
+        started ahead of time by the main window.  after is an optional
+        Future (e.g. a discarded preparation of the same folder that is
+        still running) to wait for before starting."""
         super().__init__()
 
         if isinstance(lls_dir, llspy.LLSdir):
@@ -365,9 +542,15 @@ class LLSitemWorker(QtCore.QObject):
 
         self.__id = int(wid)
         self.opts = opts
+        self.prepared = prepared
+        self.after = after
+        self.staged = None  # llspy.scratch.ScratchStage, when using scratch
+        self.metrics = llspy.metrics.Recorder(experiment=self.E.basename)
+        self._decon_span = None
         self.shortname = shortname(self.path)
         self.aborted = False
-        self.__argQueue = []  # holds all argument lists that will be sent to threads
+        # holds all argument lists that will be sent to threads
+        self.__argQueue = DeviceWorkQueue()
         self.GPU_SET = QtCore.QCoreApplication.instance().gpuset
         self.__CUDAthreads = {gpu: None for gpu in self.GPU_SET}
         if not len(self.GPU_SET):
@@ -378,26 +561,34 @@ class LLSitemWorker(QtCore.QObject):
 
     @QtCore.Slot()
     def work(self):
-        if self.E.is_compressed():
-            self.status_update.emit(f"Decompressing {self.E.basename}")
-            self.E.decompress()
-
-        if not self.E.ready_to_process:
-            if not self.E.has_lls_tiffs:
-                self._logger.warning(f"No TIFF files to process in {self.path}")
-            if not self.E.parameters.isReady():
-                self._logger.warning(f"Incomplete parameters for: {self.path}")
-                self.skipped.emit(self.path)
-            return
-
-        # this needs to go here instead of __init__ in case folder is compressed
         try:
-            self.P = self.E.localParams(**self.opts)
+            if self.after is not None:
+                wait([self.after])
+            if self.prepared is not None:
+                # prepared while the previous item was being processed
+                item = self.prepared.result()
+                if item.ready and not item.corrected:
+                    correct_item(item, self.status_update.emit)
+            else:
+                item = prepare_item(self.E, self.opts, self.status_update.emit)
         except Exception:
             self.error.emit()
             self.finished.emit()
             raise
 
+        if not item.ready:
+            if not self.E.parameters.isReady():
+                self.skipped.emit(self.path)
+            return
+
+        self.P = item.P
+        self.staged = item.staged
+        self.metrics = item.metrics
+        # item.E is a copy of self.E, pointing at the Corrected folder (or at
+        # the scratch directory) while processing
+        self._source = self.E
+        self.E = item.E
+
         # we process one folder at a time. Progress bar updates per Z stack
         # so the maximum is the total number of timepoints * channels
         self.nFiles = len(self.P.tRange) * len(self.P.cRange)
@@ -408,20 +599,9 @@ class LLSitemWorker(QtCore.QObject):
         self._logger.debug(f"Full path {self.path}")
         self._logger.debug(f"Parameters {self.E.parameters}\n")
 
-        if self.P.correctFlash:
-            try:
-                self.status_update.emit(
-                    f"Correcting Flash artifact on {self.E.basename}"
-                )
-                self.E.path = self.E.correct_flash(**self.P)
-            except llspy.llsdir.LLSpyError:
-                self.error.emit()
-                raise
-        # if not flash correcting but there is trimming/median filter requested
-        elif self.P.medianFilter or any(
-            any(i) for i in (self.P.trimX, self.P.trimY, self.P.trimZ)
-        ):
-            self.E.path = self.E.median_and_trim(**self.P)
+        if llspy.pipeline.should_stream(self.P):
+            self.stream_process()
+            return
 
         self.nFiles_done = 0
         self.progressValue.emit(0)
@@ -433,12 +613,14 @@ class LLSitemWorker(QtCore.QObject):
         if self.P.nIters > 0 or (self.P.deskew != 0 and self.P.saveDeskewedRaw):
             try:
                 # check the binary path and create object
-                binary = llspy.cudabinwrapper.CUDAbin(_CUDABIN)
+                binary = llspy.cudabinwrapper.get_cudabin(_CUDABIN)
             except Exception:
                 self.error.emit()
                 raise
 
-            self.__argQueue = divide_arg_queue(self.E, len(self.GPU_SET), binary)
+            self.__argQueue = DeviceWorkQueue(
+                divide_arg_queue(self.E, len(self.GPU_SET), binary), self.GPU_SET
+            )
 
             # with the argQueue populated, we can now start the workers
             if not len(self.__argQueue):
@@ -456,45 +638,56 @@ class LLSitemWorker(QtCore.QObject):
         self.timer = QtCore.QTime()
         self.timer.restart()
 
+    def stream_process(self):
+        """correct, deconvolve and save in memory, without cudaDeconv"""
+        self.nFiles_done = 0
+        self.progressValue.emit(0)
+        self.progressMaxVal.emit(self.nFiles)
+        self.status_update.emit(f"Processing {self.E.basename}: (0 of {self.nFiles})")
+        self.timer = QtCore.QTime()
+        self.timer.restart()
+        try:
+            with self.metrics.span("stream", files=self.nFiles):
+                llspy.pipeline.stream_process(
+                    self.E, self.P, callback=lambda path: self.on_file_finished()
+                )
+        except Exception:
+            self.error.emit()
+            self.finished.emit()
+            raise
+        self.post_process()
+
     def startCUDAWorkers(self):
-        # initialize the workers and threads
-
-        for gpu in self.GPU_SET:
-            # create new CUDAworker for every thread
-            # each CUDAworker will control one cudaDeconv process (which only gets
-            # one wavelength at a time)
-
-            # grab the next arguments from the queue
-            # THIS BREAKS the relationship between num_cuda_threads
-            # and self.__CUDAworkers_done...
-            # if len(self.__argQueue)== 0:
-            #   return
-            if not len(self.__argQueue):
-                return
-            args = self.__argQueue.pop(0)
-
-            CUDAworker, thread = newWorkerThread(
-                CudaDeconvWorker,
-                args,
-                {"CUDA_VISIBLE_DEVICES": gpu},
-                wid=gpu,
-                workerConnect={
-                    # get progress messages from CUDAworker and pass to parent
-                    "file_finished": self.on_file_finished,
-                    "finished": self.on_CUDAworker_done,
-                    # any messages go straight to the log window
-                    # 'error': self.errorstring  # implement error signal?
-                },
-            )
+        self._decon_span = self.metrics.span("deconvolve", files=self.nFiles)
+        # start a CUDAworker on every idle gpu
+        for gpu, args in self.__argQueue.start():
+            self.startCUDAWorker(gpu, args)
+
+    def startCUDAWorker(self, gpu, args):
+        # each CUDAworker controls one cudaDeconv process (which only gets
+        # one wavelength at a time)
+        CUDAworker, thread = newWorkerThread(
+            CudaDeconvWorker,
+            args,
+            {"CUDA_VISIBLE_DEVICES": gpu},
+            wid=gpu,
+            workerConnect={
+                # get progress messages from CUDAworker and pass to parent
+                "file_finished": self.on_file_finished,
+                "finished": self.on_CUDAworker_done,
+                # any messages go straight to the log window
+                # 'error': self.errorstring  # implement error signal?
+            },
+        )
 
-            # need to store worker too otherwise will be garbage collected
-            self.__CUDAthreads[gpu] = (thread, CUDAworker)
+        # need to store worker too otherwise will be garbage collected
+        self.__CUDAthreads[gpu] = (thread, CUDAworker)
 
-            # connect mainGUI abort CUDAworker signal to the new CUDAworker
-            self.sig_abort.connect(CUDAworker.abort)
+        # connect mainGUI abort CUDAworker signal to the new CUDAworker
+        self.sig_abort.connect(CUDAworker.abort)
 
-            # start the thread
-            thread.start()
+        # start the thread
+        thread.start()
 
     @QtCore.Slot()
     def on_file_finished(self):
@@ -521,17 +714,20 @@ class LLSitemWorker(QtCore.QObject):
         thread.wait()
         self.__CUDAthreads[worker_id] = None
 
-        # FIXME:  this forces all GPUs to be done before ANY can continue
-        # ... only as fast as the slowest GPU
-        # could probably fix easily by delivering a value to startCudaWorkers
-        # instead of looping through gpu inside of it
-        if not any(v for v in self.__CUDAthreads.values()):
-            # if there's still stuff left in the argQueue for this item, keep going
+        # hand the next chunk to this (now idle) gpu, so that faster gpus
+        # aren't kept waiting for slower ones
+        args = self.__argQueue.task_done(worker_id)
+        if args is not None and not self.aborted:
+            self.startCUDAWorker(worker_id, args)
+        elif not any(v for v in self.__CUDAthreads.values()):
+            self._decon_span.stop("aborted" if self.aborted else None)
             if self.aborted:
                 self.aborted = False
+                if self.staged:
+                    self.staged.cleanup()
+                    self.staged = None
+                self.E = self._source
                 self.finished.emit()
-            elif len(self.__argQueue):
-                self.startCUDAWorkers()
             # otherwise send the signal that this item is done
             else:
                 self.post_process()
@@ -539,20 +735,30 @@ class LLSitemWorker(QtCore.QObject):
     def post_process(self):
         if self.P.doReg:
             self.status_update.emit(f"Doing Channel Registration: {self.E.basename}")
-            try:
-                self.E.register(
-                    self.P.regRefWave,
-                    self.P.regMode,
-                    self.P.regCalibPath,
-                    discard=self.P.deleteUnregistered,
+
+            def on_registered(path):
+                self.status_update.emit(
+                    f"Registered {self.E.basename}: {os.path.basename(path)}"
                 )
+
+            try:
+                with self.metrics.span("register"):
+                    self.E.register(
+                        self.P.regRefWave,
+                        self.P.regMode,
+                        self.P.regCalibPath,
+                        discard=self.P.deleteUnregistered,
+                        callback=on_registered,
+                        mergeMIPs=self.P.mergeMIPs,
+                    )
             except Exception:
                 self._logger.error("REGISTRATION FAILED")
                 raise
 
         if self.P.mergeMIPs:
             self.status_update.emit(f"Merging MIPs: {self.E.basename}")
-            self.E.mergemips()
+            with self.metrics.span("mergemips"):
+                self.E.mergemips()
         else:
             for mipfile in self.E.path.glob("**/*comboMIP_*"):
                 mipfile.unlink()  # clean up any combo MIPs from previous runs
@@ -572,17 +778,20 @@ class LLSitemWorker(QtCore.QObject):
         if not self.P.keepCorrected:
             shutil.rmtree(str(self.E.path.joinpath("Corrected")), ignore_errors=True)
 
+        if self.staged:
+            # copy the outputs back to the experiment folder in the background
+            self.staged.finish()
+            self.staged = None
+        self.E = self._source
+
         if self.P.compressRaw:
             self.status_update.emit(f"Compressing Raw: {self.E.basename}")
-            self.E.compress()
+            with self.metrics.span("compress"):
+                self.E.compress()
 
         if self.P.writeLog:
-            outname = str(
-                self.E.path.joinpath(f"{self.E.basename}_{llspy.config.__OUTPUTLOG__}")
-            )
             try:
-                with open(outname, "w") as outfile:
-                    json.dump(self.P, outfile, cls=llspy.util.paramEncoder)
+                llspy.llsdir.write_processing_log(self.E, self.P, self.metrics)
             except FileNotFoundError:
                 self._logger.error("Could not write processing log file.")
 
@@ -593,7 +802,7 @@ class LLSitemWorker(QtCore.QObject):
         self._logger.info(f"LLSworker #{self.__id} notified to abort")
         if any(v for v in self.__CUDAthreads.values()):
             self.aborted = True
-            self.__argQueue = []
+            self.__argQueue.clear()
             self.sig_abort.emit()
         # self.processButton.setDisabled(True) # will be reenabled when workers done
         else:
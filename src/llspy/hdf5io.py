@@ -0,0 +1,151 @@
+"""Chunked HDF5 output of processed data.
+
+:class:`HDF5Writer` writes every processed stack of an experiment into one
+HDF5 file, instead of one tiff file per stack, with one TCZYX dataset per
+output folder::
+
+    cell1/cell1_processed.h5
+        /GPUdecon    # (T, C, Z, Y, X), one chunk per stack
+        /Deskewed
+        /Corrected
+
+Datasets are chunked per stack (timepoint and channel), resizable along T and
+C, so stacks can be appended as they are produced, and optionally compressed.
+HDF5 filters run under the global lock of h5py, so the chunks are compressed
+by the writer threads themselves (in parallel, zlib releases the GIL) and
+written with ``write_direct_chunk``: the file is a regular gzip-filtered HDF5
+file that any HDF5 reader (h5py, Fiji's HDF5 plugins, ...) can read.  Like :class:`~llspy.zarrio.ZarrWriter`, it is a drop-in replacement for
+:class:`~llspy.tiffio.AsyncTiffWriter` (see
+:class:`~llspy.tiffio.ChunkedWriter`), selected with the ``outputFormat``
+processing option.
+
+Reading a single stack only reads its chunk::
+
+    >>> util.readHDF5Frame("cell1/cell1_processed.h5", (10, 0), "GPUdecon")
+
+Requires the optional ``h5py`` package.
+"""
+
+import logging
+import threading
+import zlib
+
+import numpy as np
+
+from .tiffio import ChunkedWriter
+
+logger = logging.getLogger(__name__)
+
+
+def _import_h5py():
+    try:
+        import h5py
+    except ImportError as e:
+        raise ImportError("The hdf5 output format requires h5py") from e
+    return h5py
+
+
+def encode_chunk(stack, compression="gzip", level=4, shuffle=True):
+    """Bytes of a chunk holding the whole stack, as the HDF5 shuffle and
+    deflate filters would write it."""
+    data = np.ascontiguousarray(stack)
+    if compression is None:
+        return data.tobytes()
+    if shuffle and data.itemsize > 1:
+        data = data.view(np.uint8).reshape(-1, data.itemsize).T
+    return zlib.compress(np.ascontiguousarray(data).tobytes(), level)
+
+
+class HDF5Writer(ChunkedWriter):
+    """Write processed stacks to the TCZYX datasets of an HDF5 file.
+
+    Args:
+        path (str): HDF5 file, created if necessary (existing datasets are
+            added to)
+        dt (float): time interval, for the metadata
+        compression (str): "gzip", or None for uncompressed chunks
+        level (int): gzip compression level
+        shuffle (bool): byte-shuffle before compression (which helps with 16
+            and 32 bit data)
+        **kwargs: timepoints, channels and fpattern of
+            :class:`~llspy.tiffio.ChunkedWriter`, and the AsyncTiffWriter
+            options
+    """
+
+    def __init__(self, path, dt=1, compression="gzip", level=4, shuffle=True, **kwargs):
+        if compression not in (None, "gzip"):
+            raise ValueError(f"Unsupported compression: {compression}")
+        h5py = _import_h5py()
+        self.path = str(path)
+        self.file = h5py.File(self.path, "a")
+        self.dt = dt
+        self.compression = compression
+        self.level = level
+        self.shuffle = shuffle and compression is not None
+        self._file_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def _dataset(self, image, shape, dtype, dx, dz):
+        """the dataset of image, created or grown to fit shape"""
+        if image not in self.file:
+            dset = self.file.create_dataset(
+                image,
+                shape=shape,
+                dtype=dtype,
+                chunks=(1, 1, *shape[2:]),
+                maxshape=(None, None, *shape[2:]),
+                compression=self.compression,
+                compression_opts=self.level if self.compression else None,
+                shuffle=self.shuffle,
+                fillvalue=0,
+            )
+            dset.attrs["axes"] = "TCZYX"
+            dset.attrs["element_size_um"] = (dz, dx, dx)
+            dset.attrs["interval"] = self.dt
+            return dset
+        dset = self.file[image]
+        if dset.shape[2:] != shape[2:]:
+            raise ValueError(
+                f"Cannot write a stack of shape {shape[2:]} to {image} "
+                f"of shape {dset.shape[2:]}"
+            )
+        if any(n > m for n, m in zip(shape[:2], dset.shape[:2])):
+            grown = tuple(max(n, m) for n, m in zip(shape[:2], dset.shape))
+            dset.resize((*grown, *dset.shape[2:]))
+        return dset
+
+    def write_stack(self, image, stack, t, c, dx=1, dz=1):
+        """Write the ZYX stack of timepoint t and channel c to image."""
+        stack, ti, ci, shape = self.locate(stack, t, c)
+        with self._file_lock:
+            dtype = self.file[image].dtype if image in self.file else stack.dtype
+        # compressed here, in parallel, rather than by the filters
+        chunk = encode_chunk(
+            stack.astype(dtype, copy=False), self.compression, self.level, self.shuffle
+        )
+        with self._file_lock:
+            dset = self._dataset(image, shape, dtype, dx, dz)
+            if dset.dtype != dtype:  # created by another thread meanwhile
+                chunk = encode_chunk(
+                    stack.astype(dset.dtype), self.compression, self.level, self.shuffle
+                )
+            dset.id.write_direct_chunk((ti, ci, 0, 0, 0), chunk)
+
+    def close_store(self):
+        with self._file_lock:
+            self.file.close()
+
+
+def open_image(path, image="GPUdecon"):
+    """TCZYX h5py dataset of an image in a file written by :class:`HDF5Writer`.
+
+    Indexing it reads (and decompresses) only the chunks that are needed.
+    The file stays open as long as the dataset is referenced.
+    """
+    h5py = _import_h5py()
+    f = h5py.File(str(path), "r")
+    if image not in f:
+        found = list(f)
+        f.close()
+        raise KeyError(f"No {image} image in {path}, found: {found}")
+    return f[image]
@@ -0,0 +1,153 @@
+"""Registry of the numba-compiled kernels used by llspy and fiducialreg.
+
+Kernels are declared with the :func:`kernel` decorator, which does not import
+numba.  They are compiled on their first call (or by :func:`warm_up`) with
+``cache=True``, so the machine code is written to disk once and later
+processes, including ``multiprocessing`` pool workers, load it instead of
+compiling again.  The signatures given to :func:`kernel` are the ones the
+processing code actually uses: :func:`warm_up` compiles (or loads) exactly
+those, while calls with other types still compile lazily.
+
+Warm-up runs in a background thread at CLI/GUI startup (:func:`start_warm_up`)
+and in the initializer of the CPU pools (:func:`pool_initializer`); set the
+environment variable ``LLSPY_JIT_WARMUP=0`` to disable it.  Without numba the
+kernels are plain python functions and warm-up does nothing.
+"""
+
+import functools
+import importlib
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+
+DEFAULT_OPTIONS = {"nopython": True, "nogil": True, "cache": True}
+
+
+def _lookup(name):
+    module, _, attr = name.rpartition(".")
+    return getattr(importlib.import_module(module), attr)
+
+
+class Kernel:
+    """A python function compiled with numba on first use.
+
+    Args:
+        func (callable): the python implementation.
+        signatures (tuple): numba signatures compiled by :meth:`compile`.
+        options: numba.jit options, on top of :data:`DEFAULT_OPTIONS`.
+    """
+
+    def __init__(self, func, signatures=(), **options):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.name = f"{func.__module__}.{func.__qualname__}"
+        self.signatures = tuple(signatures)
+        self.options = {**DEFAULT_OPTIONS, **options}
+        self._dispatcher = None
+        self._lock = threading.Lock()
+
+    def compile(self):
+        """Compile (or load from the cache) the kernel and its signatures."""
+        with self._lock:
+            if self._dispatcher is None:
+                try:
+                    import numba
+                except ImportError:
+                    self._dispatcher = self.func
+                    return self._dispatcher
+                dispatcher = numba.jit(**self.options)(self.func)
+                for sig in self.signatures:
+                    dispatcher.compile(sig)
+                self._dispatcher = dispatcher
+        return self._dispatcher
+
+    @property
+    def compiled(self):
+        return self._dispatcher is not None
+
+    def __call__(self, *args, **kwargs):
+        return (self._dispatcher or self.compile())(*args, **kwargs)
+
+    def __reduce__(self):
+        # pickled by name, like the plain function would be
+        return _lookup, (self.name,)
+
+    def __repr__(self):
+        return f"<Kernel {self.name}>"
+
+
+def kernel(*signatures, **options):
+    """Register the decorated function as a :class:`Kernel`.
+
+    Example::
+
+        @kernel("(f8[:], f8[:])")
+        def add(a, b):
+            return a + b
+    """
+
+    def deco(func):
+        k = Kernel(func, signatures, **options)
+        REGISTRY[k.name] = k
+        return k
+
+    return deco
+
+
+# modules defining kernels, imported by warm_up so that all of them register
+KERNEL_MODULES = ("llspy.camera", "llspy.camcalib", "fiducialreg.imwarp")
+
+
+def warm_up_enabled():
+    return os.environ.get("LLSPY_JIT_WARMUP", "1").lower() not in ("0", "false", "no")
+
+
+def warm_up(names=None):
+    """Compile the given kernels (all known kernels by default).
+
+    Args:
+        names (list): kernel names, e.g. ``"llspy.camera.calc_correction"``.
+
+    Returns:
+        list: names of the kernels that failed to compile.
+    """
+    if names is None:
+        for module in KERNEL_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError as e:
+                logger.debug(f"Not warming up {module}: {e}")
+        names = list(REGISTRY)
+    failed = []
+    for name in names:
+        try:
+            _lookup(name).compile()
+        except Exception as e:
+            logger.warning(f"Could not compile {name}: {e}")
+            failed.append(name)
+    return failed
+
+
+def start_warm_up(names=None):
+    """Run :func:`warm_up` in a daemon thread, unless disabled.
+
+    Returns:
+        threading.Thread: the warm-up thread, or None if warm-up is disabled.
+    """
+    if not warm_up_enabled():
+        return None
+    thread = threading.Thread(
+        target=warm_up, args=(names,), name="lls-jit-warmup", daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def pool_initializer(names=None):
+    """multiprocessing.Pool initializer warming up the kernels a pool uses."""
+    if warm_up_enabled():
+        warm_up(names)
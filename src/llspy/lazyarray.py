@@ -0,0 +1,245 @@
+"""Lazy, file-backed array views of LLS experiments.
+
+:class:`LLSArray` presents the raw stacks of an :class:`~llspy.llsdir.LLSdir`
+as a single TCZYX array without loading anything up front.  Indexing reads
+only the stacks that are needed, and reductions such as ``max`` are computed
+one stack at a time, so that very long timelapses can be scanned with a
+memory footprint of a few stacks.
+
+>>> E = llspy.LLSdir('path/to/experiment_directory')
+>>> A = E.as_array()
+>>> A.shape
+(500, 2, 65, 256, 512)
+>>> A[10, 0].shape  # reads a single stack
+(65, 256, 512)
+>>> mip = np.max(A, axis=2)  # TCYX max projection, one stack in memory at a time
+"""
+
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from . import util
+
+logger = logging.getLogger(__name__)
+
+_TCPATTERN = re.compile(r"_ch(\d+)_stack(\d{4})_")
+
+_REDUCTIONS = {
+    "max": np.maximum,
+    "min": np.minimum,
+    "sum": np.add,
+}
+
+
+def _normalize_axis(axis, ndim):
+    if axis is None:
+        return tuple(range(ndim))
+    if isinstance(axis, int):
+        axis = (axis,)
+    out = []
+    for ax in axis:
+        if not -ndim <= ax < ndim:
+            raise ValueError(
+                f"axis {ax} is out of bounds for array of dimension {ndim}"
+            )
+        out.append(ax % ndim)
+    return tuple(sorted(set(out)))
+
+
+def _index_list(key, length):
+    """convert an index into a (list of indices, keep dimension) tuple."""
+    if isinstance(key, slice):
+        return list(range(*key.indices(length))), True
+    if isinstance(key, (int, np.integer)):
+        if not -length <= key < length:
+            raise IndexError(
+                f"index {key} is out of bounds for axis with size {length}"
+            )
+        return [int(key) % length], False
+    idx = np.asarray(key)
+    if idx.dtype == bool:
+        idx = np.nonzero(idx)[0]
+    return [int(i) % length for i in idx.ravel()], True
+
+
+class LLSArray:
+    """Lazy TCZYX array backed by a set of ZYX tiff files.
+
+    Args:
+        files (dict): mapping of (t_index, c_index) -> path of each ZYX stack
+        shape (tuple): full (nT, nC, nZ, nY, nX) shape
+        dtype: numpy dtype of the stacks
+        cache_size (int): number of recently read stacks to keep
+        memmap (bool): memory-map uncompressed, contiguous tiffs instead of
+            decoding them into new arrays
+    """
+
+    def __init__(self, files, shape, dtype, cache_size=8, memmap=True):
+        self.files = files
+        self.shape = tuple(int(i) for i in shape)
+        self.dtype = np.dtype(dtype)
+        self.cache_size = cache_size
+        self.memmap = memmap
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_llsdir(cls, E, **kwargs):
+        """Create a lazy array from the raw tiffs of an LLSdir"""
+        if not E.tiff.raw:
+            raise ValueError(f"No raw tiffs to create array from in {E.path}")
+        tset = sorted(E.parameters.tset)
+        cset = sorted(E.parameters.channels.keys())
+        tindex = {t: i for i, t in enumerate(tset)}
+        cindex = {c: i for i, c in enumerate(cset)}
+        files = {}
+        for f in E.tiff.raw:
+            m = _TCPATTERN.search(str(f))
+            if m:
+                c, t = int(m.group(1)), int(m.group(2))
+                if t in tindex and c in cindex:
+                    files[(tindex[t], cindex[c])] = str(f)
+        dtype = np.dtype(f"uint{E.tiff.bit_depth or 16}")
+        shape = (len(tset), len(cset), *E.parameters.shape)
+        return cls(files, shape, dtype, **kwargs)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self):
+        return self.size * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f"<LLSArray shape={self.shape} dtype={self.dtype}>"
+
+    def get_stack(self, t, c):
+        """return the ZYX stack at (t, c) index, using the LRU cache"""
+        key = (t, c)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        path = self.files.get(key)
+        if path is None:
+            logger.debug(f"No file for stack (t={t}, c={c}), filling with zeros")
+            stack = np.zeros(self.shape[2:], self.dtype)
+        else:
+            stack = util.imread(path, memmap=self.memmap).reshape(self.shape[2:])
+        with self._lock:
+            self._cache[key] = stack
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return stack
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _expand_key(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            i = next(n for n, k in enumerate(key) if k is Ellipsis)
+            fill = (slice(None),) * (self.ndim - len(key) + 1)
+            key = key[:i] + fill + key[i + 1 :]
+        if len(key) > self.ndim:
+            raise IndexError("too many indices for array")
+        return key + (slice(None),) * (self.ndim - len(key))
+
+    def __getitem__(self, key):
+        key = self._expand_key(key)
+        tidx, tkeep = _index_list(key[0], self.shape[0])
+        cidx, ckeep = _index_list(key[1], self.shape[1])
+        zyxkey = key[2:]
+        out = None
+        for i, t in enumerate(tidx):
+            for j, c in enumerate(cidx):
+                sub = self.get_stack(t, c)[zyxkey]
+                if out is None:
+                    out = np.empty((len(tidx), len(cidx), *sub.shape), sub.dtype)
+                out[i, j] = sub
+        if out is None:
+            sub = np.empty(self.shape[2:], self.dtype)[zyxkey]
+            out = np.empty((len(tidx), len(cidx), *sub.shape), self.dtype)
+        if not ckeep:
+            out = out[:, 0]
+        if not tkeep:
+            out = out[0]
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        out = self[:]
+        return out.astype(dtype, copy=False) if dtype is not None else out
+
+    def _reduce(self, name, axis=None, keepdims=False, dtype=None):
+        """reduce over axis, one stack at a time"""
+        axes = _normalize_axis(axis, self.ndim)
+        zyxaxes = tuple(a - 2 for a in axes if a >= 2)
+        func = getattr(np, "sum" if name == "mean" else name)
+        combine = _REDUCTIONS["sum" if name == "mean" else name]
+        if name == "mean" and dtype is None:
+            dtype = np.float64
+        kwargs = {} if dtype is None or name in ("max", "min") else {"dtype": dtype}
+
+        out = None
+        for t in range(self.shape[0]):
+            for c in range(self.shape[1]):
+                r = func(self.get_stack(t, c), axis=zyxaxes, keepdims=True, **kwargs)
+                if out is None:
+                    nt = 1 if 0 in axes else self.shape[0]
+                    nc = 1 if 1 in axes else self.shape[1]
+                    out = np.empty((nt, nc, *r.shape), r.dtype)
+                    filled = np.zeros((nt, nc), bool)
+                idx = (0 if 0 in axes else t, 0 if 1 in axes else c)
+                if filled[idx]:
+                    combine(out[idx], r, out=out[idx])
+                else:
+                    out[idx] = r
+                    filled[idx] = True
+        if name == "mean":
+            out = out / np.prod([self.shape[a] for a in axes])
+        if not keepdims:
+            out = out.squeeze(axis=axes)
+            if out.ndim == 0:
+                out = out[()]
+        return out
+
+    def max(self, axis=None, keepdims=False):
+        return self._reduce("max", axis, keepdims)
+
+    def min(self, axis=None, keepdims=False):
+        return self._reduce("min", axis, keepdims)
+
+    def sum(self, axis=None, keepdims=False, dtype=None):
+        return self._reduce("sum", axis, keepdims, dtype)
+
+    def mean(self, axis=None, keepdims=False, dtype=None):
+        return self._reduce("mean", axis, keepdims, dtype)
+
+    def __array_function__(self, func, types, args, kwargs):
+        reducers = {
+            np.max: "max",
+            np.amax: "max",
+            np.min: "min",
+            np.amin: "min",
+            np.sum: "sum",
+            np.mean: "mean",
+        }
+        if func in reducers and args and args[0] is self:
+            return getattr(self, reducers[func])(*args[1:], **kwargs)
+        # anything else gets a fully loaded array
+        args = tuple(np.asarray(a) if isinstance(a, LLSArray) else a for a in args)
+        return func(*args, **kwargs)
@@ -2,6 +2,7 @@ import ctypes
 import logging
 import os
 import sys
+import threading
 
 import numpy as np
 
@@ -10,133 +11,166 @@ from .util import load_lib
 
 logger = logging.getLogger(__name__)
 
+# libcudaDecon keeps global state (e.g. between RL_init and RL_cleanup), so
+# threads sharing the library must hold this lock around their calls
+lock = threading.RLock()
 
-cudaLib = load_lib("libcudaDecon")
-
-if not cudaLib:
-    logger.error("Could not load libcudaDecon!  Read docs for more info")
-else:
-    try:
-        # Deskew is used when no decon is desired
-        # https://stackoverflow.com/questions/5862915/passing-numpy-arrays-to-a-c-function-for-input-and-output
-        Deskew_interface = cudaLib.Deskew_interface
-        Deskew_interface.restype = ctypes.c_int
-        Deskew_interface.argtypes = [
-            np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
-            ctypes.c_int,
-            ctypes.c_int,
-            ctypes.c_int,
-            ctypes.c_float,
-            ctypes.c_float,
-            ctypes.c_float,
-            np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
-            ctypes.c_int,
-            ctypes.c_int,
-            ctypes.c_float,
-        ]
+# libcudaDecon is loaded (and its interface bound to the names below) by
+# _load on first use, so that importing llspy does not pay for it
+_loaded = False
 
-        # Affine transformation
-        Affine_interface = cudaLib.Affine_interface
-        Affine_interface.restype = ctypes.c_int
-        Affine_interface.argtypes = [
-            np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
-            ctypes.c_int,
-            ctypes.c_int,
-            ctypes.c_int,
-            np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
-            np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
-        ]
 
-        # Affine transformation
-        Affine_interface_RA = cudaLib.Affine_interface_RA
-        Affine_interface_RA.restype = ctypes.c_int
-        Affine_interface_RA.argtypes = [
-            np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
-            ctypes.c_int,
-            ctypes.c_int,
-            ctypes.c_int,
-            ctypes.c_float,
-            ctypes.c_float,
-            ctypes.c_float,
-            np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
-            np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
-        ]
+def _load():
+    """Load libcudaDecon once, returning the library (or None if missing)."""
+    global _loaded, cudaLib
+    global Deskew_interface, Affine_interface, Affine_interface_RA
+    global camcor_interface_init, camcor_interface, RL_interface_init
+    global get_output_nx, get_output_ny, get_output_nz
+    global RL_interface, RL_cleanup, cuda_reset
 
-        # setup
-        camcor_interface_init = cudaLib.camcor_interface_init
-        camcor_interface_init.restype = ctypes.c_int
-        camcor_interface_init.argtypes = [
-            ctypes.c_int,
-            ctypes.c_int,
-            ctypes.c_int,
-            np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
-        ]
+    with lock:
+        if _loaded:
+            return cudaLib
+        cudaLib = load_lib("libcudaDecon")
 
-        # execute camcor
-        camcor_interface = cudaLib.camcor_interface
-        camcor_interface.restype = ctypes.c_int
-        camcor_interface.argtypes = [
-            np.ctypeslib.ndpointer(ctypes.c_uint16, flags="C_CONTIGUOUS"),
-            ctypes.c_int,
-            ctypes.c_int,
-            ctypes.c_int,
-            np.ctypeslib.ndpointer(ctypes.c_uint16, flags="C_CONTIGUOUS"),
-        ]
-
-        # RL_interface_init must be used before using RL_interface
-        RL_interface_init = cudaLib.RL_interface_init
-        RL_interface_init.restype = ctypes.c_int
-        RL_interface_init.argtypes = [
-            ctypes.c_int,  # nx
-            ctypes.c_int,  # ny
-            ctypes.c_int,  # nz
-            ctypes.c_float,  # drdata
-            ctypes.c_float,  # dzdata
-            ctypes.c_float,  # drpsf
-            ctypes.c_float,  # dzpsf
-            ctypes.c_float,  # angle
-            ctypes.c_float,  # rotate
-            ctypes.c_int,  # outputwidth
-            ctypes.c_char_p,
-        ]  # otfpath.encode()
-
-        # used between init and RL_interface to retrieve the post-deskewed image dimensions
-        get_output_nx = cudaLib.get_output_nx
-        get_output_ny = cudaLib.get_output_ny
-        get_output_nz = cudaLib.get_output_nz
-
-        # The actual decon
-        RL_interface = cudaLib.RL_interface
-        RL_interface.restype = ctypes.c_int
-        RL_interface.argtypes = [
-            np.ctypeslib.ndpointer(ctypes.c_ushort, flags="C_CONTIGUOUS"),  # im
-            ctypes.c_int,  # nx
-            ctypes.c_int,  # ny
-            ctypes.c_int,  # nz
-            np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
-            np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),  # result
-            ctypes.c_float,  # background
-            ctypes.c_bool,  # doRescale
-            ctypes.c_bool,  # saveDeskewed
-            ctypes.c_int,  # nIters
-            ctypes.c_int,  # shift
-            ctypes.c_int,  # napodize
-            ctypes.c_int,  # nZblend
-            ctypes.c_float,  # padVal
-            ctypes.c_bool,
-        ]  # bDupRevStack
-        # call after
-        RL_cleanup = cudaLib.RL_cleanup
-
-        cuda_reset = cudaLib.cuda_reset
-
-    except AttributeError as e:
-        logger.warning("Failed to properly import libcudaDeconv")
-        print(e)
+        if not cudaLib:
+            logger.error("Could not load libcudaDecon!  Read docs for more info")
+        else:
+            try:
+                # Deskew is used when no decon is desired
+                # https://stackoverflow.com/questions/5862915/passing-numpy-arrays-to-a-c-function-for-input-and-output
+                Deskew_interface = cudaLib.Deskew_interface
+                Deskew_interface.restype = ctypes.c_int
+                Deskew_interface.argtypes = [
+                    np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
+                    ctypes.c_int,
+                    ctypes.c_int,
+                    ctypes.c_int,
+                    ctypes.c_float,
+                    ctypes.c_float,
+                    ctypes.c_float,
+                    np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
+                    ctypes.c_int,
+                    ctypes.c_int,
+                    ctypes.c_float,
+                ]
+
+                # Affine transformation
+                Affine_interface = cudaLib.Affine_interface
+                Affine_interface.restype = ctypes.c_int
+                Affine_interface.argtypes = [
+                    np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
+                    ctypes.c_int,
+                    ctypes.c_int,
+                    ctypes.c_int,
+                    np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
+                    np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
+                ]
+
+                # Affine transformation
+                Affine_interface_RA = cudaLib.Affine_interface_RA
+                Affine_interface_RA.restype = ctypes.c_int
+                Affine_interface_RA.argtypes = [
+                    np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
+                    ctypes.c_int,
+                    ctypes.c_int,
+                    ctypes.c_int,
+                    ctypes.c_float,
+                    ctypes.c_float,
+                    ctypes.c_float,
+                    np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
+                    np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
+                ]
+
+                # setup
+                camcor_interface_init = cudaLib.camcor_interface_init
+                camcor_interface_init.restype = ctypes.c_int
+                camcor_interface_init.argtypes = [
+                    ctypes.c_int,
+                    ctypes.c_int,
+                    ctypes.c_int,
+                    np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
+                ]
+
+                # execute camcor
+                camcor_interface = cudaLib.camcor_interface
+                camcor_interface.restype = ctypes.c_int
+                camcor_interface.argtypes = [
+                    np.ctypeslib.ndpointer(ctypes.c_uint16, flags="C_CONTIGUOUS"),
+                    ctypes.c_int,
+                    ctypes.c_int,
+                    ctypes.c_int,
+                    np.ctypeslib.ndpointer(ctypes.c_uint16, flags="C_CONTIGUOUS"),
+                ]
+
+                # RL_interface_init must be used before using RL_interface
+                RL_interface_init = cudaLib.RL_interface_init
+                RL_interface_init.restype = ctypes.c_int
+                RL_interface_init.argtypes = [
+                    ctypes.c_int,  # nx
+                    ctypes.c_int,  # ny
+                    ctypes.c_int,  # nz
+                    ctypes.c_float,  # drdata
+                    ctypes.c_float,  # dzdata
+                    ctypes.c_float,  # drpsf
+                    ctypes.c_float,  # dzpsf
+                    ctypes.c_float,  # angle
+                    ctypes.c_float,  # rotate
+                    ctypes.c_int,  # outputwidth
+                    ctypes.c_char_p,
+                ]  # otfpath.encode()
+
+                # used between init and RL_interface to retrieve the post-deskewed image dimensions
+                get_output_nx = cudaLib.get_output_nx
+                get_output_ny = cudaLib.get_output_ny
+                get_output_nz = cudaLib.get_output_nz
+
+                # The actual decon
+                RL_interface = cudaLib.RL_interface
+                RL_interface.restype = ctypes.c_int
+                RL_interface.argtypes = [
+                    np.ctypeslib.ndpointer(ctypes.c_ushort, flags="C_CONTIGUOUS"),  # im
+                    ctypes.c_int,  # nx
+                    ctypes.c_int,  # ny
+                    ctypes.c_int,  # nz
+                    np.ctypeslib.ndpointer(ctypes.c_float, flags="C_CONTIGUOUS"),
+                    np.ctypeslib.ndpointer(
+                        ctypes.c_float, flags="C_CONTIGUOUS"
+                    ),  # result
+                    ctypes.c_float,  # background
+                    ctypes.c_bool,  # doRescale
+                    ctypes.c_bool,  # saveDeskewed
+                    ctypes.c_int,  # nIters
+                    ctypes.c_int,  # shift
+                    ctypes.c_int,  # napodize
+                    ctypes.c_int,  # nZblend
+                    ctypes.c_float,  # padVal
+                    ctypes.c_bool,
+                ]  # bDupRevStack
+                # call after
+                RL_cleanup = cudaLib.RL_cleanup
+
+                cuda_reset = cudaLib.cuda_reset
+
+            except AttributeError as e:
+                logger.warning("Failed to properly import libcudaDeconv")
+                print(e)
+        _loaded = True
+    return cudaLib
+
+
+def __getattr__(name):
+    # e.g. `from llspy.libcudawrapper import cudaLib` loads the library (but the import
+    # machinery probing for e.g. __path__ does not)
+    if not _loaded and not name.startswith("__"):
+        _load()
+        if name in globals():
+            return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def requireCUDAlib():
-    if not cudaLib:
+    if not _load():
         raise LibCUDAException(
             "Could not find libcudaDeconv library! These "
             "functions will not be available:\n"
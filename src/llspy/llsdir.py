@@ -2,34 +2,43 @@ import datetime
 import glob
 import json
 import logging
+import multiprocessing
 import os
 import pprint
+import queue
 import re
 import shutil
 import sys
+import threading
 import time
-import warnings
-from multiprocessing import Pool, cpu_count
+from contextlib import nullcontext
+from multiprocessing import cpu_count
 
 import numpy as np
-import tifffile as tf
 from parse import parse as _parse
 
+from llspy import libcudawrapper
 from llspy.libcudawrapper import affineGPU, deskewGPU, quickDecon
 
-from . import arrayfun, compress, config, parse, schema, util
+from . import (
+    arrayfun,
+    compress,
+    config,
+    kernels,
+    metrics,
+    parse,
+    pipeline,
+    schema,
+    scratch,
+    util,
+)
 from . import otf as otfmodule
-from .camera import CameraParameters, selectiveMedianFilter
-from .cudabinwrapper import CUDAbin
+from .camera import CameraParameters, calc_correction, selectiveMedianFilter
+from .cudabinwrapper import get_cudabin
 from .exceptions import LLSpyError, OTFError
+from .mips import MIPAccumulator, combo_name
 from .settingstxt import LLSsettings
-
-try:
-    from fiducialreg.fiducialreg import CloudSet, RegFile, RegistrationError
-except ImportError:
-    thisDirectory = os.path.dirname(os.path.abspath(__file__))
-    sys.path.append(os.path.join(thisDirectory, os.pardir))
-    from fiducialreg.fiducialreg import CloudSet, RegFile, RegistrationError
+from .tiffio import AsyncTiffWriter, StackPrefetcher, read_into
 
 try:
     import pathlib as plib
@@ -44,6 +53,18 @@ except (ImportError, AttributeError):
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+
+def _fiducialreg():
+    """Import fiducialreg (and with it most of scipy) on first use."""
+    try:
+        from fiducialreg import fiducialreg
+    except ImportError:
+        thisDirectory = os.path.dirname(os.path.abspath(__file__))
+        sys.path.append(os.path.join(thisDirectory, os.pardir))
+        from fiducialreg import fiducialreg
+    return fiducialreg
+
+
 np.seterr(divide="ignore", invalid="ignore")
 
 # this is for multiprocessing with pyinstaller on windows
@@ -82,6 +103,9 @@ if sys.platform.startswith("win"):
     forking.Popen = _Popen
 
 
+# marks the end of a stream of work items in the threaded pipelines below
+_SENTINEL = object()
+
 __FPATTERN__ = "{basename}_ch{channel:d}_stack{stack:d}_{wave:d}nm_{reltime:d}msec_{abstime:d}msecAbs{}"
 
 
@@ -94,11 +118,19 @@ def correctTimepoint(
     trimY,
     trimX,
     flashCorrectTarget="cpu",
+    writer=None,
+    stacks=None,
 ):
     """accepts a list of filenames (fnames) that represent Z stacks that have
     been acquired in an interleaved manner (i.e. ch1z1,ch2z1,ch1z2,ch2z2...)
+
+    If an :class:`~llspy.tiffio.AsyncTiffWriter` is provided, corrected stacks
+    are submitted to it and may still be pending when this function returns.
+    If the stacks have already been read (e.g. by a
+    :class:`~llspy.tiffio.StackPrefetcher`), they can be passed as ``stacks``.
     """
-    stacks = [util.imread(f) for f in fnames]
+    if stacks is None:
+        stacks = [util.imread(f) for f in fnames]
     outstacks = camparams.correct_stacks(
         stacks, medianFilter, (trimZ, trimY, trimX), flashCorrectTarget
     )
@@ -106,21 +138,46 @@ def correctTimepoint(
         str(outpath.joinpath(os.path.basename(str(f).replace(".tif", "_COR.tif"))))
         for f in fnames
     ]
-    for n in range(len(outstacks)):
-        util.imsave(util.reorderstack(np.squeeze(outstacks[n]), "zyx"), outnames[n])
+    with AsyncTiffWriter() if writer is None else nullcontext(writer) as w:
+        for n in range(len(outstacks)):
+            w.submit(np.squeeze(outstacks[n]), outnames[n])
 
 
 def unwrapper(tup):
     return correctTimepoint(*tup)
 
 
-def filter_stack(filename, outname, dx, background, trim, medianFilter):
-    stack = util.imread(filename)
+def filter_stack(
+    filename, outname, dx, background, trim, medianFilter, writer=None, stack=None
+):
+    """median filter and/or trim a stack, writing the result to outname.
+
+    ``stack`` may be provided if filename has already been read.  Without the
+    median filter it must then only hold the planes left after trimZ (see
+    :func:`_untrimmed_planes`).
+    """
     if medianFilter:
+        if stack is None:
+            stack = util.imread(filename)
         stack, _ = selectiveMedianFilter(stack, background)
+    else:
+        # without the median filter (which needs every plane) only read the
+        # planes that will survive trimZ
+        if stack is None:
+            stack = util.imread(filename, planes=_untrimmed_planes(filename, trim[0]))
+        trim = ((0, 0), *trim[1:])
     if any(any(i) for i in trim):
         stack = arrayfun.trimedges(stack, trim)
-    util.imsave(util.reorderstack(np.squeeze(stack), "zyx"), outname, dx=dx, dz=1)
+    if writer is None:
+        util.imsave(np.squeeze(stack), outname, dx=dx, dz=1)
+    else:
+        writer.submit(np.squeeze(stack), outname, dx=dx, dz=1)
+
+
+def _untrimmed_planes(filename, trimZ):
+    """slice of Z planes that are left after trimming trimZ from a stack"""
+    nz = util.imread(filename, header_only=True)[0][0]
+    return slice(trimZ[0], nz - trimZ[1])
 
 
 def unbundle(group):
@@ -145,16 +202,39 @@ def move_corrected(path):
                     t += 1
 
 
+def cpu_pool(processes=None, jit=()):
+    """multiprocessing Pool for the CPU-bound corrections.
+
+    Forking a process that is running other threads can deadlock the child
+    on a lock held by one of them (e.g. the logging lock), so pools created
+    outside of the main thread use the "spawn" start method.  Workers compile
+    (or load from the numba cache) the kernels named in ``jit`` when they
+    start, rather than on their first task.
+    """
+    if threading.current_thread() is threading.main_thread():
+        ctx = multiprocessing.get_context()
+    else:
+        ctx = multiprocessing.get_context("spawn")
+    if jit:
+        return ctx.Pool(
+            processes=processes or cpu_count(),
+            initializer=kernels.pool_initializer,
+            initargs=(list(jit),),
+        )
+    return ctx.Pool(processes=processes or cpu_count())
+
+
 def get_regObj(regCalibPath):
     """Detect whether provided path is a directory of tiffs with fiducials or
     a pre-calibrated registration file"""
+    fr = _fiducialreg()
     refObj = None
     if os.path.isfile(regCalibPath) and regCalibPath.endswith(
         (".reg", ".txt", ".json")
     ):
-        refObj = RegFile(regCalibPath)
+        refObj = fr.RegFile(regCalibPath)
         if not refObj.n_tforms > 0:
-            raise RegistrationError(f"No transforms found in file: {regCalibPath}")
+            raise fr.RegistrationError(f"No transforms found in file: {regCalibPath}")
         logger.debug("RegCalib Path detected as registration file")
     elif os.path.isdir(regCalibPath):  # path must be raw fidicial dataset
         refObj = RegDir(regCalibPath)
@@ -164,50 +244,149 @@ def get_regObj(regCalibPath):
                   Registration requires a folder of multi-channel fiducial marker
                   tiff files, as well as a settings.txt file
                   """
-            raise RegistrationError(mes.format(path=regCalibPath))
+            raise fr.RegistrationError(mes.format(path=regCalibPath))
         logger.debug("RegCalib Path detected as fiducial dataset")
     return refObj
 
 
-def register_folder(folder, regRefWave, regMode, regObj, voxsize=None, discard=False):
+def register_folder(
+    folder,
+    regRefWave,
+    regMode,
+    regObj,
+    voxsize=None,
+    discard=False,
+    workers=1,
+    maxqueue=4,
+    callback=None,
+    mips=None,
+):
     """Register all (non-reference) wavelengths in a folder to the specified
     reference wavelength, using the provided regObj.
 
     voxsize must be an array of pixel sizes [dz, dy, dx]
+
+    Files are streamed through a bounded producer/consumer pipeline: a single
+    reader thread, ``workers`` warping threads and an
+    :class:`~llspy.tiffio.AsyncTiffWriter`, so that disk I/O and the affine
+    transforms overlap.  The GPU calls themselves are serialized
+    (libcudaDecon state is global), so more than one warper only helps
+    with the conversions around them.  At most ``maxqueue``
+    stacks wait between any two stages.  If provided, ``callback`` is called
+    with the path of each registered file as soon as it has been written.
+
+    With a :class:`~llspy.mips.MIPAccumulator` as ``mips``, the projections
+    of the registered stacks are taken while they are in memory.  The
+    reference channel is not changed, so its projections are read from the
+    MIP files in the MIPs subfolder.
     """
     if voxsize is None:
         voxsize = [1, 1, 1]
     if isinstance(regObj, str):
         regObj = get_regObj(regObj)
     folder = str(folder)
-
     global __FPATTERN__
 
-    # get all tiffs in folders
-    files = parse.filter_w(os.listdir(folder), regRefWave, exclusive=True)
+    # get all tiffs in folders (one directory listing for the whole function)
+    listing = os.listdir(folder)
+    files = parse.filter_w(listing, regRefWave, exclusive=True)
     files = [f for f in files if (f.endswith(".tif") and "_REG" not in f)]
-    for F in files:
-        fname = os.path.join(folder, F)
-        outname = fname.replace(".tif", f"_REG{regRefWave}.tif")
-        imarray = util.imread(fname)
-        imwave = parse.parse_filename(fname, "wave", pattern=__FPATTERN__)
-        im_out = register_image_to_wave(
-            imarray, regObj, imwave, regRefWave, mode=regMode, voxsize=voxsize
-        ).astype(imarray.dtype)
-        util.imsave(
-            util.reorderstack(np.squeeze(im_out), "zyx"),
-            outname,
-            dx=voxsize[2],
-            dz=voxsize[0],
-        )
+
+    # look up the (inverted) transform once per wavelength, not once per file
+    waves = {F: parse.parse_filename(F, "wave", pattern=__FPATTERN__) for F in files}
+    tforms = {
+        w: np.linalg.inv(regObj.get_tform(w, regRefWave, regMode))
+        for w in set(waves.values())
+    }
+
+    readq = queue.Queue(maxsize=maxqueue)
+    errors = []
+
+    def on_written(outname, fname):
         if discard:
-            os.remove(os.path.join(folder, F))
+            os.remove(fname)
+        if callback is not None:
+            callback(outname)
+
+    # the reader and warpers keep draining their input after an error so
+    # that no thread is left blocking on a full queue
+    def reader():
+        prefetch = StackPrefetcher([[os.path.join(folder, F)] for F in files])
+        try:
+            for F, (_, (imarray,)) in zip(files, prefetch):
+                if errors:
+                    break
+                readq.put((F, imarray))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            for _ in range(workers):
+                readq.put(_SENTINEL)
+
+    def warper(writer):
+        while True:
+            item = readq.get()
+            if item is _SENTINEL:
+                break
+            if errors:
+                continue
+            F, imarray = item
+            fname = os.path.join(folder, F)
+            outname = fname.replace(".tif", f"_REG{regRefWave}.tif")
+            try:
+                with libcudawrapper.lock:
+                    im_out = affineGPU(imarray, tforms[waves[F]], voxsize)
+                im_out = np.squeeze(im_out.astype(imarray.dtype))
+                if mips is not None:
+                    info = parse.parse_filename(F, pattern=__FPATTERN__)
+                    mips.add(im_out, info["stack"], info["channel"])
+                writer.submit(
+                    im_out,
+                    outname,
+                    callback=lambda o, f=fname: on_written(o, f),
+                    dx=voxsize[2],
+                    dz=voxsize[0],
+                )
+            except Exception as e:
+                errors.append(e)
+
+    writer = AsyncTiffWriter(maxqueue=maxqueue)
+    try:
+        threads = [threading.Thread(target=reader, daemon=True)]
+        threads.extend(
+            threading.Thread(target=warper, args=(writer,), daemon=True)
+            for _ in range(workers)
+        )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.flush()
+    finally:
+        writer.close()
+    if errors:
+        raise errors[0]
 
     # rename refwave files too
-    for F in parse.filter_w(os.listdir(folder), regRefWave, exclusive=False):
+    refchannels = set()
+    for F in parse.filter_w(listing, regRefWave, exclusive=False):
         fname = os.path.join(folder, F)
         outname = fname.replace(".tif", f"_REG{regRefWave}.tif")
         os.rename(fname, outname)
+        if F.endswith(".tif"):
+            refchannels.add(parse.parse_filename(F, "channel", pattern=__FPATTERN__))
+        if callback is not None:
+            callback(outname)
+
+    mipdir = os.path.join(folder, "MIPs")
+    if mips is not None and os.path.isdir(mipdir):
+        for axis, channels in list_mips(mipdir).items():
+            if axis not in mips.axes:
+                continue
+            for c in refchannels & set(channels):
+                for path in channels[c]:
+                    t = parse.parse_filename(str(path), "stack", pattern=__FPATTERN__)
+                    mips.add_projection(axis, util.imread(str(path)), t, c)
 
 
 def register_image_to_wave(
@@ -217,8 +396,9 @@ def register_image_to_wave(
 
     global __FPATTERN__
 
-    if not isinstance(regCalibObj, (RegDir, RegFile)):
-        raise RegistrationError(
+    fr = _fiducialreg()
+    if not isinstance(regCalibObj, (RegDir, fr.RegFile)):
+        raise fr.RegistrationError(
             "Calibration object for register_image_to_wave "
             "must be either RegDir or RegFile.  Received: %s" % str(type(regCalibObj))
         )
@@ -247,13 +427,17 @@ def register_image_to_wave(
     return affineGPU(img, inv_tform, voxsize)
 
 
-def preview(exp, tR=0, cR=None, **kwargs):
+def preview(exp, tR=0, cR=None, recorder=None, mips=None, **kwargs):
     """Process LLS experiment, without file IO.
 
     Args:
         exp (:obj:`str`, LLSdir): path to LLS experiment or LLSdir instance
         tR (:obj:`int`, Iterable[:obj:`int`], optional): Time points to process (zero indexed)
         cR (:obj:`int`, Iterable[:obj:`int`], optional): Channels to process (zero indexed)
+        recorder (:obj:`llspy.metrics.Recorder`, optional): records the time
+            spent in every stage (decompress, read, preprocess, deconvolve)
+        mips (:obj:`llspy.mips.MIPAccumulator`, optional): receives the
+            projections of every processed stack
 
         **kwargs: any keyword arguments that are recognized by the LLS `Schema list`_.
 
@@ -267,14 +451,17 @@ def preview(exp, tR=0, cR=None, **kwargs):
             exp = LLSdir(exp)
     logger.debug(f"Preview called on {exp.path!s}")
     logger.debug(f"Params: {exp.parameters}")
+    if recorder is None:
+        recorder = metrics.Recorder(experiment=exp.basename)
 
     if exp.is_compressed():
-        try:
-            exp.decompress_partial(tRange=tR)
-        except Exception as e:
-            logger.error("ERROR: could not do partial decompression...")
-            logger.error(str(e))
-            exp.decompress()
+        with recorder.span("decompress"):
+            try:
+                exp.decompress_partial(tRange=tR)
+            except Exception as e:
+                logger.error("ERROR: could not do partial decompression...")
+                logger.error(str(e))
+                exp.decompress()
 
     if not exp.ready_to_process:
         if not exp.has_lls_tiffs:
@@ -292,84 +479,30 @@ def preview(exp, tR=0, cR=None, **kwargs):
         P.correctFlash = False
         logger.warning("Cannot perform Flash Correction without settings.txt file")
 
+    # without flash correction, trimmed Z planes don't need to be read at all
+    planes = None
+    trim = (P.trimZ, P.trimY, P.trimX)
+    if not P.correctFlash and any(P.trimZ):
+        planes = slice(P.trimZ[0], exp.parameters.nz - P.trimZ[1])
+        trim = ((0, 0), P.trimY, P.trimX)
+
+    # read timepoint t+1 while timepoint t is being processed. Every stack
+    # is copied by the processing below, so the read buffers can be recycled
+    prefetch = StackPrefetcher.from_llsdir(
+        exp, P.tRange, P.cRange, planes=planes, recycle=True
+    )
     out = []
-    for timepoint in P.tRange:
-        stacks = [util.imread(f) for f in exp.get_files(c=P.cRange, t=timepoint)]
-        if not stacks:
-            continue
-        # logger.debug("shape_raw: {}".format(stacks[0].shape))
-        if P.correctFlash:
-            camparams = CameraParameters(P.camparamsPath)
-            camparams = camparams.get_subroi(exp.settings.camera.roi)
-            stacks = camparams.correct_stacks(
-                stacks, trim=(P.trimZ, P.trimY, P.trimX), medianFilter=P.medianFilter
-            )
-        else:
-            # camera correction trims edges, so if we aren't doing the camera correction
-            # we need to call the edge trim on our own
-            if any(any(i) for i in (P.trimZ, P.trimY, P.trimX)):
-                stacks = [
-                    arrayfun.trimedges(s, (P.trimZ, P.trimY, P.trimX)) for s in stacks
-                ]
-            # camera correction also does background subtraction
-            # so otherwise trigger it manually here
-            stacks = [
-                arrayfun.sub_background(s, b) for s, b in zip(stacks, P.background)
-            ]
-
-        # FIXME: background is the only thing keeping this from just **P to deconvolve
-        if P.nIters > 0:
-            opts = {
-                "nIters": P.nIters,
-                "drdata": P.drdata,
-                "dzdata": P.dzdata,
-                "deskew": P.deskew,
-                "rotate": P.rotate,
-                "width": P.width,
-                "shift": P.shift,
-                "background": 0,  # zero here because it's already been subtracted above
-            }
-            for i, d in enumerate(zip(stacks, P.otfs)):
-                stk, otf = d
-                stacks[i] = quickDecon(stk, otf, **opts)
-        else:
-            # deconvolution does deskewing and cropping, so we do it here if we're
-            #
-            if P.deskew:
-                stacks = [deskewGPU(s, P.dzdata, P.drdata, P.deskew) for s in stacks]
-            stacks = [arrayfun.cropX(s, P.width, P.shift) for s in stacks]
-
-        # FIXME: this is going to be slow until we cache the tform Matrix results
-        if P.doReg:
-            if P.regCalibPath is None:
-                logger.error(
-                    "Skipping Registration: no Calibration Object path provided"
-                )
-            else:
-                refObj = get_regObj(P.regCalibPath)
-                if isinstance(refObj, (RegDir, RegFile)) and refObj.isValid:
-                    voxsize = [
-                        exp.parameters.dzFinal,
-                        exp.parameters.dx,
-                        exp.parameters.dx,
-                    ]
-                    for i, d in enumerate(zip(stacks, P.wavelength)):
-                        stk, wave = d
-                        if not wave == P.regRefWave:  # don't reg the reference channel
-                            stacks[i] = register_image_to_wave(
-                                stk,
-                                refObj,
-                                imwave=wave,
-                                refwave=P.regRefWave,
-                                mode=P.regMode,
-                                voxsize=voxsize,
-                            )
-                else:
-                    logger.error(
-                        "Registration Calibration dir not valid" f"{P.regCalibPath}"
-                    )
-
+    for paths, stacks in recorder.iterate("read", prefetch):
+        with recorder.span("preprocess"):
+            stacks = preprocess_stacks(exp, P, stacks, trim=trim)
+        with recorder.span("deconvolve"):
+            stacks = deconvolve_stacks(exp, P, stacks)
+        if mips is not None:
+            for path, stack in zip(paths, stacks):
+                info = parse.parse_filename(path, pattern=exp.fname_pattern)
+                mips.add(stack, info["stack"], info["channel"])
         out.append(np.stack(stacks, 0))
+    logger.debug(f"Preview stages:\n{recorder.format_summary()}")
 
     if out:
         combined = np.stack(out, 0) if len(out) > 1 else out[0]
@@ -380,115 +513,393 @@ def preview(exp, tR=0, cR=None, **kwargs):
         return None
 
 
-def process(exp, binary=None, **kwargs):
-    """Process LLS experiment with cudaDeconv, output results to file.
+def process_stacks(exp, P, stacks, trim=None):
+    """Process the raw stacks (one per channel) of a single timepoint in memory.
 
-    Args:
-        exp (:obj:`str`, LLSdir): path to LLS experiment or LLSdir instance
-        binary (:obj:`str`, optional): specify path to cudaDeconv binary, otherwise
-            gets default bundled binary (if present).
+    This is the per-timepoint work of :func:`preview`: flash correction or
+    trimming and background subtraction (:func:`preprocess_stacks`), then
+    deconvolution or deskewing and optional channel registration
+    (:func:`deconvolve_stacks`).
 
-        **kwargs: any keyword arguments that are recognized by the LLS `Schema list`_.
+    Args:
+        exp (LLSdir): the experiment the stacks belong to
+        P (dict): processing parameters, as returned by ``exp.localParams()``
+        stacks (list): raw ZYX arrays, one per channel in ``P.cRange``
+        trim (tuple): (trimZ, trimY, trimX) to apply when not flash correcting.
+            Defaults to the trims in P.
 
     Returns:
-        None:  Files are written to disk.
+        list: the processed stacks
     """
+    stacks = preprocess_stacks(exp, P, stacks, trim)
+    return deconvolve_stacks(exp, P, stacks)
 
-    if not isinstance(exp, LLSdir):
-        if isinstance(exp, str):
-            exp = LLSdir(exp)
-    logger.debug(f"Process called on {exp.path!s}")
-    logger.debug(f"Params: {exp.parameters}")
 
-    if exp.is_compressed():
-        exp.decompress()
+def preprocess_stacks(exp, P, stacks, trim=None):
+    """CPU part of :func:`process_stacks`: correction, trimming and background."""
+    if trim is None:
+        trim = (P.trimZ, P.trimY, P.trimX)
+    stacks = list(stacks)
+    if P.correctFlash:
+        camparams = CameraParameters(P.camparamsPath)
+        camparams = camparams.get_subroi(exp.settings.camera.roi)
+        stacks = camparams.correct_stacks(
+            stacks, trim=(P.trimZ, P.trimY, P.trimX), medianFilter=P.medianFilter
+        )
+    else:
+        # camera correction trims edges, so if we aren't doing the camera correction
+        # we need to call the edge trim on our own
+        if any(any(i) for i in trim):
+            stacks = [arrayfun.trimedges(s, trim) for s in stacks]
+        # camera correction also does background subtraction
+        # so otherwise trigger it manually here
+        stacks = [arrayfun.sub_background(s, b) for s, b in zip(stacks, P.background)]
+    return stacks
 
-    if not exp.ready_to_process:
-        if not exp.has_lls_tiffs:
-            logger.warning(f"No TIFF files to process in {exp.path}")
-        if not exp.parameters.isReady():
-            logger.warning(f"Parameters are not valid: {exp.path}")
-        return
 
-    P = exp.localParams(**kwargs)
+def deconvolve_stacks(exp, P, stacks):
+    """GPU part of :func:`process_stacks`: deconvolution or deskewing, and
+    registration, of stacks returned by :func:`preprocess_stacks`.
 
-    if binary is None:
-        binary = CUDAbin()
+    Calls into libcudaDecon, so only one thread at a time should run it.
+    """
+    stacks = list(stacks)
+    # FIXME: background is the only thing keeping this from just **P to deconvolve
+    if P.nIters > 0:
+        opts = {
+            "nIters": P.nIters,
+            "drdata": P.drdata,
+            "dzdata": P.dzdata,
+            "deskew": P.deskew,
+            "rotate": P.rotate,
+            "width": P.width,
+            "shift": P.shift,
+            "background": 0,  # zero here because it's already been subtracted above
+        }
+        for i, d in enumerate(zip(stacks, P.otfs)):
+            stk, otf = d
+            stacks[i] = quickDecon(stk, otf, **opts)
+    else:
+        # deconvolution does deskewing and cropping, so we do it here if we're
+        #
+        if P.deskew:
+            stacks = [deskewGPU(s, P.dzdata, P.drdata, P.deskew) for s in stacks]
+        stacks = [arrayfun.cropX(s, P.width, P.shift) for s in stacks]
 
-    if P.correctFlash:
-        exp.path = exp.correct_flash(**P)
-    elif P.medianFilter or any(any(i) for i in (P.trimX, P.trimY, P.trimZ)):
-        exp.path = exp.median_and_trim(**P)
-
-    if P.nIters > 0 or P.saveDeskewedRaw or P.rotate:
-        for chan in P.cRange:
-            opts = {
-                "background": P.background[chan] if not P.correctFlash else 0,
-                "drdata": P.drdata,
-                "dzdata": P.dzdata,
-                "wavelength": float(P.wavelength[chan]) / 1000,
-                "deskew": P.deskew,
-                "saveDeskewedRaw": P.saveDeskewedRaw,
-                "MIP": P.MIP,
-                "rMIP": P.rMIP,
-                "uint16": P.uint16,
-                "bleachCorrection": P.bleachCorrection,
-                "RL": P.nIters,
-                "rotate": P.rotate,
-                "width": P.width,
-                "shift": P.shift,
-                # 'quiet': bool(quiet),
-                # 'verbose': bool(verbose),
-            }
-
-            # filter by channel and trange
-            if (
-                len(list(P.tRange)) == exp.parameters.nt
-            ):  # processing all the timepoints
-                filepattern = f"ch{chan}_"
+    # FIXME: this is going to be slow until we cache the tform Matrix results
+    if P.doReg:
+        if P.regCalibPath is None:
+            logger.error("Skipping Registration: no Calibration Object path provided")
+        else:
+            refObj = get_regObj(P.regCalibPath)
+            if isinstance(refObj, (RegDir, _fiducialreg().RegFile)) and refObj.isValid:
+                voxsize = [
+                    exp.parameters.dzFinal,
+                    exp.parameters.dx,
+                    exp.parameters.dx,
+                ]
+                for i, d in enumerate(zip(stacks, P.wavelength)):
+                    stk, wave = d
+                    if not wave == P.regRefWave:  # don't reg the reference channel
+                        stacks[i] = register_image_to_wave(
+                            stk,
+                            refObj,
+                            imwave=wave,
+                            refwave=P.regRefWave,
+                            mode=P.regMode,
+                            voxsize=voxsize,
+                        )
             else:
-                filepattern = f"ch{chan}_stack{util.pyrange_to_perlregex(P.tRange)}"
+                logger.error(
+                    "Registration Calibration dir not valid" f"{P.regCalibPath}"
+                )
 
-            binary.process(str(exp.path), filepattern, P.otfs[chan], **opts)
+    return stacks
 
-        # if verbose:
-        #   logger.info(response.output.decode('utf-8'))
 
-    # FIXME: this is just a messy first try...
-    if P.doReg:
-        exp.register(P.regRefWave, P.regMode, P.regCalibPath, P.deleteUnregistered)
+class ProcessJob:
+    """Processing of a single LLS experiment, split into stages.
+
+    :func:`process` runs all stages in order.  The stages can also be run
+    separately (for instance by :class:`llspy.batch.BatchScheduler`, which
+    corrects one experiment while deconvolving another):
+
+    1. :meth:`correct` - flash correction, median filter and trimming, written
+       to the Corrected folder (CPU)
+    2. :meth:`deconvolve` - deskewing/deconvolution with cudaDeconv, or the
+       whole streaming pipeline when ``streamPipeline`` is set (GPU)
+    3. :meth:`finish` - registration, MIP merging, cleanup, compression of the
+       raw data and the processing log (CPU)
+
+    Check :attr:`ready` before running any stage: it is False if the
+    experiment can't be processed.  The stages are measured by
+    :attr:`recorder` (see :mod:`llspy.metrics`); with ``writeLog``, the
+    measurements are written to a ProcessingMetrics.jsonl file, and their
+    summary to the processing log.
+
+    Args:
+        exp (:obj:`str`, LLSdir): path to LLS experiment or LLSdir instance
+        binary (:obj:`str`, optional): cudaDeconv binary, otherwise gets
+            default bundled binary (if present).
+        processes (int, optional): number of processes used by the CPU
+            corrections (default: one per CPU)
+        recorder (:obj:`llspy.metrics.Recorder`, optional): records the
+            stages, a new one is made by default.
+        **kwargs: any keyword arguments that are recognized by the LLS `Schema list`_.
+    """
+
+    def __init__(self, exp, binary=None, processes=None, recorder=None, **kwargs):
+        if not isinstance(exp, LLSdir):
+            if isinstance(exp, str):
+                exp = LLSdir(exp)
+        logger.debug(f"Process called on {exp.path!s}")
+        logger.debug(f"Params: {exp.parameters}")
+        self.exp = exp
+        self.binary = binary
+        self.processes = processes
+        self.ready = False
+        self.staged = None
+        if recorder is None:
+            recorder = metrics.Recorder(experiment=exp.basename)
+        self.recorder = recorder
+
+        if exp.is_compressed():
+            with recorder.span("decompress"):
+                exp.decompress()
+
+        if not exp.ready_to_process:
+            if not exp.has_lls_tiffs:
+                logger.warning(f"No TIFF files to process in {exp.path}")
+            if not exp.parameters.isReady():
+                logger.warning(f"Parameters are not valid: {exp.path}")
+            return
+
+        self.P = exp.localParams(**kwargs)
+        if self.P.writeLog:
+            recorder.set_path(metrics_path(exp))
+        self.stream = pipeline.should_stream(self.P)
+        # with a scratch directory, intermediates and outputs are written
+        # there, and the outputs are copied back to exp.path by finish()
+        self.staged = scratch.stage(exp, self.P)
+        self.work = self.staged.exp if self.staged else exp
+        self.ready = True
+
+    @property
+    def needs_correction(self):
+        P = self.P
+        trim = any(any(i) for i in (P.trimX, P.trimY, P.trimZ))
+        return not self.stream and (P.correctFlash or P.medianFilter or trim)
+
+    @property
+    def needs_decon(self):
+        P = self.P
+        return self.stream or P.nIters > 0 or P.saveDeskewedRaw or bool(P.rotate)
+
+    def correct(self):
+        """correct raw data, writing it to the Corrected folder"""
+        P = self.P
+        if self.stream:
+            return  # done in memory by the streaming pipeline
+        if P.correctFlash:
+            with self.recorder.span("correct"):
+                self.work.path = self.work.correct_flash(processes=self.processes, **P)
+        elif P.medianFilter or any(any(i) for i in (P.trimX, P.trimY, P.trimZ)):
+            with self.recorder.span("correct"):
+                self.work.path = self.work.median_and_trim(
+                    processes=self.processes, **P
+                )
+
+    def deconvolve(self):
+        """deskew and/or deconvolve the (corrected) data"""
+        P = self.P
+        if self.stream:
+            # correction, deconvolution and MIPs without intermediate files
+            with self.recorder.span("stream"):
+                pipeline.stream_process(self.work, P)
+        elif self.needs_decon:
+            binary = self.binary if self.binary is not None else get_cudabin()
+            for chan in P.cRange:
+                opts = {
+                    "background": P.background[chan] if not P.correctFlash else 0,
+                    "drdata": P.drdata,
+                    "dzdata": P.dzdata,
+                    "wavelength": float(P.wavelength[chan]) / 1000,
+                    "deskew": P.deskew,
+                    "saveDeskewedRaw": P.saveDeskewedRaw,
+                    "MIP": P.MIP,
+                    "rMIP": P.rMIP,
+                    "uint16": P.uint16,
+                    "bleachCorrection": P.bleachCorrection,
+                    "RL": P.nIters,
+                    "rotate": P.rotate,
+                    "width": P.width,
+                    "shift": P.shift,
+                    # 'quiet': bool(quiet),
+                    # 'verbose': bool(verbose),
+                }
+
+                # filter by channel and trange
+                if (
+                    len(list(P.tRange)) == self.work.parameters.nt
+                ):  # processing all the timepoints
+                    filepattern = f"ch{chan}_"
+                else:
+                    filepattern = f"ch{chan}_stack{util.pyrange_to_perlregex(P.tRange)}"
+
+                with self.recorder.span("deconvolve", channel=chan):
+                    binary.process(
+                        str(self.work.path), filepattern, P.otfs[chan], **opts
+                    )
+
+    def finish(self):
+        """registration, MIP merging, cleanup and compression"""
+        P = self.P
+        work = self.work
+        try:
+            # FIXME: this is just a messy first try...
+            if P.doReg and pipeline.output_store(work, P) is not None:
+                logger.warning(f"Cannot register {P.outputFormat} outputs, skipping")
+            elif P.doReg:
+                with self.recorder.span("register"):
+                    work.register(
+                        P.regRefWave,
+                        P.regMode,
+                        P.regCalibPath,
+                        P.deleteUnregistered,
+                        mergeMIPs=P.mergeMIPs,
+                    )
+
+            if P.mergeMIPs:
+                with self.recorder.span("mergemips"):
+                    work.mergemips()
+
+            # if we did camera correction, move the resulting processed folders to
+            # the parent folder, and optionally delete the corrected folder
+            if P.moveCorrected and work.path.name == "Corrected":
+                move_corrected(str(work.path))
+                work.path = work.path.parent
+
+            if not P.keepCorrected:
+                shutil.rmtree(str(work.path.joinpath("Corrected")), ignore_errors=True)
+        except Exception:
+            self.abort()
+            raise
+
+        if self.staged:
+            self.staged.finish()  # copy outputs back in the background
+            self.staged = None
+
+        if P.compressRaw:
+            with self.recorder.span("compress"):
+                self.exp.compress()
 
-    if P.mergeMIPs:
-        exp.mergemips()
+        if P.writeLog:
+            write_processing_log(self.exp, P, self.recorder)
 
-    # if P.mergeMIPsraw:
-    #   if exp.path.joinpath('Deskewed').is_dir():
-    #       exp.mergemips('Deskewed')
+    def abort(self):
+        """clean up after a failed stage"""
+        if self.staged:
+            self.staged.cleanup()
+            self.staged = None
 
-    # if we did camera correction, move the resulting processed folders to
-    # the parent folder, and optionally delete the corrected folder
-    if P.moveCorrected and exp.path.name == "Corrected":
-        move_corrected(str(exp.path))
-        exp.path = exp.path.parent
+    def run(self):
+        """run all processing stages"""
+        try:
+            self.correct()
+            self.deconvolve()
+        except Exception:
+            self.abort()
+            raise
+        self.finish()
+        logger.debug("Process func finished.")
 
-    if not P.keepCorrected:
-        shutil.rmtree(str(exp.path.joinpath("Corrected")), ignore_errors=True)
 
-    if P.compressRaw:
-        exp.compress()
+def metrics_path(exp):
+    """Path of the ProcessingMetrics.jsonl file of an LLSdir."""
+    return exp.path.joinpath(f"{exp.basename}_{config.__METRICSLOG__}")
 
-    if P.writeLog:
-        outname = str(exp.path.joinpath(f"{exp.basename}_{config.__OUTPUTLOG__}"))
-        with open(outname, "w") as outfile:
-            json.dump(P, outfile, cls=util.paramEncoder)
 
-    logger.debug("Process func finished.")
-    return
+def write_processing_log(exp, P, recorder=None):
+    """Write the processing parameters to the ProcessingLog.txt of an LLSdir.
 
+    With a :class:`llspy.metrics.Recorder`, the summary of the processing
+    stages is added under the "metrics" key, and logged.
+    """
+    log = dict(P)
+    if recorder is not None and recorder.spans:
+        log["metrics"] = recorder.summary()
+        logger.info(
+            f"Processing stages of {exp.basename}:\n{recorder.format_summary()}"
+        )
+    outname = str(exp.path.joinpath(f"{exp.basename}_{config.__OUTPUTLOG__}"))
+    with open(outname, "w") as outfile:
+        json.dump(log, outfile, cls=util.paramEncoder)
+
+
+def process(exp, binary=None, **kwargs):
+    """Process LLS experiment with cudaDeconv, output results to file.
+
+    Args:
+        exp (:obj:`str`, LLSdir): path to LLS experiment or LLSdir instance
+        binary (:obj:`str`, optional): specify path to cudaDeconv binary, otherwise
+            gets default bundled binary (if present).
 
-def mergemips(folder, axis, write=True, dx=1, dt=1, delete=True, fpattern=None):
+        **kwargs: any keyword arguments that are recognized by the LLS `Schema list`_.
+
+    Returns:
+        None:  Files are written to disk.
+    """
+    job = ProcessJob(exp, binary, **kwargs)
+    if job.ready:
+        job.run()
+
+
+# channel (the last "ch<n>_" in the name) and axis of a per-stack MIP file
+_MIPFILE = re.compile(r".*ch(\d+)_.*MIP_([xyz])\.tif$")
+
+
+def list_mips(folder):
+    """Group the per-stack MIP files of a folder by axis and channel.
+
+    The folder is listed once, merged comboMIP files are left out.
+
+    Returns:
+        dict: {axis: {channel: [paths, sorted by name]}}
+    """
+    mips = {}
+    for name in sorted(os.listdir(str(folder))):
+        match = _MIPFILE.match(name)
+        if match and "comboMIP" not in name:
+            channel, axis = int(match.group(1)), match.group(2)
+            mips.setdefault(axis, {}).setdefault(channel, []).append(
+                plib.Path(folder, name)
+            )
+    return mips
+
+
+def mergemips(
+    folder,
+    axis,
+    write=True,
+    dx=1,
+    dt=1,
+    delete=True,
+    fpattern=None,
+    writer=None,
+    mips=None,
+    workers=4,
+):
     """combine folder of MIPs into a single multi-channel time stack.
-    return dict with keys= axes(x,y,z) and values = numpy array
+    return the TZCYX numpy array
+
+    The MIPs are read by ``workers`` threads straight into a preallocated
+    array, so merging needs little more memory than the merged stack itself.
+    Pass the result of :func:`list_mips` as ``mips`` to merge several axes of
+    a folder with a single directory listing.
+
+    If an :class:`~llspy.tiffio.AsyncTiffWriter` is provided, the merged file
+    is written in the background, and the individual MIPs are only deleted
+    once it has been written.
     """
     if not fpattern:
         global __FPATTERN__
@@ -496,38 +907,33 @@ def mergemips(folder, axis, write=True, dx=1, dt=1, delete=True, fpattern=None):
     folder = plib.Path(folder)
     if not folder.is_dir():
         raise OSError(f"MIP folder does not exist: {folder!s}")
+    if mips is None:
+        mips = list_mips(folder)
 
     try:
-        filelist = []
-        tiffs = []
-        channelCounts = []
-        c = 0
-        while True:
-            channelFiles = sorted(folder.glob(f"*ch{c}_*MIP_{axis}.tif"))
-            if not len(channelFiles):
-                break  # no MIPs in this channel
-                # this assumes that there are no gaps in the channels (i.e. ch1, ch3 but not 2)
-            for file in channelFiles:
-                tiffs.append(tf.imread(str(file)))
-                filelist.append(file)
-            channelCounts.append(len(channelFiles))
-            c += 1
-        if not len(filelist):
+        # this assumes that there are no gaps in the channels (i.e. ch1, ch3 but not 2)
+        channels = mips.get(axis, {})
+        channelFiles = []
+        while len(channelFiles) in channels:
+            channelFiles.append(channels[len(channelFiles)])
+        if not channelFiles:
             return None  # there were no MIPs for this axis
-        if c > 0:
-            nt = np.max(channelCounts)
-
-            if len(set(channelCounts)) > 1:
-                raise ValueError(
-                    "Cannot merge MIPS with different number of "
-                    "timepoints per channel"
-                )
-            if len(tiffs) != c * nt:
-                raise ValueError("Number of images does not equal nC * nT")
-
-            stack = np.stack(tiffs)
-            stack = stack.reshape((c, 1, nt, stack.shape[-2], stack.shape[-1]))  # TZCYX
-            stack = np.transpose(stack, (2, 1, 0, 3, 4))
+        c = len(channelFiles)
+        channelCounts = [len(files) for files in channelFiles]
+        nt = np.max(channelCounts)
+        if len(set(channelCounts)) > 1:
+            raise ValueError(
+                "Cannot merge MIPS with different number of timepoints per channel"
+            )
+        filelist = [file for files in channelFiles for file in files]
+
+        shape, dtype = util.imread(str(filelist[0]), header_only=True)
+        stack = np.empty((nt, 1, c, *shape[-2:]), dtype)  # TZCYX
+        read_into(
+            [channelFiles[ch][t] for t in range(nt) for ch in range(c)],
+            [stack[t, 0, ch] for t in range(nt) for ch in range(c)],
+            workers=workers,
+        )
 
         if write:
             # FIXME: this is getting ugly
@@ -535,19 +941,21 @@ def mergemips(folder, axis, write=True, dx=1, dt=1, delete=True, fpattern=None):
                 str(filelist[0]), "basename", pattern=fpattern
             )
             cor = "_COR" if "_COR" in str(filelist[0]) else ""
-            axis = str(filelist[0]).split("MIP_")[1][0]
             _, ext = os.path.splitext(filelist[0])
-            if "decon" in str(folder).lower():
-                miptype = "_decon_"
-            elif "deskewed" in str(folder).lower():
-                miptype = "_deskewed_"
-            else:
-                miptype = "_"
-            outname = basename + cor + miptype + "comboMIP_" + axis + ext
-            util.imsave(stack, str(folder.joinpath(outname)), dx=dx, dt=dt)
+            outname = combo_name(folder, basename + cor, axis, ext)
 
-        if delete:
-            [file.unlink() for file in filelist if "comboMIP" not in str(file)]
+        def cleanup(*args):
+            if delete:
+                [file.unlink() for file in filelist]
+
+        if write and writer is not None:
+            writer.submit(
+                stack, str(folder.joinpath(outname)), callback=cleanup, dx=dx, dt=dt
+            )
+        else:
+            if write:
+                util.imsave(stack, str(folder.joinpath(outname)), dx=dx, dt=dt)
+            cleanup()
 
         return stack
 
@@ -831,17 +1239,9 @@ class LLSdir:
             self.parameters.duration = []
 
     def read_tiff_header(self):
-        with warnings.catch_warnings():
-            warnings.simplefilter("ignore")
-            with tf.TiffFile(self.tiff.raw[0]) as firstTiff:
-                self.parameters.shape = firstTiff.series[0].shape
-                try:
-                    self.tiff.bit_depth = firstTiff.pages[0].bitspersample
-                except AttributeError:
-                    try:
-                        self.tiff.bit_depth = firstTiff.pages[0].bits_per_sample
-                    except AttributeError:
-                        self.tiff.bit_depth = 16
+        shape, dtype = util.imread(self.tiff.raw[0], header_only=True)
+        self.parameters.shape = shape
+        self.tiff.bit_depth = dtype.itemsize * 8
         (
             self.parameters.nz,
             self.parameters.ny,
@@ -910,6 +1310,11 @@ class LLSdir:
         else:
             subfolders.append("MIPs")
 
+        stores = self._output_stores()
+        subfolders += [p.name for p in stores if p.is_dir()]
+        for store in stores:
+            if store.is_file():
+                store.unlink()
         for folder in subfolders:
             if self.path.joinpath(folder).exists():
                 try:
@@ -923,9 +1328,9 @@ class LLSdir:
                     logger.error(e)
                     return 0
         try:
-            i = self.path.glob("*" + config.__OUTPUTLOG__)
-            for n in i:
-                n.unlink()
+            for log in (config.__OUTPUTLOG__, config.__METRICSLOG__):
+                for n in self.path.glob("*" + log):
+                    n.unlink()
         except Exception:
             pass
         return 1
@@ -1107,30 +1512,73 @@ class LLSdir:
             subdir = self.path
 
         # the "**" pattern means this directory and all subdirectories, recursively
-        for MIPdir in subdir.glob("**/MIPs/"):
-            # get dict with keys= axes(x,y,z) and values = numpy array
-            try:
-                interval = self.parameters.interval[0]
-            except IndexError:
-                interval = 0
-            for axis in ["z", "y", "x"]:
-                mergemips(
-                    MIPdir,
-                    axis,
-                    dx=self.parameters.dx,
-                    dt=interval,
-                    fpattern=self.fname_pattern,
-                )
+        # each merged file is written while the next axis is being read
+        with AsyncTiffWriter() as writer:
+            for MIPdir in subdir.glob("**/MIPs/"):
+                # get dict with keys= axes(x,y,z) and values = numpy array
+                try:
+                    interval = self.parameters.interval[0]
+                except IndexError:
+                    interval = 0
+                mips = list_mips(MIPdir)
+                for axis in ["z", "y", "x"]:
+                    mergemips(
+                        MIPdir,
+                        axis,
+                        dx=self.parameters.dx,
+                        dt=interval,
+                        fpattern=self.fname_pattern,
+                        writer=writer,
+                        mips=mips,
+                    )
 
     def process(self, filepattern, otf, indir=None, binary=None, **opts):
         if binary is None:
-            binary = CUDAbin()
+            binary = get_cudabin()
 
         if indir is None:
             indir = str(self.path)
         output = binary.process(indir, filepattern, otf, **opts)
         return output
 
+    def as_array(self, cache_size=8, memmap=True):
+        """Return a lazy TCZYX :class:`~llspy.lazyarray.LLSArray` of the raw data.
+
+        Stacks are only read when indexed (memory-mapped when possible), and
+        the ``cache_size`` most recently read stacks are kept in memory.
+        """
+        from .lazyarray import LLSArray
+
+        return LLSArray.from_llsdir(self, cache_size=cache_size, memmap=memmap)
+
+    def _output_stores(self):
+        """chunked output stores (see the outputFormat option) in the folder"""
+        return sorted(
+            p
+            for suffix in pipeline.STORE_SUFFIXES.values()
+            for p in self.path.glob("*" + suffix)
+        )
+
+    def output_array(self, image="GPUdecon", level=0):
+        """Return a lazy TCZYX array of processed data in a chunked output store.
+
+        ``image`` is the output folder it replaces (GPUdecon, Deskewed or
+        Corrected) and ``level`` the resolution level (of OME-Zarr stores).
+        See :mod:`llspy.zarrio` and :mod:`llspy.hdf5io`.
+        """
+        stores = self._output_stores()
+        if not stores:
+            raise FileNotFoundError(f"No chunked output store in {self.path}")
+        if stores[0].suffix == ".h5":
+            if level:
+                raise ValueError("HDF5 outputs have a single resolution level")
+            from .hdf5io import open_image
+
+            return open_image(stores[0], image)
+        from .zarrio import open_image
+
+        return open_image(stores[0], image, level)
+
     def get_t(self, t):
         return parse.filter_t(self.tiff.raw, t)
 
@@ -1192,8 +1640,10 @@ class LLSdir:
             return
         # defaults background and=100, pad=100, sigma=2
         bgrd = []
+        # detect_background only looks at a single plane, so only read that one
+        plane = 1 if (self.parameters.nz or 0) > 1 else 0
         for c in cRange:
-            i = util.imread(self.get_files(c=c)[0]).squeeze()
+            i = util.imread(self.get_files(c=c)[0], planes=plane)
             bgrd.append(arrayfun.detect_background(i))
         # self.parameters.background = bgrd
         return bgrd
@@ -1207,6 +1657,7 @@ class LLSdir:
         trimZ=(0, 0),
         trimY=(0, 0),
         trimX=(0, 0),
+        processes=None,
         **kwargs,
     ):
         trim = (trimZ, trimY, trimX)
@@ -1235,8 +1686,16 @@ class LLSdir:
                     outname = outname.replace(".tif", "_COR.tif")
                 g.append((f, outname, self.parameters.dx, bgrd, trim, medianFilter))
 
-        with Pool(processes=cpu_count()) as pool:
-            pool.map(unbundle, g)
+        if medianFilter:
+            with cpu_pool(processes) as pool:
+                pool.map(unbundle, g)
+        else:
+            # trimming alone is I/O bound: overlap reads and writes instead
+            planes = _untrimmed_planes(g[0][0], trimZ) if g and any(trimZ) else None
+            prefetch = StackPrefetcher([[args[0]] for args in g], planes=planes)
+            with AsyncTiffWriter() as writer:
+                for args, (_, (stack,)) in zip(g, prefetch):
+                    filter_stack(*args, writer=writer, stack=stack)
 
         return outpath
 
@@ -1249,9 +1708,14 @@ class LLSdir:
         trimZ=(0, 0),
         trimY=(0, 0),
         trimX=(0, 0),
+        processes=None,
         **kwargs,
     ):
-        """Correct flash artifact, writing files to Corrected dir."""
+        """Correct flash artifact, writing files to Corrected dir.
+
+        ``processes`` limits the number of processes used by the "parallel"
+        target (default: one per CPU).
+        """
         if not self.has_settings:
             raise LLSpyError("Cannot correct Flash pixels without settings.txt file")
         if not isinstance(camparamsPath, CameraParameters):
@@ -1301,15 +1765,11 @@ class LLSdir:
                 (t, camparams, outpath, medianFilter, trimZ, trimY, trimX)
                 for t in timegroups
             ]
-            with Pool(processes=cpu_count()) as pool:
+            with cpu_pool(processes, jit=[calc_correction.name]) as pool:
                 pool.map(unwrapper, g)
+            return outpath
 
-        elif flashCorrectTarget == "cpu":
-            for t in timegroups:
-                correctTimepoint(
-                    t, camparams, outpath, medianFilter, trimZ, trimY, trimX
-                )
-        elif flashCorrectTarget == "cuda" or flashCorrectTarget == "gpu":
+        if flashCorrectTarget == "cuda" or flashCorrectTarget == "gpu":
             camparams.init_CUDAcamcor(
                 (
                     self.parameters.nz * self.parameters.nc,
@@ -1317,24 +1777,55 @@ class LLSdir:
                     self.parameters.nx,
                 )
             )
-            for t in timegroups:
-                correctTimepoint(
-                    t, camparams, outpath, medianFilter, trimZ, trimY, trimX, "cuda"
-                )
+            target = "cuda"
         else:
-            for t in timegroups:
+            target = "cpu"
+
+        # correction of timepoint t overlaps the reading of timepoint t+1
+        # and the writing of timepoint t-1.  correct_stacks copies its
+        # input, so the read buffers can be recycled
+        prefetch = StackPrefetcher(timegroups, recycle=True)
+        with AsyncTiffWriter() as writer:
+            for t, stacks in prefetch:
                 correctTimepoint(
-                    t, camparams, outpath, medianFilter, trimZ, trimY, trimX
+                    t,
+                    camparams,
+                    outpath,
+                    medianFilter,
+                    trimZ,
+                    trimY,
+                    trimX,
+                    target,
+                    writer=writer,
+                    stacks=stacks,
                 )
         return outpath
 
-    def register(self, regRefWave, regMode, regCalibPath, discard=False):
+    def register(
+        self,
+        regRefWave,
+        regMode,
+        regCalibPath,
+        discard=False,
+        callback=None,
+        mergeMIPs=False,
+        **kwargs,
+    ):
+        """Register all non-reference channels in the GPUdecon/Deskewed folders.
+
+        ``callback`` is called with the path of each file as it is registered,
+        remaining kwargs are passed to :func:`register_folder`.
+
+        With ``mergeMIPs``, the MIPs of every folder are merged from the
+        registered stacks while they are in memory, and replace its (not
+        registered) MIP files.
+        """
         if self.parameters.nc < 2:
             logger.error("Cannot register single channel dataset")
             return
 
         regObj = get_regObj(regCalibPath)
-        if isinstance(regObj, (RegDir, RegFile)) and regObj.isValid:
+        if isinstance(regObj, (RegDir, _fiducialreg().RegFile)) and regObj.isValid:
             voxsize = [self.parameters.dzFinal, self.parameters.dx, self.parameters.dx]
             subdirs = [
                 x
@@ -1342,12 +1833,48 @@ class LLSdir:
                 if x.is_dir() and x.name in ("GPUdecon", "Deskewed")
             ]
             for D in subdirs:
+                mipfiles = {}
+                mips = None
+                if mergeMIPs and D.joinpath("MIPs").is_dir():
+                    mipfiles = list_mips(D.joinpath("MIPs"))
+                    if mipfiles:
+                        mips = MIPAccumulator([a in mipfiles for a in "xyz"])
                 register_folder(
-                    D, regRefWave, regMode, regObj, voxsize, discard=discard
+                    D,
+                    regRefWave,
+                    regMode,
+                    regObj,
+                    voxsize,
+                    discard=discard,
+                    callback=callback,
+                    mips=mips,
+                    **kwargs,
                 )
+                if mips is not None:
+                    self._write_registered_mips(D.joinpath("MIPs"), mips, mipfiles)
         else:
             logger.error("Registration Calibration path not valid" f"{regCalibPath}")
 
+    def _write_registered_mips(self, mipdir, mips, mipfiles):
+        """write comboMIPs of registered data, replacing the per-stack MIPs"""
+        paths = [
+            path
+            for channels in mipfiles.values()
+            for files in channels.values()
+            for path in files
+        ]
+        basename = parse.parse_filename(
+            paths[0].name, "basename", pattern=self.fname_pattern
+        )
+        cor = "_COR" if "_COR" in paths[0].name else ""
+        try:
+            interval = self.parameters.interval[0]
+        except IndexError:
+            interval = 0
+        mips.write(mipdir, basename + cor, dx=self.parameters.dx, dt=interval)
+        for path in paths:
+            path.unlink()
+
     def toJSON(self):
         import json
 
@@ -1428,7 +1955,7 @@ class RegDir(LLSdir):
         for k, v in D.items():
             setattr(self, k, v)
         super().__init__(D["path"])
-        self._cloudset = CloudSet().fromJSON(D["_cloudset"])
+        self._cloudset = _fiducialreg().CloudSet().fromJSON(D["_cloudset"])
         return self
 
     def _deskewed(self, dz=None, dx=None, angle=None):
@@ -1448,7 +1975,7 @@ class RegDir(LLSdir):
         """actually generates the fiducial cloud"""
         if "_cloudset" in dir(self) and not redo:
             return self._cloudset
-        self._cloudset = CloudSet(
+        self._cloudset = _fiducialreg().CloudSet(
             self._deskewed() if self.deskew else self.data,
             labels=self.waves,
             dx=self.parameters.dx,
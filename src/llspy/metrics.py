@@ -0,0 +1,256 @@
+"""Lightweight timing and resource instrumentation of processing stages.
+
+A :class:`Recorder` collects :class:`Span` measurements, one per processing
+stage (decompression, flash correction, deconvolution, registration, ...)::
+
+    recorder = Recorder("exp_ProcessingMetrics.jsonl", experiment="exp")
+    with recorder.span("correct"):
+        ...
+    recorder.summary()
+
+Every span measures wall time, CPU time (of this process and of its waited-for
+child processes, e.g. cudaDeconv or the correction pool), the bytes read and
+written by this process and its peak resident memory, and is appended as a
+JSON line to the metrics file, if any.  Byte counts come from /proc/self/io
+(or psutil, if installed) and include all threads of the process; they are
+None where neither is available.  Peak memory is the high-water mark of the
+process (and its children) when the span ends.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("wall", "cpu", "read_bytes", "write_bytes")
+
+
+def cpu_time():
+    """CPU time in seconds used by this process and its waited-for children."""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def io_counters():
+    """(bytes read, bytes written) by this process so far, or (None, None)."""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["rchar"]), int(fields["wchar"])
+    except (OSError, KeyError, ValueError):
+        pass
+    try:
+        import psutil
+
+        counters = psutil.Process().io_counters()
+        return counters.read_bytes, counters.write_bytes
+    except Exception:
+        return None, None
+
+
+def peak_rss():
+    """Peak resident memory in bytes of this process or its children."""
+    try:
+        import resource
+    except ImportError:  # windows
+        try:
+            import psutil
+
+            return psutil.Process().memory_info().peak_wset
+        except Exception:
+            return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Span:
+    """Measurement of one stage, started on creation.
+
+    Usually created with :meth:`Recorder.span`, as a context manager or, for stages
+    that end in a callback, stopped explicitly with :meth:`stop`.  Extra
+    attributes, such as the number of files processed, can be added to
+    :attr:`attrs` before the span is stopped.
+    """
+
+    def __init__(self, name, recorder=None, **attrs):
+        self.name = name
+        self.recorder = recorder
+        self.attrs = attrs
+        self.result = None
+        self.thread = threading.get_ident()
+        self._start = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = cpu_time()
+        self._io = io_counters()
+        if recorder is not None:
+            recorder._open(self)
+
+    def stop(self, error=None):
+        """Stop the span and hand it to its recorder; returns the result dict."""
+        if self.result is not None:
+            return self.result
+        read, written = io_counters()
+        self.result = {
+            "stage": self.name,
+            "start": self._start,
+            "wall": time.perf_counter() - self._wall,
+            "cpu": cpu_time() - self._cpu,
+            "read_bytes": None if read is None else read - self._io[0],
+            "write_bytes": None if written is None else written - self._io[1],
+            "peak_rss": peak_rss(),
+            **self.attrs,
+        }
+        if error is not None:
+            self.result["error"] = error if isinstance(error, str) else repr(error)
+        if self.recorder is not None:
+            self.recorder._close(self)
+            self.recorder.add(self.result)
+        return self.result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop(exc)
+
+
+class Recorder:
+    """Collects spans and writes them to a JSON-lines metrics file.
+
+    Args:
+        path (str): metrics file, appended to.  Spans recorded before a path
+            is set with :meth:`set_path` are written when it is set.
+        **context: added to every event, e.g. the experiment name.
+    """
+
+    def __init__(self, path=None, **context):
+        self.path = None
+        self.context = context
+        self.spans = []
+        self._running = []
+        self._lock = threading.Lock()
+        if path is not None:
+            self.set_path(path)
+
+    def set_path(self, path):
+        with self._lock:
+            self.path = str(path)
+            self._write(self.spans)
+
+    def _write(self, spans):
+        if self.path is None or not spans:
+            return
+        try:
+            with open(self.path, "a") as f:
+                for span in spans:
+                    f.write(json.dumps({**self.context, **span}) + "\n")
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {self.path}: {e}")
+
+    def _open(self, span):
+        with self._lock:
+            self._running.append(span)
+
+    def _close(self, span):
+        with self._lock:
+            if span in self._running:
+                self._running.remove(span)
+
+    def current_stage(self, thread=None):
+        """Name of the innermost running span of a thread (by ident).
+
+        Falls back to the innermost running span of any thread, as helper
+        threads (e.g. readers) work for the stage that started them.
+        Returns None if no span is running.
+        """
+        with self._lock:
+            running = list(self._running)
+        for span in reversed(running):
+            if span.thread == thread:
+                return span.name
+        return running[-1].name if running else None
+
+    def add(self, result):
+        with self._lock:
+            self.spans.append(result)
+            self._write([result])
+
+    def span(self, name, **attrs):
+        """Start a :class:`Span`.
+
+        Use it as a context manager, or call its ``stop()`` method when the
+        stage is done.
+        """
+        return Span(name, self, **attrs)
+
+    def iterate(self, name, iterable, **attrs):
+        """Yield from iterable, recording the time spent waiting for each item."""
+        it = iter(iterable)
+        while True:
+            span = self.span(name, **attrs)
+            try:
+                item = next(it)
+            except StopIteration:
+                self._close(span)
+                return
+            span.stop()
+            yield item
+
+    def summary(self):
+        """Totals per stage, in order of first occurrence, plus "total".
+
+        The wall time of "total" is the time from the start of the first span
+        to the end of the last one, so overlapping stages are not counted
+        twice.
+
+        Returns:
+            dict: {stage: {"count", "wall", "cpu", "read_bytes", "write_bytes",
+            "peak_rss"}}
+        """
+        with self._lock:
+            spans = list(self.spans)
+        stages = {}
+        for name in [s["stage"] for s in spans] + ["total"]:
+            if name in stages:
+                continue
+            group = (
+                spans if name == "total" else [s for s in spans if s["stage"] == name]
+            )
+            if not group:
+                continue
+            totals = {"count": len(group)}
+            for field in FIELDS:
+                values = [s[field] for s in group]
+                totals[field] = None if None in values else sum(values)
+            totals["peak_rss"] = max(s["peak_rss"] or 0 for s in group) or None
+            stages[name] = totals
+        if spans:
+            end = max(s["start"] + s["wall"] for s in spans)
+            stages["total"]["wall"] = end - min(s["start"] for s in spans)
+        return stages
+
+    def format_summary(self):
+        """The summary as a human readable table."""
+        lines = [
+            f"{'stage':<14}{'n':>4}{'wall (s)':>10}{'cpu (s)':>10}"
+            f"{'read (MB)':>11}{'written (MB)':>14}{'peak (MB)':>11}"
+        ]
+
+        def mb(v):
+            return "-" if v is None else f"{v / 1e6:.1f}"
+
+        for name, s in self.summary().items():
+            lines.append(
+                f"{name:<14}{s['count']:>4}{s['wall']:>10.2f}{s['cpu']:>10.2f}"
+                f"{mb(s.get('read_bytes')):>11}{mb(s.get('write_bytes')):>14}"
+                f"{mb(s['peak_rss']):>11}"
+            )
+        return "\n".join(lines)
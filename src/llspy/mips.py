@@ -0,0 +1,148 @@
+"""Max intensity projections of processed stacks, taken in memory.
+
+cudaDeconv writes one MIP file per stack and axis (the ``MIP`` and ``rMIP``
+options), which :func:`llspy.llsdir.mergemips` later reads back and merges
+into one comboMIP hyperstack per axis.  Pipelines that hold the processed
+stacks in memory (the streaming pipeline, preview, the watcher and
+registration) use a :class:`MIPAccumulator` instead: the projections are
+taken while each stack is in memory and written straight to the comboMIP
+files, without per-stack MIP files or any extra reads.
+"""
+
+import logging
+import os
+import threading
+
+import numpy as np
+
+from . import util
+
+logger = logging.getLogger(__name__)
+
+# numpy axis of a ZYX stack that is projected for each MIP axis
+AXES = {"x": 2, "y": 1, "z": 0}
+
+
+def combo_name(folder, basename, axis, ext=".tif"):
+    """Name of the merged MIP file of an axis in folder (as mergemips names it)."""
+    folder = str(folder).lower()
+    if "decon" in folder:
+        miptype = "_decon_"
+    elif "deskewed" in folder:
+        miptype = "_deskewed_"
+    else:
+        miptype = "_"
+    return f"{basename}{miptype}comboMIP_{axis}{ext}"
+
+
+class MIPAccumulator:
+    """Collect the X/Y/Z max projections of stacks as they are processed.
+
+    Projections are kept per (timepoint, channel), so stacks can be added in
+    any order and from several threads.  :meth:`get` and :meth:`write`
+    assemble them into TZCYX hyperstacks of the timepoints and channels that
+    were added.
+
+    Args:
+        axes (tuple): (x, y, z) flags of the projections to take, like the
+            ``MIP`` processing option
+
+    >>> mips = MIPAccumulator(P.MIP)
+    >>> for t, c, stack in processed:
+    ...     mips.add(stack, t, c)
+    >>> mips.write("GPUdecon/MIPs", "cell1", dx=P.drdata)
+    """
+
+    def __init__(self, axes=(1, 1, 1)):
+        self.axes = [axis for axis, flag in zip("xyz", axes) if flag]
+        self.projections = {axis: {} for axis in self.axes}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """number of stacks with projections"""
+        return len({key for mips in self.projections.values() for key in mips})
+
+    def add(self, stack, t, c):
+        """Take the projections of a ZYX stack of timepoint t and channel c."""
+        stack = np.asarray(stack)
+        if stack.ndim != 3:
+            stack = np.squeeze(stack)
+        for axis in self.axes:
+            self.add_projection(axis, stack.max(AXES[axis]), t, c)
+
+    def add_projection(self, axis, mip, t, c):
+        """Add a 2D projection (for instance read from a MIP file)."""
+        with self._lock:
+            self.projections[axis][(t, c)] = np.asarray(mip)
+
+    def get(self, axis):
+        """TZCYX hyperstack of the projections along axis, or None.
+
+        Timepoints and channels are sorted; a channel that is missing for a
+        timepoint is left black.
+        """
+        with self._lock:
+            mips = dict(self.projections.get(axis, {}))
+        if not mips:
+            return None
+        tindex = {t: i for i, t in enumerate(sorted({t for t, _ in mips}))}
+        cindex = {c: i for i, c in enumerate(sorted({c for _, c in mips}))}
+        first = next(iter(mips.values()))
+        out = np.zeros((len(tindex), 1, len(cindex), *first.shape), first.dtype)
+        for (t, c), mip in mips.items():
+            if mip.shape != first.shape:
+                raise ValueError(
+                    f"Cannot merge {axis} MIPs of shape {mip.shape} and {first.shape}"
+                )
+            out[tindex[t], 0, cindex[c]] = mip
+        if len(mips) < len(tindex) * len(cindex):
+            logger.warning(f"Some channels are missing from the {axis} MIPs")
+        return out
+
+    def write(self, folder, basename, writer=None, dx=1, dt=1):
+        """Write one comboMIP file per axis to folder.
+
+        Args:
+            folder (str): output folder, created if necessary.  Its name sets
+                the type of MIP in the filename, like in mergemips.
+            basename (str): experiment basename (with "_COR" if corrected)
+            writer (:obj:`llspy.tiffio.AsyncTiffWriter`): write in the
+                background, otherwise the files are written before returning
+            dx, dt: pixel size and time interval of the ImageJ metadata
+
+        Returns:
+            list: paths of the comboMIP files
+        """
+        paths = []
+        for axis in self.axes:
+            stack = self.get(axis)
+            if stack is None:
+                continue
+            os.makedirs(str(folder), exist_ok=True)
+            path = os.path.join(str(folder), combo_name(folder, basename, axis))
+            if writer is not None:
+                writer.submit(stack, path, dx=dx, dt=dt)
+            else:
+                util.imsave(stack, path, dx=dx, dt=dt)
+            paths.append(path)
+        return paths
+
+    def read(self, folder, basename, timepoints, channels):
+        """Add the projections in comboMIP files written by :meth:`write`.
+
+        Used to continue accumulating after a restart.  Files that don't
+        hold len(timepoints) x len(channels) projections are skipped.
+        """
+        for axis in self.axes:
+            path = os.path.join(str(folder), combo_name(folder, basename, axis))
+            if not os.path.exists(path):
+                continue
+            data = util.imread(path)
+            try:
+                data = data.reshape(len(timepoints), len(channels), *data.shape[-2:])
+            except ValueError:
+                logger.warning(f"Ignoring {path}: unexpected shape {data.shape}")
+                continue
+            for t, planes in zip(timepoints, data):
+                for c, mip in zip(channels, planes):
+                    self.add_projection(axis, mip, t, c)
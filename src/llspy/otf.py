@@ -2,6 +2,7 @@ import ctypes
 import logging
 import os
 import re
+import threading
 from datetime import datetime, timedelta
 
 import numpy as np
@@ -22,35 +23,58 @@ except (ImportError, AttributeError):
     raise ImportError("no pathlib detected. For python2: pip install pathlib2")
 
 
-otflib = load_lib("libradialft")
-
-if not otflib:
-    logger.error("Could not load libradialft!")
-else:
-    try:
-        shared_makeotf = otflib.makeOTF
-        shared_makeotf.restype = ctypes.c_int
-        shared_makeotf.argtypes = [
-            ctypes.c_char_p,
-            ctypes.c_char_p,
-            ctypes.c_int,
-            ctypes.c_float,
-            ctypes.c_int,
-            ctypes.c_bool,
-            ctypes.c_float,
-            ctypes.c_float,
-            ctypes.c_float,
-            ctypes.c_float,
-            ctypes.c_int,
-            ctypes.c_bool,
-        ]
-    except AttributeError as e:
-        logger.warning("Failed to properly import libradialft")
-        logger.error(e)
+# libradialft is loaded by _load on first use (see requireOTFlib)
+_loaded = False
+_lock = threading.Lock()
+
+
+def _load():
+    """Load libradialft once, returning the library (or None if missing)."""
+    global _loaded, otflib, shared_makeotf
+    with _lock:
+        if _loaded:
+            return otflib
+        otflib = load_lib("libradialft")
+        if not otflib:
+            logger.error("Could not load libradialft!")
+        else:
+            try:
+                shared_makeotf = otflib.makeOTF
+                shared_makeotf.restype = ctypes.c_int
+                shared_makeotf.argtypes = [
+                    ctypes.c_char_p,
+                    ctypes.c_char_p,
+                    ctypes.c_int,
+                    ctypes.c_float,
+                    ctypes.c_int,
+                    ctypes.c_bool,
+                    ctypes.c_float,
+                    ctypes.c_float,
+                    ctypes.c_float,
+                    ctypes.c_float,
+                    ctypes.c_int,
+                    ctypes.c_bool,
+                ]
+            except AttributeError as e:
+                logger.warning("Failed to properly import libradialft")
+                logger.error(e)
+        _loaded = True
+    return otflib
+
+
+def __getattr__(name):
+    # e.g. `otf.otflib` loads the library (but the import
+    # machinery probing for e.g. __path__ does not)
+    if not _loaded and not name.startswith("__"):
+        _load()
+        if name in globals():
+            return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def requireOTFlib(func, *args, **kwargs):
     def dec(*args, **kwargs):
+        _load()
         try:
             return func(*args, **kwargs)
         except Exception as e:
@@ -0,0 +1,338 @@
+"""Streaming, in-memory processing of LLS experiments.
+
+The default :func:`llspy.llsdir.process` writes every camera-corrected,
+median-filtered or trimmed stack to a ``Corrected`` folder, which cudaDeconv
+then reads back in.  :func:`stream_process` instead streams the experiment one
+timepoint at a time through a staged pipeline::
+
+    read (prefetched) -> correct -> deskew/decon (GPU) -> MIPs -> write
+
+with bounded queues between the stages, so that intermediates only live in
+memory.  Corrected stacks are only written when ``keepCorrected`` is set.
+
+Outputs are named like those of cudaDeconv, so registration, MIP merging and
+the other post-processing steps work on them unchanged, except that with
+``mergeMIPs`` the projections are merged in memory (see :mod:`llspy.mips`)
+and written as comboMIP files, instead of one MIP file per stack.  Enable it
+with the ``streamPipeline`` processing option.  It is also used for the
+chunked ``outputFormat`` "zarr" and "hdf5" (see :mod:`llspy.zarrio` and
+:mod:`llspy.hdf5io`), which write all stacks of an experiment to a single
+store instead of tiff files.
+"""
+
+import logging
+import os
+import queue
+import threading
+
+import numpy as np
+
+from . import arrayfun, parse
+from . import libcudawrapper as libcu
+from .camera import CameraParameters, selectiveMedianFilter
+from .mips import MIPAccumulator
+from .tiffio import AsyncTiffWriter, StackPrefetcher
+
+logger = logging.getLogger(__name__)
+
+_SENTINEL = object()
+
+#: name of the output store of the chunked outputFormats, after the basename
+STORE_SUFFIXES = {"zarr": ".ome.zarr", "hdf5": "_processed.h5"}
+
+
+def can_stream(P):
+    """whether the (local) parameters P can be processed by stream_process"""
+    if P.bleachCorrection:
+        logger.info("bleachCorrection is not supported in the streaming pipeline")
+        return False
+    if P.nIters == 0 and P.rotate:
+        logger.info("rotation without deconvolution requires cudaDeconv")
+        return False
+    return True
+
+
+def should_stream(P):
+    """whether P is processed by stream_process: with ``streamPipeline`` or a
+    chunked ``outputFormat`` (which only the streaming pipeline writes)"""
+    chunked = P.outputFormat != "tiff"
+    if not (P.streamPipeline or chunked):
+        return False
+    if can_stream(P):
+        return True
+    if chunked:
+        logger.warning(
+            f"{P.outputFormat} output needs the streaming pipeline, writing tiffs"
+        )
+    return False
+
+
+def output_store(exp, P):
+    """path of the chunked output store of exp, or None for tiff output"""
+    if P.outputFormat not in STORE_SUFFIXES:
+        return None
+    basename = parse.parse_filename(
+        str(exp.tiff.raw[0]), "basename", pattern=exp.fname_pattern
+    )
+    return exp.path.joinpath(basename + STORE_SUFFIXES[P.outputFormat])
+
+
+def open_writer(exp, P, maxqueue=4):
+    """background writer of the outputs of exp, for P.outputFormat"""
+    store = output_store(exp, P)
+    if store is None:
+        return AsyncTiffWriter(maxqueue=maxqueue)
+    if P.outputFormat == "hdf5":
+        from .hdf5io import HDF5Writer as Writer
+    else:
+        from .zarrio import ZarrWriter as Writer
+
+    try:
+        interval = exp.parameters.interval[0]
+    except IndexError:
+        interval = 1
+    return Writer(
+        store,
+        timepoints=sorted(exp.parameters.tset),
+        channels=sorted(exp.parameters.channels),
+        dt=interval,
+        fpattern=exp.fname_pattern,
+        maxqueue=maxqueue,
+    )
+
+
+def _to_uint16(stack):
+    return np.clip(stack, 0, np.iinfo(np.uint16).max).astype(np.uint16)
+
+
+def _write_mips(writer, stack, flags, folder, basename, dx, mips=None, tc=None):
+    """write max projections of ZYX stack for each of the (x, y, z) flags,
+    or add them to a MIPAccumulator at (t, c) = tc"""
+    if mips is not None:
+        mips.add(stack, *tc)
+        return
+    for axis, flag, npaxis in zip("xyz", flags, (2, 1, 0)):
+        if flag:
+            os.makedirs(folder, exist_ok=True)
+            outname = os.path.join(folder, basename.replace(".tif", f"_MIP_{axis}.tif"))
+            writer.submit(stack.max(npaxis), outname, dx=dx)
+
+
+def stream_process(exp, P, maxqueue=2, callback=None):
+    """Process LLSdir exp with (local) parameters P, without disk intermediates.
+
+    Args:
+        exp (LLSdir): experiment to process
+        P (dict): validated local parameters, as returned by ``exp.localParams``
+        maxqueue (int): max number of timepoints waiting between two stages
+        callback (callable): called with the path of each raw file once it
+            has been processed
+    """
+    cRange = list(P.cRange)
+    trim = (P.trimZ, P.trimY, P.trimX)
+    correct = P.correctFlash and hasattr(exp, "settings")
+    if P.correctFlash and not correct:
+        logger.warning("Cannot perform Flash Correction without settings.txt file")
+    cortag = "_COR" if (correct or P.medianFilter) else ""
+    corrfolder = str(exp.path.joinpath("Corrected"))
+    deconfolder = str(exp.path.joinpath("GPUdecon"))
+    deskewfolder = str(exp.path.joinpath("Deskewed"))
+    deconvolve = P.nIters > 0
+
+    # flash correction depends on the order in which all channels were
+    # acquired, so all of them are read (and corrected) when it is on
+    channels = sorted(exp.parameters.channels.keys()) if correct else cRange
+
+    if correct:
+        camparams = CameraParameters(P.camparamsPath)
+        camparams = camparams.get_subroi(exp.settings.camera.roi)
+        target = P.flashCorrectTarget
+        if target in ("cuda", "gpu"):
+            camparams.init_CUDAcamcor(
+                (
+                    exp.parameters.nz * len(channels),
+                    exp.parameters.ny,
+                    exp.parameters.nx,
+                )
+            )
+        else:
+            # the multiprocessing target makes no sense for a single timepoint
+            target = "cpu"
+
+    # one group of files per timepoint, keeping track of each file's index
+    # into cRange (which is how P.background, P.otfs, etc.. are ordered)
+    groups, indices, timepoints = [], [], []
+    for t in P.tRange:
+        files, idx = [], []
+        for c in channels:
+            f = exp.get_files(t=t, c=c)
+            if f:
+                files.append(f[0])
+                idx.append(cRange.index(c) if c in cRange else None)
+        if files:
+            groups.append(files)
+            indices.append(idx)
+            timepoints.append(t)
+    if not groups:
+        logger.warning(f"No files to process in {exp.path}")
+        return
+
+    # with mergeMIPs, the projections go straight into comboMIP files
+    decon_mips = raw_mips = None
+    if P.mergeMIPs:
+        decon_mips = MIPAccumulator(P.MIP)
+        raw_mips = MIPAccumulator(P.rMIP)
+
+    corrq = queue.Queue(maxsize=maxqueue)
+    errors = []
+
+    def corrector(writer):
+        """read and correct timepoints, feeding them to the GPU stage"""
+        try:
+            prefetch = StackPrefetcher(groups)
+            for (files, stacks), idx, t in zip(prefetch, indices, timepoints):
+                if errors:
+                    break
+                if correct:
+                    stacks = camparams.correct_stacks(
+                        stacks, P.medianFilter, trim, target
+                    )
+                else:
+                    if P.medianFilter:
+                        stacks = [
+                            selectiveMedianFilter(s, P.background[i])[0]
+                            for s, i in zip(stacks, idx)
+                        ]
+                    if any(any(i) for i in trim):
+                        stacks = [arrayfun.trimedges(s, trim) for s in stacks]
+                if P.keepCorrected and (
+                    correct or P.medianFilter or any(map(any, trim))
+                ):
+                    os.makedirs(corrfolder, exist_ok=True)
+                    for f, s in zip(files, stacks):
+                        name = os.path.basename(f).replace(".tif", cortag + ".tif")
+                        writer.submit(
+                            np.squeeze(s),
+                            os.path.join(corrfolder, name),
+                            dx=exp.parameters.dx,
+                            dz=1,
+                        )
+                if not correct:
+                    # camera correction also does background subtraction
+                    stacks = [
+                        arrayfun.sub_background(s, P.background[i])
+                        for s, i in zip(stacks, idx)
+                    ]
+                corrq.put((files, idx, stacks, t))
+        except Exception as e:
+            errors.append(e)
+        finally:
+            corrq.put(_SENTINEL)
+
+    def process_stack(writer, fname, i, stack, t):
+        basename = os.path.basename(fname).replace(".tif", cortag + ".tif")
+        deskewed = None
+        if deconvolve:
+            opts = {
+                "nIters": P.nIters,
+                "drdata": P.drdata,
+                "dzdata": P.dzdata,
+                "deskew": P.deskew,
+                "rotate": P.rotate,
+                "width": P.width,
+                "shift": P.shift,
+                "background": 0,  # already subtracted
+            }
+            result = libcu.quickDecon(
+                stack, P.otfs[i], savedeskew=P.saveDeskewedRaw, **opts
+            )
+            if P.saveDeskewedRaw:
+                result, deskewed = result
+            if P.uint16:
+                result = _to_uint16(result)
+            if P.saveDecon:
+                os.makedirs(deconfolder, exist_ok=True)
+                writer.submit(
+                    result,
+                    os.path.join(deconfolder, basename.replace(".tif", "_decon.tif")),
+                    dx=P.drdata,
+                    dz=P.dzFinal,
+                )
+            _write_mips(
+                writer,
+                result,
+                P.MIP,
+                os.path.join(deconfolder, "MIPs"),
+                basename,
+                P.drdata,
+                decon_mips,
+                (t, cRange[i]),
+            )
+        elif P.saveDeskewedRaw:
+            if P.deskew:
+                deskewed = libcu.deskewGPU(
+                    stack, P.dzdata, P.drdata, P.deskew, P.width, P.shift, P.padval
+                )
+            else:
+                deskewed = arrayfun.cropX(stack, P.width, P.shift)
+
+        if deskewed is not None:
+            if P.uint16raw:
+                deskewed = _to_uint16(deskewed)
+            os.makedirs(deskewfolder, exist_ok=True)
+            writer.submit(
+                deskewed,
+                os.path.join(deskewfolder, basename.replace(".tif", "_deskewed.tif")),
+                dx=P.drdata,
+                dz=P.dzFinal,
+            )
+            _write_mips(
+                writer,
+                deskewed,
+                P.rMIP,
+                os.path.join(deskewfolder, "MIPs"),
+                basename,
+                P.drdata,
+                raw_mips,
+                (t, cRange[i]),
+            )
+
+    with open_writer(exp, P, maxqueue=2 * maxqueue) as writer:
+        thread = threading.Thread(target=corrector, args=(writer,), daemon=True)
+        thread.start()
+        # the GPU stage runs in this thread: the libcudaDeconv state is global
+        while True:
+            item = corrq.get()
+            if item is _SENTINEL:
+                break
+            if errors:
+                continue  # drain the queue so the corrector can finish
+            files, idx, stacks, t = item
+            try:
+                for fname, i, stack in zip(files, idx, stacks):
+                    if i is not None:
+                        process_stack(writer, fname, i, stack, t)
+                        if callback is not None:
+                            callback(fname)
+            except Exception as e:
+                errors.append(e)
+        thread.join()
+        if errors:
+            raise errors[0]
+        if P.mergeMIPs:
+            basename = parse.parse_filename(
+                groups[0][0], "basename", pattern=exp.fname_pattern
+            )
+            try:
+                interval = exp.parameters.interval[0]
+            except IndexError:
+                interval = 0
+            for mips, folder in ((decon_mips, deconfolder), (raw_mips, deskewfolder)):
+                mips.write(
+                    os.path.join(folder, "MIPs"),
+                    basename + cortag,
+                    writer,
+                    dx=P.drdata,
+                    dt=interval,
+                )
+    logger.debug(f"Streamed {len(groups)} timepoints of {exp.path}")
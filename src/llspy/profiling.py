@@ -0,0 +1,448 @@
+"""Reproducible profiles of preview or process runs of an experiment.
+
+:func:`profile` runs :func:`llspy.llsdir.preview` or :func:`llspy.llsdir.process`
+on a subset of an experiment and writes a bundle, a folder or a zip file, that
+can be attached to a ticket and compared to another with :func:`compare`::
+
+    context.json    machine, package versions, experiment and parameters
+    stages.json     time and resources per stage (see :mod:`llspy.metrics`)
+    metrics.jsonl   every recorded stage
+    functions.json  time per function, sorted by total (cumulative) time
+    functions.txt   the same as a table
+    stacks.folded   sampled stacks, with the stage as root frame, for
+                    flamegraph.pl, speedscope or inferno
+    profile.prof    cProfile statistics (deterministic mode), for pstats or
+                    snakeviz
+
+Functions are named ``path:function`` with the path relative to sys.path, so
+names are comparable between machines and installations.  Stacks are always
+sampled (every ``interval`` seconds, from all threads of the process); in
+sampling mode the function breakdown is estimated from the samples, in
+deterministic mode it comes from cProfile, which only sees the thread that
+calls :func:`profile`.  Work done in subprocesses (e.g. cudaDeconv or the
+correction pool of process) shows up as waiting in the calling thread.
+"""
+
+import collections
+import cProfile
+import json
+import logging
+import os
+import pathlib as plib
+import platform
+import pstats
+import re
+import sys
+import tempfile
+import threading
+import zipfile
+from datetime import datetime
+
+from llspy import __version__, metrics, util
+
+logger = logging.getLogger(__name__)
+
+MODES = ("preview", "process")
+PACKAGES = (
+    "numpy",
+    "scipy",
+    "numba",
+    "tifffile",
+    "scikit-image",
+    "voluptuous",
+    "h5py",
+    "psutil",
+)
+
+# innermost frames of helper threads that are idle (waiting for work)
+IDLE = {
+    "threading.py:wait",
+    "threading.py:_wait_for_tstate_lock",
+    "queue.py:get",
+    "selectors.py:select",
+    "concurrent/futures/thread.py:_worker",
+}
+
+
+def _shorten(filename):
+    """filename relative to its sys.path entry, with forward slashes."""
+    best = filename
+    for entry in sys.path:
+        entry = os.path.join(os.path.abspath(entry or os.curdir), "")
+        if filename.startswith(entry) and len(filename) - len(entry) < len(best):
+            best = filename[len(entry) :]
+    return best.replace(os.sep, "/")
+
+
+def _frame_name(code):
+    return f"{_shorten(code.co_filename)}:{code.co_name}"
+
+
+def _thread_name(name):
+    # numbered names (Thread-3, ThreadPoolExecutor-0_1) differ between runs
+    return re.sub(r"\d+", "N", name)
+
+
+class Sampler(threading.Thread):
+    """Samples the stacks of all threads every interval seconds.
+
+    Every sample is labelled with the stage that runs in the sampled thread
+    according to the recorder (see :meth:`llspy.metrics.Recorder.current_stage`).
+    Helper threads that are idle are skipped, the target thread (the one that
+    runs the profiled code) is always sampled.
+
+    Args:
+        recorder (:obj:`llspy.metrics.Recorder`): recorder of the stages
+        interval (float): seconds between samples
+        target (int): ident of the profiled thread, defaults to the caller
+        root (code): frames of the target thread down to and including the
+            first frame running this code object are left out, so that
+            stacks don't depend on how the profiled code was called
+    """
+
+    def __init__(self, recorder, interval=0.005, target=None, root=None):
+        super().__init__(name="llspy-profile-sampler", daemon=True)
+        self.recorder = recorder
+        self.interval = interval
+        self.target = target or threading.get_ident()
+        self.root = root
+        self.stacks = collections.Counter()
+        self.nsamples = 0
+        self._done = threading.Event()
+        self._names = {}
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+    def sample(self):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == self.ident:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if ident == self.target and code is self.root:
+                    break
+                if code not in self._names:
+                    self._names[code] = _frame_name(code)
+                stack.append(self._names[code])
+                frame = frame.f_back
+            if not stack:
+                continue
+            if ident != self.target and stack[0] in IDLE:
+                continue
+            stage = self.recorder.current_stage(ident) or "(no stage)"
+            thread = _thread_name(names.get(ident, "Thread"))
+            self.stacks[(stage, thread, *reversed(stack))] += 1
+        self.nsamples += 1
+
+    def folded(self):
+        """The samples in the folded format of flamegraph.pl, sorted."""
+        return "".join(
+            f"{';'.join(stack)} {n}\n" for stack, n in sorted(self.stacks.items())
+        )
+
+    def functions(self):
+        """Estimated self and total seconds per function (all threads)."""
+        selftime = collections.Counter()
+        total = collections.Counter()
+        for stack, n in self.stacks.items():
+            frames = stack[2:]
+            selftime[frames[-1]] += n
+            for name in set(frames):
+                total[name] += n
+        return _sorted(
+            {
+                "function": name,
+                "samples": total[name],
+                "self": selftime[name] * self.interval,
+                "total": total[name] * self.interval,
+            }
+            for name in total
+        )
+
+
+def _sorted(functions):
+    return sorted(functions, key=lambda f: (-f["total"], f["function"]))
+
+
+def pstats_functions(stats):
+    """Calls, self and total seconds per function of a pstats.Stats."""
+    functions = collections.defaultdict(lambda: [0, 0.0, 0.0])
+    for (filename, line, func), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        name = func if filename == "~" else f"{_shorten(filename)}:{func}"
+        entry = functions[name]  # functions of the same name are summed
+        entry[0] += calls
+        entry[1] += tottime
+        entry[2] = max(entry[2], cumtime)
+    return _sorted(
+        {"function": name, "calls": calls, "self": tottime, "total": cumtime}
+        for name, (calls, tottime, cumtime) in functions.items()
+    )
+
+
+def format_functions(functions, limit=50):
+    """The function breakdown as a table of the top functions."""
+    count = "calls" if functions and "calls" in functions[0] else "samples"
+    lines = [f"{'total (s)':>10}{'self (s)':>10}{count:>10}  function"]
+    for f in functions[:limit]:
+        lines.append(
+            f"{f['total']:>10.3f}{f['self']:>10.3f}{f[count]:>10}  {f['function']}"
+        )
+    return "\n".join(lines)
+
+
+def package_versions(packages=PACKAGES):
+    """Installed version of every package, None if not installed."""
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:
+        from importlib_metadata import PackageNotFoundError, version
+
+    versions = {"llspy": __version__}
+    for name in packages:
+        try:
+            versions[name] = version(name)
+        except PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def total_memory():
+    """Physical memory in bytes, or None if unknown."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        pass
+    try:
+        import psutil
+
+        return psutil.virtual_memory().total
+    except Exception:
+        return None
+
+
+def gpu_context():
+    """Whether libcudaDecon loads, and the GPUs cudaDeconv reports."""
+    from llspy import cudabinwrapper, libcudawrapper
+
+    context = {"libcudaDecon": bool(libcudawrapper._load())}
+    try:
+        context["gpus"] = cudabinwrapper.gpulist()
+    except Exception as e:
+        logger.debug(f"Could not list GPUs: {e}")
+        context["gpus"] = []
+    return context
+
+
+def machine_context():
+    """Description of this machine and python environment."""
+    return {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "memory": total_memory(),
+        "packages": package_versions(),
+        "gpu": gpu_context(),
+    }
+
+
+def _run(mode, exp, tRange, cRange, recorder, kwargs):
+    # the root frame of the sampled stacks
+    from llspy import llsdir
+
+    if mode == "preview":
+        llsdir.preview(exp, tRange, cRange, recorder=recorder, **kwargs)
+    else:
+        llsdir.process(exp, tRange=tRange, cRange=cRange, recorder=recorder, **kwargs)
+
+
+def profile(
+    exp,
+    output=None,
+    mode="preview",
+    tRange=0,
+    cRange=None,
+    sampling=True,
+    interval=0.005,
+    **kwargs,
+):
+    """Profile preview or process of an experiment and write a bundle.
+
+    Args:
+        exp (:obj:`str`, LLSdir): path to LLS experiment or LLSdir instance
+        output (str): bundle folder, or zip file if it ends with .zip.
+            Defaults to {basename}_profile_{date}.zip in the working directory.
+        mode (str): "preview" (in memory) or "process" (writes the outputs
+            to the experiment, like `lls decon`)
+        tRange, cRange: timepoints and channels to process (None means all)
+        sampling (bool): estimate the function breakdown from the sampled
+            stacks (True) or measure it with cProfile (False)
+        interval (float): seconds between stack samples
+        **kwargs: any keyword arguments that are recognized by the LLS `Schema list`_.
+
+    Returns:
+        pathlib.Path: the bundle.  If processing fails, the bundle is written
+        (with the error in context.json) before the error is raised.
+    """
+    from llspy import llsdir
+
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}, not {mode!r}")
+    if not isinstance(exp, llsdir.LLSdir):
+        exp = llsdir.LLSdir(str(exp))
+    now = datetime.now()
+    if output is None:
+        output = f"{exp.basename}_profile_{now:%Y%m%d-%H%M%S}.zip"
+    output = plib.Path(output)
+
+    recorder = metrics.Recorder(experiment=exp.basename)
+    sampler = Sampler(recorder, interval, root=_run.__code__)
+    profiler = None if sampling else cProfile.Profile()
+    error = None
+    sampler.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        _run(mode, exp, tRange, cRange, recorder, kwargs)
+    except Exception as e:
+        error = e
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        sampler.stop()
+
+    try:
+        params = dict(exp.localParams(tRange=tRange, cRange=cRange, **kwargs))
+    except Exception:
+        params = dict(kwargs, tRange=tRange, cRange=cRange)
+    context = {
+        "created": now.isoformat(timespec="seconds"),
+        "command": {
+            "mode": mode,
+            "tRange": tRange,
+            "cRange": cRange,
+            "profiler": "sampling" if sampling else "deterministic",
+            "interval": interval,
+        },
+        "experiment": {
+            "path": str(exp.path),
+            "basename": exp.basename,
+            "parameters": dict(exp.parameters),
+        },
+        "params": params,
+        "machine": machine_context(),
+        "samples": sampler.nsamples,
+        "error": None if error is None else repr(error),
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bundle = plib.Path(tmp) if output.suffix == ".zip" else output
+        bundle.mkdir(parents=True, exist_ok=True)
+        _write_json(bundle / "context.json", context)
+        _write_json(bundle / "stages.json", recorder.summary())
+        with open(bundle / "metrics.jsonl", "w") as f:
+            for span in recorder.spans:
+                f.write(json.dumps({**recorder.context, **span}) + "\n")
+        if profiler is not None:
+            profiler.dump_stats(str(bundle / "profile.prof"))
+            functions = pstats_functions(pstats.Stats(profiler))
+        else:
+            functions = sampler.functions()
+        _write_json(bundle / "functions.json", functions)
+        (bundle / "functions.txt").write_text(format_functions(functions) + "\n")
+        (bundle / "stacks.folded").write_text(sampler.folded())
+        if output.suffix == ".zip":
+            output.parent.mkdir(parents=True, exist_ok=True)
+            with zipfile.ZipFile(str(output), "w", zipfile.ZIP_DEFLATED) as zf:
+                for path in sorted(bundle.iterdir()):
+                    zf.write(str(path), path.name)
+    logger.info(f"Wrote profile of {exp.basename} to {output}")
+
+    if error is not None:
+        raise error
+    return output
+
+
+def _write_json(path, obj):
+    with open(path, "w") as f:
+        json.dump(obj, f, indent=2, sort_keys=True, cls=util.paramEncoder)
+
+
+def load_bundle(path):
+    """Read the json files of a bundle (folder or zip) into a dict."""
+    path = plib.Path(path)
+    bundle = {}
+    names = ("context.json", "stages.json", "functions.json")
+    if path.is_dir():
+        for name in names:
+            with open(path / name) as f:
+                bundle[plib.Path(name).stem] = json.load(f)
+    else:
+        with zipfile.ZipFile(str(path)) as zf:
+            for name in names:
+                bundle[plib.Path(name).stem] = json.loads(zf.read(name))
+    return bundle
+
+
+def compare(old, new, limit=15):
+    """Compare two bundles: stage times, function times and package versions.
+
+    Args:
+        old, new (str): bundle folders or zip files
+        limit (int): number of functions (largest total time in either
+            bundle) to compare
+
+    Returns:
+        str: a human readable report
+    """
+    old, new = load_bundle(old), load_bundle(new)
+
+    def change(a, b):
+        if a is None or b is None:
+            return f"{'-':>10}"
+        return f"{b - a:>+10.3f}"
+
+    def seconds(v):
+        return f"{'-':>10}" if v is None else f"{v:>10.3f}"
+
+    lines = [f"{'stage':<24}{'old (s)':>10}{'new (s)':>10}{'change':>10}"]
+    stages = list(old["stages"]) + [s for s in new["stages"] if s not in old["stages"]]
+    for stage in stages:
+        a = old["stages"].get(stage, {}).get("wall")
+        b = new["stages"].get(stage, {}).get("wall")
+        lines.append(f"{stage:<24}{seconds(a)}{seconds(b)}{change(a, b)}")
+
+    lines.append("")
+    lines.append(f"{'old (s)':>10}{'new (s)':>10}{'change':>10}  function (total)")
+    totals = [
+        {f["function"]: f["total"] for f in bundle["functions"]}
+        for bundle in (old, new)
+    ]
+    top = sorted(
+        set(totals[0]) | set(totals[1]),
+        key=lambda name: -max(totals[0].get(name, 0), totals[1].get(name, 0)),
+    )[:limit]
+    for name in top:
+        a, b = totals[0].get(name), totals[1].get(name)
+        lines.append(f"{seconds(a)}{seconds(b)}{change(a, b)}  {name}")
+
+    versions = [b["context"]["machine"]["packages"] for b in (old, new)]
+    changed = [
+        f"{name}: {versions[0].get(name)} -> {versions[1].get(name)}"
+        for name in sorted(set(versions[0]) | set(versions[1]))
+        if versions[0].get(name) != versions[1].get(name)
+    ]
+    if changed:
+        lines.append("")
+        lines.append("changed packages:")
+        lines.extend(f"  {c}" for c in changed)
+    return "\n".join(lines)
@@ -0,0 +1,145 @@
+"""Fast discovery of LLS experiment folders in large directory trees.
+
+:func:`find_experiments` replaces ``util.get_subfolders_containing_filepattern``
+followed by ``util.getfoldersize`` for the recursive CLI commands: directories
+are listed concurrently with :func:`os.scandir`, file sizes are taken from the
+``DirEntry.stat()`` results of that same listing, and known output folders are
+never searched for experiments (they are only descended into to size an
+experiment).
+"""
+
+import fnmatch
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .scratch import OUTPUT_DIRS
+
+logger = logging.getLogger(__name__)
+
+SKIP_DIRS = (*OUTPUT_DIRS, "Corrected")
+
+# size is None unless sizes were requested; mtime is that of the folder itself
+Experiment = namedtuple("Experiment", ["path", "size", "mtime"])
+
+
+class _Listing:
+    __slots__ = ("children", "is_exp", "mtime", "nbytes", "path")
+
+    def __init__(self, path, mtime):
+        self.path = path
+        self.mtime = mtime
+        self.nbytes = 0
+        self.is_exp = False
+        self.children = []
+
+
+def _list_dir(listing, pattern, discover, sizing):
+    """List one directory, returning its subdirectory entries.
+
+    The listing is marked as an experiment if ``discover`` and one of its files
+    matches ``pattern``; file sizes are summed when ``sizing`` is requested or
+    the folder turns out to be an experiment and ``sizing is None``.
+    """
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(listing.path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry)
+                    elif entry.is_file():
+                        files.append(entry)
+                except OSError:
+                    continue
+    except OSError as e:
+        logger.warning(f"Could not scan {listing.path}: {e}")
+        return []
+    if discover:
+        listing.is_exp = any(fnmatch.fnmatch(f.name, pattern) for f in files)
+    if sizing or (sizing is None and listing.is_exp):
+        for f in files:
+            try:
+                listing.nbytes += f.stat().st_size
+            except OSError:
+                pass
+    return subdirs
+
+
+def find_experiments(
+    root, pattern="*Settings.txt", level=1, sizes=False, workers=8, skip=SKIP_DIRS
+):
+    """Find all folders below root that contain a file matching pattern.
+
+    Args:
+        root (str): directory to search (included in the search).
+        pattern (str): fnmatch pattern identifying an experiment folder.
+        level (int): how many directory levels below root are searched.
+        sizes (bool): also compute the total size of each experiment folder,
+            including all of its subfolders, in the same pass.
+        workers (int): number of threads listing directories concurrently.
+        skip (tuple): folder names that are never searched for experiments.
+
+    Returns:
+        list: :class:`Experiment` tuples, sorted by path.
+    """
+    root = os.path.abspath(root)
+    listings = []
+
+    def scan(listing, depth, discover, in_exp):
+        # inside an experiment everything is sized, otherwise decide per folder
+        sizing = (True if in_exp else None) if sizes else False
+        subdirs = _list_dir(listing, pattern, discover, sizing)
+        in_exp = in_exp or listing.is_exp
+        jobs = []
+        for entry in subdirs:
+            child_discover = discover and depth < level and entry.name not in skip
+            if not (child_discover or (sizes and in_exp)):
+                continue
+            try:
+                mtime = entry.stat(follow_symlinks=False).st_mtime
+            except OSError:
+                continue
+            child = _Listing(entry.path, mtime)
+            listing.children.append(child)
+            jobs.append((child, depth + 1, child_discover, in_exp))
+        return jobs
+
+    top = _Listing(root, os.stat(root).st_mtime)
+    with ThreadPoolExecutor(workers, thread_name_prefix="lls-scan") as pool:
+        pending = {pool.submit(scan, top, 0, True, False)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for job in future.result():
+                    listings.append(job[0])
+                    pending.add(pool.submit(scan, *job))
+
+    def total(listing):
+        return listing.nbytes + sum(total(c) for c in listing.children)
+
+    found = []
+    for listing in [top, *listings]:
+        if listing.is_exp:
+            size = total(listing) if sizes else None
+            found.append(Experiment(listing.path, size, listing.mtime))
+    return sorted(found)
+
+
+def expand_paths(paths, pattern="*Settings.txt", level=1, sizes=False, workers=8):
+    """Expand a list of folders to the experiment folders they contain.
+
+    Folders that are experiments themselves are kept as they are (and are not
+    searched further), every other folder is searched ``level`` deep.  Returns
+    a dict of {path: :class:`Experiment`} sorted by path, without duplicates.
+    """
+    found = {}
+    for path in paths:
+        if any(fnmatch.fnmatch(f, pattern) for f in os.listdir(path)):
+            exps = find_experiments(path, pattern, 0, sizes, workers)
+        else:
+            exps = find_experiments(path, pattern, level, sizes, workers)
+        found.update((e.path, e) for e in exps)
+    return dict(sorted(found.items()))
@@ -125,6 +125,12 @@ __defaults__ = {
         "duplicate reversed stack prior to decon to reduce Z ringing",
     ),
     "lzw": (False, "use LZW tiff compression"),
+    "streamPipeline": (
+        False,
+        "process in memory, timepoint by timepoint, without writing Corrected/",
+    ),
+    "scratchDir": (None, "fast local directory for intermediate files"),
+    "outputFormat": ("tiff", '{"tiff", "zarr", "hdf5"} format of processed stacks'),
     # 'bRollingBall': self.backgroundRollingRadio.
 }
 
@@ -256,6 +262,17 @@ __validator__ = {
     "FlatStart": smartbool,
     "dupRevStack": smartbool,
     "lzw": smartbool,
+    "streamPipeline": smartbool,
+    "scratchDir": Any(
+        None, "", dirpath, msg="Unable to find scratch directory. Check filepath"
+    ),
+    "outputFormat": All(
+        Coerce(str),
+        Lower,
+        Strip,
+        Any("tiff", "zarr", "hdf5"),
+        msg="outputFormat must be {tiff, zarr, hdf5}",
+    ),
 }
 
 
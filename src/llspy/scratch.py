@@ -0,0 +1,199 @@
+"""Local scratch space for intermediate processing products.
+
+When raw data lives on slow (network) storage, processing can be staged in a
+scratch directory on a fast local disk (e.g. NVMe or ``/dev/shm``)::
+
+    >>> stage = ScratchStage(E, '/dev/shm')
+    >>> process_everything(stage.exp)  # Corrected/, GPUdecon/, ... on scratch
+    >>> stage.finish()  # copy final outputs back in the background
+
+The raw tiffs and Settings.txt are symlinked into the scratch directory, so
+they are read from their original location without being copied, while every
+folder created during processing lives on scratch.  :meth:`ScratchStage.finish`
+copies the final outputs back to the experiment folder in a background thread
+(merging them with outputs that are already there) and then removes the
+scratch directory, so the slow filesystem only ever sees the final writes.
+"""
+
+import logging
+import math
+import os
+import shutil
+import tempfile
+import threading
+
+from .exceptions import ScratchError
+
+logger = logging.getLogger(__name__)
+
+#: folders that are copied back to the experiment after processing
+OUTPUT_DIRS = ("GPUdecon", "Deskewed", "CPPdecon", "MIPs")
+
+_pending = []
+_pending_lock = threading.Lock()
+
+
+def estimate_bytes(E, P):
+    """Estimate the disk space needed to process LLSdir E with parameters P.
+
+    Based on the size of the raw tiffs in ``E.tiff.bytes``: one copy for the
+    Corrected folder (if any correction or trimming is done), plus the
+    deskewed and/or deconvolved outputs, which are wider than the raw data
+    after deskewing and twice as large when saved as float32.
+    """
+    raw = sum(E.tiff.bytes or [])
+    nstacks = len(E.tiff.bytes or []) or 1
+    fraction = min(1, len(list(P.tRange)) * len(list(P.cRange)) / nstacks)
+    raw *= fraction
+
+    expand = 1.0
+    if P.deskew:
+        if P.width:
+            expand = P.width / E.parameters.nx
+        else:
+            shift = E.parameters.nz * P.dzdata
+            shift *= math.cos(math.radians(P.deskew)) / P.drdata
+            expand = (E.parameters.nx + shift) / E.parameters.nx
+
+    total = 0
+    if P.correctFlash or P.medianFilter or any(map(any, (P.trimZ, P.trimY, P.trimX))):
+        total += raw
+    if P.nIters > 0:
+        total += raw * expand * (1 if P.uint16 else 2)
+    if P.saveDeskewedRaw:
+        total += raw * expand * (1 if P.uint16raw else 2)
+    return int(total)
+
+
+def merge_tree(src, dst):
+    """Copy the files in src into dst, keeping the files already in dst.
+
+    Files with the same name are overwritten.  Processing a subset of the
+    timepoints or channels therefore never removes earlier outputs.
+    """
+    for dirpath, _, files in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(target, exist_ok=True)
+        for f in files:
+            shutil.copy2(os.path.join(dirpath, f), os.path.join(target, f))
+
+
+class ScratchStage:
+    """Stage processing of an LLSdir in a scratch directory.
+
+    Args:
+        E (LLSdir): experiment to process
+        root (str): scratch directory (e.g. on local SSD or ``/dev/shm``)
+        nbytes (int): disk space needed for processing.  A :class:`ScratchError`
+            is raised if ``root`` has less free space than that.
+        keep (Iterable[str]): folders copied back to the experiment by
+            :meth:`finish`
+
+    Attributes:
+        exp (LLSdir): LLSdir at the scratch location, to be processed
+    """
+
+    def __init__(self, E, root, nbytes=0, keep=OUTPUT_DIRS):
+        from .llsdir import LLSdir
+
+        if not os.path.isdir(str(root)):
+            raise ScratchError(f"Scratch directory does not exist: {root}")
+        free = shutil.disk_usage(str(root)).free
+        if nbytes > free:
+            raise ScratchError(
+                f"Not enough space in scratch directory {root}: "
+                f"{nbytes / 1e9:.2f} GB needed, {free / 1e9:.2f} GB free"
+            )
+        self.source = str(E.path)
+        self.keep = tuple(keep)
+        self.path = tempfile.mkdtemp(prefix=f"llspy_{E.basename}_", dir=str(root))
+        self._thread = None
+        try:
+            for f in list(E.get_settings_files()) + list(E.tiff.raw or []):
+                f = str(f)
+                os.symlink(f, os.path.join(self.path, os.path.basename(f)))
+        except OSError as e:
+            shutil.rmtree(self.path, ignore_errors=True)
+            raise ScratchError(f"Could not link raw data into scratch: {e}") from e
+        logger.info(f"Staging {self.source} in scratch directory {self.path}")
+        self.exp = LLSdir(self.path, E.fname_pattern, ditch_partial=False)
+
+    def _copy_back(self):
+        try:
+            for d in self.keep:
+                src = os.path.join(self.path, d)
+                if os.path.isdir(src):
+                    merge_tree(src, os.path.join(self.source, d))
+            logger.debug(f"Copied outputs from {self.path} to {self.source}")
+        except Exception as e:
+            logger.error(f"Failed to copy outputs from scratch to {self.source}: {e}")
+            logger.error(f"Outputs have been left in {self.path}")
+        else:
+            self.cleanup()
+        finally:
+            with _pending_lock:
+                if self in _pending:
+                    _pending.remove(self)
+
+    def finish(self, wait=False):
+        """Copy the outputs back to the experiment folder, then clean up.
+
+        The copy runs in a background thread unless ``wait`` is True.  The
+        scratch directory is left in place if copying fails.
+        """
+        self._thread = threading.Thread(
+            target=self._copy_back, name=f"ScratchCopy-{os.path.basename(self.path)}"
+        )
+        with _pending_lock:
+            _pending.append(self)
+        self._thread.start()
+        if wait:
+            self.wait()
+        return self._thread
+
+    def wait(self, timeout=None):
+        """Block until the background copy is done."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def cleanup(self):
+        """Remove the scratch directory (the raw data are only symlinked)."""
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.cleanup()
+
+
+def wait_for_copies(timeout=None):
+    """Block until all pending copies from scratch have finished."""
+    with _pending_lock:
+        stages = list(_pending)
+    for s in stages:
+        s.wait(timeout)
+
+
+def stage(E, P):
+    """Return a ScratchStage for E if P.scratchDir is set and usable, else None.
+
+    Problems with the scratch directory are logged, and processing falls back
+    to the experiment folder.
+    """
+    if not P.scratchDir:
+        return None
+    from .pipeline import output_store
+
+    keep = OUTPUT_DIRS + (("Corrected",) if P.keepCorrected else ())
+    store = output_store(E, P)
+    if store is not None:
+        keep += (store.name,)
+    try:
+        return ScratchStage(E, P.scratchDir, estimate_bytes(E, P), keep=keep)
+    except ScratchError as e:
+        logger.warning(f"{e}. Processing in {E.path} instead")
+        return None
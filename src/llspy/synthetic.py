@@ -0,0 +1,287 @@
+"""Synthetic LLS experiments for benchmarks and tests.
+
+:func:`make_experiment` writes a folder that LLSdir treats like a real
+acquisition: a Settings.txt (general, waveform, camera and .ini sections)
+and one uint16 tiff per channel and timepoint, showing gaussian beads on a
+noisy camera offset.  The beads of channel c are displaced by ``c * shift``
+voxels, so the channels can be registered to each other, and
+:func:`make_camparams` writes a matching FlashParam file for flash correction.
+"""
+
+import logging
+import os
+import pathlib as plib
+from datetime import datetime
+
+import numpy as np
+import tifffile
+
+logger = logging.getLogger(__name__)
+
+FPATTERN = "{name}_ch{c}_stack{t:04d}_{wave}nm_{reltime:07d}msec_{abstime:010d}msecAbs"
+
+# pixel size of the C11440-22C (Orca Flash 4.0) camera, in microns
+CAMERA_PIXEL = 6.5
+CAMERA_SERIAL = 100740
+CHIP_SIZE = 2048
+
+SETTINGS_TEMPLATE = """\
+***** ***** ***** General ***** ***** *****
+Date :\t{date}
+Acq Mode :\tZ stack
+Version :\tv 4.04505.Development Built on : 3/1/2018 11:07:30 AM, rev 4505
+
+***** ***** ***** Waveform ***** ***** *****
+Waveform type :\tLinear
+
+{waveforms}
+Cycle lasers :\tper Z
+
+Z motion :\t{zmotion}
+
+
+***** ***** *****   Camera  ***** ***** *****
+Model :\tC11440-22C
+Serial :\t{serial}
+Frame Transfer :\tOFF
+Trigger :\tExternal
+Exp(s) :\t{exposure:.5f}
+Cycle(s) :\t{cycle:.5f}
+Cycle(Hz) :\t{hz:.2f} Hz
+Frame Mode :\tRun Till Abort
+Readout Mode :\tImage
+ROI :\tLeft={left} Top={top} Right={right} Bot={bottom}
+Binning :\tX=1 Y=1
+# of Pixels :\tX={chip} Y={chip}
+# of Exps :\t{nexp} exp(s)
+FOV ROI :\tLeft={left} Top={top} Right={right} Bot={bottom}
+# of Imgs :\t{nexp} img(s)
+
+***** ***** *****   Advanced Timing  ***** ***** *****
+Trigger Mode :\tSLM -> Cam
+# exp per SLM enable :\t0
+
+***** ***** *****   .ini File  ***** ***** *****
+[Detection optics]
+Magnification = {mag:.5f}
+
+[General]
+Camera type = "Orca4.0"
+Cam Trigger mode = "SLM -> Cam"
+2nd Camera type = "Disabled"
+Twin cam mode? = FALSE
+SPIM type = "Lattice Lightsheet"
+
+[Sample stage]
+Angle between stage and bessel beam (deg) = {angle}
+"""
+
+
+def camera_roi(ny, nx, chip=CHIP_SIZE):
+    """Camera ROI [left, top, right, bottom] of an ny x nx image.
+
+    The camera is rotated by 90 degrees, so the ROI is ny wide and nx high.
+    It is centered on the chip, like most acquisitions.
+    """
+    left = (chip - ny) // 2 + 1
+    top = (chip - nx) // 2 + 1
+    return [left, top, left + ny - 1, top + nx - 1]
+
+
+def settings_text(
+    nz,
+    ny,
+    nx,
+    nt=1,
+    waves=(488, 560),
+    dz=0.4,
+    dx=0.104,
+    angle=31.5,
+    samplescan=True,
+    exposure=20,
+    date=None,
+):
+    """Return the text of a Settings.txt file for the given acquisition.
+
+    Args:
+        nz, ny, nx (int): shape of every stack.
+        nt (int): number of timepoints.
+        waves (tuple): laser line of every channel.
+        dz (float): step size in microns (stage or objective).
+        dx (float): pixel size in microns.
+        angle (float): angle between stage and light sheet.
+        samplescan (bool): stage scan (True) or objective scan (False).
+        exposure (float): exposure time per plane in ms.
+        date (datetime): acquisition date, defaults to now.
+    """
+    date = date or datetime.now()
+    left, top, right, bottom = camera_roi(ny, nx)
+    lines = []
+    for name, offset, interval, npix in (
+        ("X Galvo", 0, 0.0325, 201),
+        ("Z Galvo", 0, 0 if samplescan else dz, nz),
+        ("Z PZT", 50, 0 if samplescan else dz, nz),
+        ("S PZT", 50, dz if samplescan else 0, nz),
+    ):
+        for c in range(len(waves)):
+            lines.append(
+                f"{name} Offset, Interval (um), # of Pixels for Excitation ({c}) :"
+                f"\t{offset}\t{interval}\t{npix}"
+            )
+        lines.append("")
+    lines.extend(f"# of stacks ({c}) :\t{nt}" for c in range(len(waves)))
+    lines.append("")
+    lines.extend(
+        f"Excitation Filter, Laser, Power (%), Exp(ms) ({c}) :"
+        f"\tN/A\t{wave}\t10\t{exposure}"
+        for c, wave in enumerate(waves)
+    )
+    lines.append("")
+    nexp = nz * nt * len(waves)
+    return SETTINGS_TEMPLATE.format(
+        date=date.strftime("%m/%d/%Y %I:%M:%S %p"),
+        waveforms="\n".join(lines),
+        zmotion="Sample piezo" if samplescan else "Z objective & galvo",
+        serial=CAMERA_SERIAL,
+        exposure=exposure / 1000,
+        cycle=exposure / 1000 + 0.001,
+        hz=1000 / (exposure + 1),
+        left=left,
+        top=top,
+        right=right,
+        bottom=bottom,
+        chip=CHIP_SIZE,
+        nexp=nexp,
+        mag=CAMERA_PIXEL / dx,
+        angle=angle,
+    )
+
+
+def bead_positions(shape, nbeads, margin=4, seed=0):
+    """Random (z, y, x) bead positions at least margin voxels from the edges."""
+    rng = np.random.default_rng(seed)
+    low = np.full(3, margin, dtype=float)
+    high = np.array(shape, dtype=float) - margin - 1
+    return rng.uniform(low, np.maximum(high, low), size=(nbeads, 3))
+
+
+def render_beads(shape, positions, sigma=(1.5, 1.2, 1.2), amplitude=2000):
+    """Render gaussian beads at (z, y, x) positions into a float32 volume."""
+    out = np.zeros(shape, np.float32)
+    sigma = np.asarray(sigma, dtype=float)
+    radius = np.ceil(3 * sigma).astype(int)
+    for pos in positions:
+        center = np.round(pos).astype(int)
+        lo = np.maximum(center - radius, 0)
+        hi = np.minimum(center + radius + 1, shape)
+        if np.any(hi <= lo):
+            continue
+        # the gaussian is separable, so build it from three 1D profiles
+        profiles = [
+            np.exp(-((np.arange(lo[i], hi[i]) - pos[i]) ** 2) / (2 * sigma[i] ** 2))
+            for i in range(3)
+        ]
+        out[lo[0] : hi[0], lo[1] : hi[1], lo[2] : hi[2]] += amplitude * (
+            profiles[0][:, None, None] * profiles[1][None, :, None] * profiles[2]
+        )
+    return out
+
+
+def make_experiment(
+    path,
+    nz=32,
+    ny=128,
+    nx=64,
+    nt=2,
+    waves=(488, 560),
+    nbeads=30,
+    shift=(0, 0.8, -0.6),
+    offset=100,
+    background=5,
+    name="synthetic",
+    mips=False,
+    seed=0,
+    **settings,
+):
+    """Write a synthetic LLS experiment folder.
+
+    Args:
+        path (str): experiment folder, created if necessary.
+        nz, ny, nx (int): shape of every stack.
+        nt (int): number of timepoints.
+        waves (tuple): laser line of every channel.
+        nbeads (int): number of beads in every stack.
+        shift (tuple): (z, y, x) displacement in voxels between the beads of
+            consecutive channels.
+        offset (int): camera offset added to every pixel.
+        background (float): mean photon background on top of the offset.
+        name (str): basename of the tiff files.
+        mips (bool): also write X/Y/Z MIPs of every stack to a MIPs folder.
+        seed (int): seed for bead positions and noise.
+        **settings: passed on to :func:`settings_text`.
+
+    Returns:
+        pathlib.Path: the experiment folder.
+    """
+    path = plib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    shape = (nz, ny, nx)
+    with open(path / f"{name}_Settings.txt", "w") as f:
+        f.write(settings_text(nz, ny, nx, nt=nt, waves=waves, **settings))
+    if mips:
+        (path / "MIPs").mkdir(exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    positions = bead_positions(shape, nbeads, seed=seed)
+    beads = [
+        render_beads(shape, positions + c * np.asarray(shift)) + background
+        for c in range(len(waves))
+    ]
+    for t in range(nt):
+        for c, wave in enumerate(waves):
+            data = rng.poisson(beads[c]) + offset
+            data = np.clip(data, 0, 65535).astype(np.uint16)
+            fname = FPATTERN.format(
+                name=name,
+                c=c,
+                t=t,
+                wave=wave,
+                reltime=t * 1000,
+                abstime=1000000 + t * 1000,
+            )
+            tifffile.imwrite(str(path / f"{fname}.tif"), data, photometric="minisblack")
+            if mips:
+                for axis, ax in (("z", 0), ("y", 1), ("x", 2)):
+                    mip = data.max(ax)
+                    tifffile.imwrite(
+                        str(path / "MIPs" / f"{fname}_MIP_{axis}.tif"), mip
+                    )
+    logger.debug(f"Wrote synthetic experiment {path} ({nt}x{len(waves)}x{shape})")
+    return path
+
+
+def make_camparams(folder, ny, nx, pad=8, seed=0):
+    """Write a FlashParam file covering the ROI of an ny x nx experiment.
+
+    The parameter ROI extends ``pad`` pixels beyond the data ROI on every
+    side, as FlashParams are usually calibrated on a larger ROI.
+
+    Returns:
+        str: path of the FlashParam tiff.
+    """
+    left, top, right, bottom = camera_roi(ny, nx)
+    roi = (left - pad, top - pad, right + pad, bottom + pad)
+    shape = (ny + 2 * pad, nx + 2 * pad)
+    rng = np.random.default_rng(seed)
+    data = np.stack(
+        [
+            rng.normal(20, 4, shape).clip(0),  # A: amplitude of the carry-over
+            rng.uniform(0.005, 0.05, shape),  # B: rate of association
+            rng.normal(100, 2, shape),  # dark image (camera offset)
+        ]
+    ).astype(np.float32)
+    fname = os.path.join(
+        str(folder), "FlashParam_sn{}_roi{}-{}-{}-{}.tif".format(CAMERA_SERIAL, *roi)
+    )
+    tifffile.imwrite(fname, data, photometric="minisblack")
+    return fname
@@ -0,0 +1,365 @@
+import itertools
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from . import parse, util
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTiffWriter:
+    """Write tiff files from a pool of background threads.
+
+    Arrays submitted with :meth:`submit` are written with :func:`util.imsave`
+    (so BigTIFF and ImageJ metadata are handled exactly as with synchronous
+    writes), while the caller continues with the next piece of work.  At most
+    ``workers + maxqueue`` arrays are held at once: when that many writes are
+    pending, :meth:`submit` blocks until one of them has finished.
+
+    Errors raised while writing are re-raised in the submitting thread on the
+    next call to :meth:`submit`, :meth:`check` or :meth:`flush`, unless
+    ``collect_errors`` is False: then they are only reported by the Future
+    returned by :meth:`submit` for the failed write.
+
+    Submitted arrays must not be modified by the caller after submission.
+
+    >>> with AsyncTiffWriter() as writer:
+    ...     for stack, outpath in results:
+    ...         writer.submit(stack, outpath, dx=0.1, dz=0.3)
+    """
+
+    def __init__(self, workers=2, maxqueue=4, collect_errors=True):
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="AsyncTiffWriter"
+        )
+        self._slots = threading.BoundedSemaphore(workers + maxqueue)
+        self._lock = threading.Lock()
+        self._futures = []
+        self._errors = []
+        self.collect_errors = collect_errors
+        self.nwritten = 0
+
+    def submit(self, arr, outpath, callback=None, **kwargs):
+        """Queue arr to be written to outpath.
+
+        kwargs are passed to :func:`util.imsave`.  If provided, ``callback``
+        is called with outpath (in the writer thread) after a successful write.
+        """
+        self.check()
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._write, arr, outpath, callback, kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def _save(self, arr, outpath, **kwargs):
+        """write one array (in a writer thread)"""
+        util.imsave(arr, str(outpath), **kwargs)
+
+    def _write(self, arr, outpath, callback, kwargs):
+        try:
+            self._save(arr, outpath, **kwargs)
+            if callback is not None:
+                callback(outpath)
+            with self._lock:
+                self.nwritten += 1
+        except Exception as e:
+            logger.error(f"Failed to write {outpath}: {e}")
+            if self.collect_errors:
+                with self._lock:
+                    self._errors.append(e)
+            raise
+        finally:
+            self._slots.release()
+
+    def check(self):
+        """Raise the first error from any completed write."""
+        with self._lock:
+            self._futures = [f for f in self._futures if not f.done()]
+            if self._errors:
+                raise self._errors.pop(0)
+
+    def flush(self):
+        """Block until all pending writes are finished."""
+        with self._lock:
+            pending = list(self._futures)
+        for future in pending:
+            try:
+                future.result()
+            except Exception:
+                pass  # collected in self._errors
+        self.check()
+
+    def close(self):
+        """Flush pending writes and shut down the writer threads."""
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # don't mask the original error with a write error
+            self._executor.shutdown(wait=True)
+
+
+class ChunkedWriter(AsyncTiffWriter):
+    """Base of the writers of processed stacks into a single chunked store.
+
+    A drop-in replacement for :class:`AsyncTiffWriter`: stacks submitted with
+    the path of an output tiff (such as
+    ``GPUdecon/cell1_ch0_stack0003_..._decon.tif``) are passed to
+    :meth:`write_stack`, with the name of their folder as image and their
+    timepoint and channel, in the writer threads.  Anything else, like MIPs,
+    is still written to a tiff file.
+
+    Args:
+        timepoints (list): stack numbers of the T axis, in order.  If None,
+            the stack number is the T index and T grows as stacks are added.
+        channels (list): channel numbers of the C axis, like timepoints
+        fpattern (str): filename pattern, to parse timepoint and channel
+        **kwargs: workers, maxqueue and collect_errors of AsyncTiffWriter
+    """
+
+    #: output folders that are written as images of the store
+    IMAGES = ("Corrected", "Deskewed", "GPUdecon")
+
+    def __init__(self, timepoints=None, channels=None, fpattern=None, **kwargs):
+        self.timepoints = None if timepoints is None else list(timepoints)
+        self.channels = None if channels is None else list(channels)
+        self.fpattern = fpattern
+        super().__init__(**kwargs)
+
+    def _save(self, arr, outpath, **kwargs):
+        folder, name = os.path.split(str(outpath))
+        image = os.path.basename(folder)
+        info = None
+        if image in self.IMAGES:
+            try:
+                info = parse.parse_filename(name, pattern=self.fpattern)
+            except ValueError:
+                pass
+        if info is None:
+            super()._save(arr, outpath, **kwargs)
+            return
+        self.write_stack(
+            image,
+            arr,
+            info["stack"],
+            info["channel"],
+            dx=kwargs.get("dx", 1),
+            dz=kwargs.get("dz", 1),
+        )
+
+    def _index(self, value, values, name):
+        if values is None:
+            return value
+        try:
+            return values.index(value)
+        except ValueError:
+            raise ValueError(f"{name} {value} is not in the store") from None
+
+    def locate(self, stack, t, c):
+        """(ZYX stack, T index, C index, TCZYX shape that holds them)"""
+        stack = np.asarray(stack)
+        if stack.ndim != 3:
+            stack = np.squeeze(stack)
+        ti = self._index(t, self.timepoints, "timepoint")
+        ci = self._index(c, self.channels, "channel")
+        nt = len(self.timepoints) if self.timepoints is not None else ti + 1
+        nc = len(self.channels) if self.channels is not None else ci + 1
+        return stack, ti, ci, (nt, nc, *stack.shape)
+
+    def write_stack(self, image, stack, t, c, dx=1, dz=1):
+        """Write the ZYX stack of timepoint t and channel c to image.
+
+        The image is created by the first write, with the shape of its stack
+        and physical sizes dx and dz.
+        """
+        raise NotImplementedError
+
+    def close_store(self):
+        """release the store, once all writes are done"""
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.close_store()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            super().__exit__(exc_type, exc_value, traceback)
+        finally:
+            if exc_type is not None:
+                self.close_store()
+
+
+class StackPrefetcher:
+    """Iterate over groups of tiff files, reading ahead in background threads.
+
+    Each item of ``groups`` is a list of file paths (for instance all channels
+    of one timepoint).  Iterating yields ``(paths, stacks)`` tuples in order,
+    while the next ``depth`` groups are already being read, so that reading
+    from (network) storage overlaps with whatever the caller does with the
+    current group.
+
+    If ``depth`` is not given it is derived from ``memory_budget``: the current
+    group plus every group being read ahead must fit in the budget.  A depth
+    of 0 reads each group only when it is requested.
+
+    With ``recycle=True``, the arrays of a group are reused as read buffers
+    once the next group is requested, which avoids allocating a new array for
+    every stack.  Copy anything that needs to outlive the loop iteration.
+
+    >>> groups = [E.get_files(t=t) for t in E.parameters.tset]
+    >>> for paths, stacks in StackPrefetcher(groups, group_bytes=nbytes):
+    ...     process(stacks)
+    """
+
+    #: default memory budget for read-ahead (bytes)
+    MEMORY_BUDGET = 2 * 1024**3
+
+    def __init__(
+        self,
+        groups,
+        depth=None,
+        memory_budget=None,
+        group_bytes=None,
+        maxdepth=4,
+        workers=2,
+        recycle=False,
+        **read_kwargs,
+    ):
+        self.groups = [list(g) for g in groups]
+        # tifffile can't read a subset of planes into an existing buffer
+        self.recycle = recycle and read_kwargs.get("planes") is None
+        self.read_kwargs = read_kwargs
+        self.workers = workers
+        if depth is None:
+            if memory_budget is None:
+                memory_budget = self.MEMORY_BUDGET
+            if group_bytes is None:
+                group_bytes = self._group_bytes()
+            depth = int(memory_budget // max(group_bytes, 1)) - 1
+            depth = max(0, min(maxdepth, depth))
+        self.depth = min(depth, max(len(self.groups) - 1, 0))
+        self._pool = []
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @classmethod
+    def from_llsdir(cls, E, tRange=None, cRange=None, **kwargs):
+        """Prefetch the raw stacks of an LLSdir, one group per timepoint"""
+        if tRange is None:
+            tRange = E.parameters.tset
+        groups = [E.get_files(t=t, c=cRange) for t in tRange]
+        groups = [g for g in groups if len(g)]
+        if "group_bytes" not in kwargs and E.tiff.size_raw and groups:
+            kwargs["group_bytes"] = E.tiff.size_raw * len(groups[0])
+        return cls(groups, **kwargs)
+
+    def _group_bytes(self):
+        if not self.groups:
+            return 1
+        return sum(os.path.getsize(f) for f in self.groups[0])
+
+    def _read(self, path):
+        buf = None
+        if self.recycle:
+            with self._lock:
+                if self._pool:
+                    buf = self._pool.pop()
+        if buf is not None:
+            try:
+                return util.imread(path, out=buf, **self.read_kwargs)
+            except ValueError:
+                # stack has a different shape or dtype than the buffer
+                pass
+        return util.imread(path, **self.read_kwargs)
+
+    def _read_group(self, paths):
+        return [self._read(p) for p in paths]
+
+    def _release(self, stacks):
+        if self.recycle:
+            with self._lock:
+                self._pool.extend(s for s in stacks if isinstance(s, np.ndarray))
+
+    def __iter__(self):
+        if self.depth == 0:
+            for paths in self.groups:
+                yield paths, self._read_group(paths)
+            return
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="StackPrefetcher"
+        )
+        pending = deque()
+        groups = iter(self.groups)
+        try:
+            for paths in itertools.islice(groups, self.depth + 1):
+                pending.append((paths, self._executor.submit(self._read_group, paths)))
+            while pending:
+                paths, future = pending.popleft()
+                stacks = future.result()
+                yield paths, stacks
+                # the caller is done with this group: recycle it and read ahead
+                self._release(stacks)
+                for nextpaths in itertools.islice(groups, 1):
+                    pending.append(
+                        (nextpaths, self._executor.submit(self._read_group, nextpaths))
+                    )
+        finally:
+            for _, future in pending:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __len__(self):
+        return len(self.groups)
+
+
+def read_into(paths, out, workers=4):
+    """Read tiff files into preallocated arrays, from a pool of threads.
+
+    Every file is decoded directly into the array at the same position of
+    ``out`` (for instance views into one large array), so no intermediate
+    copies are made.
+
+    >>> stack = np.empty((nt, nc, ny, nx), np.uint16)
+    >>> read_into(paths, [stack[t, c] for t in range(nt) for c in range(nc)])
+
+    Raises:
+        ValueError: if a file doesn't match the shape or dtype of its array
+    """
+
+    def read(path, arr):
+        try:
+            util.imread(str(path), out=arr)
+        except ValueError as e:
+            raise ValueError(f"Could not read {path} into {arr.shape} array: {e}")
+
+    if len(paths) != len(out):
+        raise ValueError(f"Got {len(paths)} files for {len(out)} arrays")
+    if workers <= 1:
+        for path, arr in zip(paths, out):
+            read(path, arr)
+        return
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="read_into") as ex:
+        # consume the results, so that errors are raised here
+        list(ex.map(read, paths, out))
@@ -2,6 +2,7 @@ import ctypes
 import fnmatch
 import json
 import os
+import re
 import sys
 import warnings
 
@@ -49,10 +50,47 @@ def find_filepattern(path, filepattern="*.tar*"):
     return None
 
 
-def imread(*args, **kwargs):
+# tifffile.imsave was deprecated in favor of imwrite, and later removed
+_imwrite = getattr(tifffile, "imwrite", None) or tifffile.imsave
+
+
+def imread(path, *args, memmap=False, planes=None, header_only=False, **kwargs):
+    """Read a tiff file into a numpy array.
+
+    Args:
+        path (str): path to tiff file
+        memmap (bool): if True, return a read-only memory-map of the file when
+            its pixel data is uncompressed and contiguous (zero-copy).  Falls
+            back to a normal read otherwise.
+        planes (int, slice, Iterable[int]): only read these Z planes (pages)
+            of the stack.  An int returns a single 2D plane.
+        header_only (bool): don't read any pixel data, just return a
+            ``(shape, dtype)`` tuple from the tiff header.
+
+    Other args and kwargs are passed to :func:`tifffile.imread`.
+    """
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        return tifffile.imread(*args, **kwargs)
+        if header_only:
+            with tifffile.TiffFile(path) as tif:
+                return tuple(tif.series[0].shape), np.dtype(tif.series[0].dtype)
+        if memmap:
+            try:
+                arr = tifffile.memmap(path, mode="r")
+            except ValueError:
+                # compressed or non-contiguous tiffs can't be memory-mapped
+                pass
+            else:
+                return arr if planes is None else arr[_planes_key(planes)]
+        if planes is not None:
+            kwargs["key"] = _planes_key(planes)
+        return tifffile.imread(path, *args, **kwargs)
+
+
+def _planes_key(planes):
+    if isinstance(planes, (int, slice)):
+        return planes
+    return list(planes)
 
 
 def imshow(*args, **kwargs):
@@ -72,10 +110,12 @@ def imsave(arr, outpath, dx=1, dz=1, dt=1, unit="micron"):
     }
     bigT = True if arr.nbytes > 3758096384 else False  # > 3.5GB make a bigTiff
     if arr.ndim == 3:
-        arr = reorderstack(arr)  # assume that 3 dimension array is ZYX
+        # assume that 3 dimension array is ZYX.  Inserting singleton T & C
+        # axes is a view, unlike going through reorderstack's transpose
+        arr = arr[np.newaxis, :, np.newaxis]
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        tifffile.imsave(
+        _imwrite(
             outpath,
             arr,
             bigtiff=bigT,
@@ -100,7 +140,7 @@ def format_size(size):
     """Return file size as string from byte size."""
     for unit in ("B", "KB", "MB", "GB", "TB", "PB"):
         if size < 1024:
-            return f"{size:.f} {unit}"
+            return f"{size:.1f} {unit}"
         size /= 1024.0
 
 
@@ -190,6 +230,29 @@ def pyrange_to_perlregex(it, digits=4):
     return str("(" + "|".join(L) + ")")
 
 
+def string_to_iterable(string):
+    """convert a string into an iterable
+    note: ranges are inclusive
+
+    >>> string_to_iterable('0,3,5-10,15-30-3,40')
+    [0,3,5,6,7,8,9,10,15,18,21,24,27,30,40]
+    """
+    if re.search(r"[^\d^,^-]", string) is not None:
+        raise ValueError("Iterable string must contain only digits, commas, and dashes")
+    it = []
+    splits = [tuple(s.split("-")) for s in string.split(",")]
+    for item in splits:
+        if len(item) == 1:
+            it.append(int(item[0]))
+        elif len(item) == 2:
+            it.extend(list(range(int(item[0]), int(item[1]) + 1)))
+        elif len(item) == 3:
+            it.extend(list(range(int(item[0]), int(item[1]) + 1, int(item[2]))))
+        else:
+            raise ValueError("Iterable string items must be of length <= 3")
+    return sorted(set(it))
+
+
 def reorderstack(arr, inorder="zyx", outorder="tzcyx"):
     """rearrange order of array, used when resaving a file."""
     inorder = inorder.lower()
@@ -263,12 +326,12 @@ def load_lib(libname):
             d = os.path.abspath(getAbsoluteResourcePath(f))
             if os.path.isdir(d):
                 os.chdir(d)
-                lib = ctypes.CDLL(libname)
-                os.chdir(curdir)
-                return lib
+                return ctypes.CDLL(libname)
             raise Exception("didn't find it")
         except Exception:
             continue
+        finally:
+            os.chdir(curdir)
 
 
 def shortname(path, parents=2):
@@ -284,24 +347,50 @@ class paramEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
-def readHDF5(filename):
+def readHDF5(filename, dataset="data"):
     import h5py
 
-    f = h5py.File(filename, "r")
-    return f["data"].value
+    with h5py.File(filename, "r") as f:
+        return f[dataset][()]
+
 
+def readHDF5Frame(filename, frame, dataset="data"):
+    """Read frame (any index, e.g. ``t`` or ``(t, c)``) of an HDF5 dataset.
 
-def readHDF5Frame(filename, frame):
+    Only the chunks that hold the frame are read and decompressed.
+    """
     import h5py
 
-    f = h5py.File(filename, "r")
-    return f["data"][frame]
+    with h5py.File(filename, "r") as f:
+        return f[dataset][frame]
+
 
+def writeHDF5(filename, data, dataset="data", append=False, compression=None, level=4):
+    """Write data to an HDF5 dataset, chunked per frame (first axis).
 
-def writeHDF5(filename, data):
+    The dataset is resizable along its first axis: with ``append``, the
+    frames of data are added to the end of an existing dataset (which is
+    created if necessary) instead of replacing the file.
+
+    Args:
+        compression (str): None, "gzip" or "lzf"
+        level (int): gzip compression level
+    """
     import h5py
 
-    f = h5py.File(filename, "w")
-    f["data"] = data
-    f.flush()
-    f.close()
+    data = np.asarray(data)
+    with h5py.File(filename, "a" if append else "w") as f:
+        if dataset in f:
+            dset = f[dataset]
+            n = dset.shape[0]
+            dset.resize(n + data.shape[0], axis=0)
+            dset[n:] = data
+            return
+        f.create_dataset(
+            dataset,
+            data=data,
+            chunks=(1, *data.shape[1:]),
+            maxshape=(None, *data.shape[1:]),
+            compression=compression,
+            compression_opts=level if compression == "gzip" else None,
+        )
@@ -0,0 +1,426 @@
+"""Headless live processing of lattice light sheet acquisitions.
+
+:class:`WatchDaemon` watches a root folder for LLS experiments being acquired
+(any folder with a ``*Settings.txt`` file) and processes every timepoint as
+soon as the stacks of all of its channels have been written, the same way
+:func:`llspy.llsdir.preview` does.  Timepoints are read, corrected and written
+in a thread pool, while their deconvolution runs on a single GPU thread
+(libcudaDecon state is global).  Filesystem events are never waited on in the
+watchdog thread, so the daemon keeps up with fast acquisitions.  It needs
+neither Qt nor a display.
+
+A timepoint is recorded as processed, in a state file in the root folder,
+once all of its outputs have been written, so a restarted daemon resumes
+where it left off.
+
+With the ``mergeMIPs`` option, the projections of every processed stack are
+collected in memory and written to comboMIP files (see :mod:`llspy.mips`)
+when the experiment times out or the daemon is closed.
+
+>>> with WatchDaemon("/data/incoming", {"nIters": 0}) as daemon:
+...     daemon.run()
+"""
+
+import json
+import logging
+import os
+import os.path as osp
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import cpu_count
+
+from watchdog import events
+from watchdog.observers import Observer
+
+from . import libcudawrapper, llsdir, parse, util
+from .completion import CompletionTracker
+from .mips import MIPAccumulator
+from .scratch import OUTPUT_DIRS
+from .tiffio import AsyncTiffWriter
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = ".llspy_watch.json"
+
+
+def is_raw_stack(name):
+    """whether name is a raw stack as written by the acquisition software"""
+    if not name.endswith(".tif"):
+        return False
+    try:
+        parse.parse_filename(name, pattern=llsdir.__FPATTERN__)
+    except ValueError:
+        return False
+    return True
+
+
+def output_path(E, P, rawpath):
+    """path of the processed file for a raw stack, as written by the watchers"""
+    if P.nIters > 0:
+        folder, proctype = "GPUdecon", "_decon"
+    else:
+        folder, proctype = "Deskewed", "_deskewed"
+    corstring = "_COR" if P.correctFlash else ""
+    filename = osp.basename(rawpath).replace(".tif", corstring + proctype + ".tif")
+    return osp.join(str(E.path), folder, filename)
+
+
+class LiveExperiment:
+    """Bookkeeping for one experiment folder that is being acquired.
+
+    Args:
+        path (str): experiment folder (containing a Settings.txt file)
+        done (Iterable[int]): timepoints that have already been processed
+    """
+
+    def __init__(self, path, done=()):
+        self.path = path
+        self.nc = llsdir.LLSdir(path, ditch_partial=False).parameters.nc
+        self.files = {}  # timepoint -> {channel: path} of completely written files
+        self.done = set(done)
+        self.submitted = set()
+        self.failed = set()
+        self.E = None
+        self.P = None
+        self.mips = None  # MIPAccumulator, with mergeMIPs
+        self.mip_path = None  # folder and basename of the comboMIP files
+        self.size_raw = None  # expected size of raw files, once known
+        self.last_event = time.time()
+
+    @property
+    def busy(self):
+        return bool(self.submitted - self.done - self.failed)
+
+    def add_file(self, path):
+        """Register a completely written raw stack.
+
+        Returns the timepoint of the stack if all of its channels are now
+        complete and it has not been processed yet.
+        """
+        self.last_event = time.time()
+        try:
+            info = parse.parse_filename(osp.basename(path))
+            t, c = info["stack"], info["channel"]
+        except Exception:
+            logger.warning(f"Could not parse filename: {path}")
+            return None
+        channels = self.files.setdefault(t, {})
+        channels[c] = path
+        if len(channels) >= self.nc and t not in self.done | self.submitted:
+            return t
+        return None
+
+    def prepare(self, opts):
+        """Build the LLSdir and processing parameters, once the first
+        timepoint is complete (so that the tiff header can be read)."""
+        if self.E is None:
+            self.E = llsdir.LLSdir(self.path, ditch_partial=False)
+            self.P = self.E.localParams(**opts)
+            self.size_raw = self.E.tiff.size_raw
+            flags = self.P.MIP if self.P.nIters > 0 else self.P.rMIP
+            if self.P.mergeMIPs and any(flags):
+                rawpath = next(iter(next(iter(self.files.values())).values()))
+                outdir = osp.dirname(output_path(self.E, self.P, rawpath))
+                basename = parse.parse_filename(osp.basename(rawpath), "basename")
+                self.mip_path = (
+                    osp.join(outdir, "MIPs"),
+                    basename + ("_COR" if self.P.correctFlash else ""),
+                )
+                self.mips = MIPAccumulator(flags)
+                # continue the comboMIPs written before a restart
+                self.mips.read(*self.mip_path, sorted(self.done), self.P.cRange)
+        return self.E, self.P
+
+    def write_mips(self, writer):
+        """write the comboMIPs of the timepoints processed so far"""
+        if self.mips is None or not len(self.mips):
+            return
+        try:
+            interval = self.E.parameters.interval[0]
+        except IndexError:
+            interval = 0
+        self.mips.write(*self.mip_path, writer, dx=self.E.parameters.dx, dt=interval)
+
+
+class _EventHandler(events.FileSystemEventHandler):
+    """Forward watchdog events to the daemon's queue, without blocking."""
+
+    def __init__(self, events_queue):
+        super().__init__()
+        self.queue = events_queue
+
+    def on_any_event(self, event):
+        if event.is_directory:
+            return
+        if event.event_type == events.EVENT_TYPE_MOVED:
+            self.queue.put(("file", event.event_type, event.dest_path))
+        else:
+            self.queue.put(("file", event.event_type, event.src_path))
+
+
+class WatchDaemon:
+    """Watch a root folder and process incoming LLS timepoints.
+
+    Args:
+        root (str): folder to watch (recursively) for LLS experiments
+        opts (dict): processing options, as accepted by ``LLSdir.localParams``
+        workers (int): number of timepoints read, corrected and written at
+            once (deconvolution always runs one timepoint at a time)
+        settle (float): until the size of the raw files is known, and on
+            filesystems without close events, a file is considered complete
+            once its size has not changed for this many seconds
+        poll_interval (float): how often (seconds) pending files are checked
+        timeout (float): stop tracking an experiment after this many seconds
+            without new files
+        state_file (str): where to record processed timepoints.  Defaults to
+            :data:`STATE_FILE` in the root folder
+    """
+
+    def __init__(
+        self,
+        root,
+        opts=None,
+        workers=None,
+        settle=1.0,
+        poll_interval=0.1,
+        timeout=600,
+        state_file=None,
+    ):
+        self.root = osp.abspath(root)
+        self.opts = dict(opts or {})
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.state_file = state_file or osp.join(self.root, STATE_FILE)
+        self.experiments = {}
+        self.nprocessed = 0
+        self._state = self._load_state()
+        self._dirty = False
+        self._events = queue.Queue()
+        self.tracker = CompletionTracker(
+            lambda path: self._events.put(("complete", path)),
+            expected_size=self._expected_size,
+            settle=settle,
+            interval=poll_interval,
+        )
+        self._stop = threading.Event()
+        self._pool = ThreadPoolExecutor(
+            workers or max(1, cpu_count() // 2), thread_name_prefix="lls-watch"
+        )
+        self._gpu = ThreadPoolExecutor(1, thread_name_prefix="lls-watch-gpu")
+        self.writer = AsyncTiffWriter(collect_errors=False)
+        self.observer = None
+
+    def _load_state(self):
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self):
+        for path, exp in self.experiments.items():
+            self._state[osp.relpath(path, self.root)] = sorted(exp.done)
+        tmp = self.state_file + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self._state, f)
+            os.replace(tmp, self.state_file)
+            self._dirty = False
+        except OSError as e:
+            logger.error(f"Could not save watch state: {e}")
+
+    def start(self):
+        """Pick up existing experiments and start watching for new files."""
+        for dirpath, dirs, files in os.walk(self.root):
+            dirs[:] = [
+                d
+                for d in dirs
+                if d not in (*OUTPUT_DIRS, "Corrected") and not d.endswith(".zarr")
+            ]
+            if any(f.endswith("Settings.txt") for f in files):
+                self._add_experiment(dirpath)
+        self.observer = Observer()
+        self.observer.schedule(_EventHandler(self._events), self.root, recursive=True)
+        self.observer.start()
+        self.tracker.start()
+        logger.info(f"Watching {self.root} for LLS acquisitions")
+
+    def run(self, duration=None):
+        """Process events until :meth:`stop` is called (or for ``duration`` s)."""
+        if self.observer is None:
+            self.start()
+        deadline = None if duration is None else time.time() + duration
+        last_tick = 0
+        while not self._stop.is_set():
+            if deadline is not None and time.time() > deadline:
+                break
+            try:
+                self._handle(*self._events.get(timeout=self.poll_interval))
+                while True:
+                    self._handle(*self._events.get_nowait())
+            except queue.Empty:
+                pass
+            if time.time() - last_tick >= self.poll_interval:
+                self._tick()
+                last_tick = time.time()
+
+    def stop(self):
+        """Ask :meth:`run` to return (safe to call from any thread)."""
+        self._stop.set()
+
+    def close(self):
+        """Stop watching, finish the submitted timepoints and save the state."""
+        self.stop()
+        if self.observer is not None:
+            self.observer.stop()
+            self.observer.join()
+        self.tracker.stop()
+        self._pool.shutdown(wait=True)
+        self._gpu.shutdown(wait=True)
+        while True:
+            try:
+                item = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if item[0] == "processed":
+                self._handle(*item)
+        for exp in self.experiments.values():
+            self._write_mips(exp)
+        try:
+            self.writer.close()
+        finally:
+            self._save_state()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _add_experiment(self, path):
+        if path in self.experiments:
+            return
+        try:
+            done = self._state.get(osp.relpath(path, self.root), ())
+            exp = LiveExperiment(path, done)
+        except Exception as e:
+            logger.error(f"Could not watch experiment {path}: {e}")
+            return
+        self.experiments[path] = exp
+        logger.info(f"New LLS experiment being watched: {path}")
+        for name in sorted(os.listdir(path)):
+            if is_raw_stack(name):
+                self.tracker.watch(osp.join(path, name))
+
+    def _expected_size(self, path):
+        exp = self.experiments.get(osp.dirname(path))
+        return exp.size_raw if exp is not None else None
+
+    def _handle(self, kind, *args):
+        if kind == "processed":
+            self._on_processed(*args)
+            return
+        if kind == "complete":
+            self._file_complete(*args)
+            return
+        event_type, path = args
+        dirname, name = osp.split(path)
+        if event_type == events.EVENT_TYPE_DELETED:
+            self.tracker.discard(path)
+        elif name.endswith("Settings.txt") or (
+            dirname in self.experiments and is_raw_stack(name)
+        ):
+            self.tracker.watch(path)
+            # files written elsewhere and moved in place are complete
+            if event_type in (events.EVENT_TYPE_CLOSED, events.EVENT_TYPE_MOVED):
+                self.tracker.closed(path)
+
+    def _tick(self):
+        """forget idle experiments and save the state"""
+        now = time.time()
+        for path, exp in list(self.experiments.items()):
+            if not exp.busy and now - exp.last_event > self.timeout:
+                logger.info(f"No new files in {self.timeout} s, done with: {path}")
+                self._state[osp.relpath(path, self.root)] = sorted(exp.done)
+                self._dirty = True
+                self._write_mips(exp)
+                del self.experiments[path]
+        if self._dirty:
+            self._save_state()
+
+    def _file_complete(self, path):
+        dirname, name = osp.split(path)
+        if name.endswith("Settings.txt"):
+            self._add_experiment(dirname)
+            return
+        exp = self.experiments.get(dirname)
+        if exp is None:
+            return
+        t = exp.add_file(path)
+        if t is not None:
+            self._submit(exp, t)
+
+    def _submit(self, exp, t):
+        try:
+            E, P = exp.prepare(self.opts)
+        except Exception as e:
+            logger.error(f"Cannot process {exp.path}: {e}")
+            return
+        channels = exp.files[t]
+        files = [channels[c] for c in P.cRange if c in channels]
+        exp.submitted.add(t)
+        future = self._pool.submit(self._process, E, P, files, exp.mips)
+        future.add_done_callback(
+            lambda f: self._events.put(("processed", exp.path, t, f))
+        )
+
+    def _process(self, E, P, files, mips=None):
+        """read, correct and write one timepoint (in the pool), returning
+        once all of its outputs have been written"""
+        stacks = llsdir.preprocess_stacks(E, P, [util.imread(f) for f in files])
+        stacks = self._gpu.submit(self._deconvolve, E, P, stacks).result()
+        writes = []
+        for rawpath, stack in zip(files, stacks):
+            outpath = output_path(E, P, rawpath)
+            os.makedirs(osp.dirname(outpath), exist_ok=True)
+            writes.append(
+                self.writer.submit(
+                    stack, outpath, dx=E.parameters.dx, dz=E.parameters.dzFinal
+                )
+            )
+        # a failed write fails this timepoint (and no other)
+        for future in writes:
+            future.result()
+        if mips is not None:
+            for rawpath, stack in zip(files, stacks):
+                info = parse.parse_filename(osp.basename(rawpath))
+                mips.add(stack, info["stack"], info["channel"])
+
+    def _write_mips(self, exp):
+        try:
+            exp.write_mips(self.writer)
+        except Exception as e:
+            logger.error(f"Could not write the MIPs of {exp.path}: {e}")
+
+    @staticmethod
+    def _deconvolve(E, P, stacks):
+        with libcudawrapper.lock:
+            return llsdir.deconvolve_stacks(E, P, stacks)
+
+    def _on_processed(self, path, t, future):
+        exp = self.experiments.get(path)
+        error = future.exception()
+        if error is not None:
+            # not marked as done, so it is retried after a restart
+            logger.error(f"Processing timepoint {t} of {path} failed: {error}")
+            if exp is not None:
+                exp.failed.add(t)
+            return
+        self.nprocessed += 1
+        logger.info(f"Processed timepoint {t} of {path}")
+        if exp is not None:
+            exp.done.add(t)
+            exp.files.pop(t, None)
+            self._dirty = True
@@ -0,0 +1,179 @@
+"""Chunked OME-Zarr output of processed data.
+
+Instead of one tiff file per stack, :class:`ZarrWriter` writes every processed
+stack of an experiment into a single OME-Zarr (v0.4) store on a local
+directory::
+
+    cell1/cell1.ome.zarr/
+        GPUdecon/0, GPUdecon/1, ...   # TCZYX decon image and its multiscales
+        Deskewed/0, ...
+        Corrected/0, ...
+
+Each image is chunked per stack (one chunk per timepoint, channel and YX tile)
+and compressed, with downsampled (2x in Y and X) levels for viewers.  The
+physical pixel sizes of the multiscales metadata come from the ``dx`` and
+``dz`` of the writes, i.e. ``parameters.dx`` (or ``drdata``) and ``dzFinal``.
+
+:class:`ZarrWriter` is a drop-in replacement for
+:class:`~llspy.tiffio.AsyncTiffWriter` (see :class:`~llspy.tiffio.ChunkedWriter`):
+stacks submitted with the path of an output tiff go into the image of their
+folder, at their timepoint and channel, and are written (and compressed) in
+parallel, as stacks finish.  Select it with the ``outputFormat`` processing
+option.  :func:`open_image` reads an image back as a lazy TCZYX array::
+
+    >>> A = open_image("cell1/cell1.ome.zarr", "GPUdecon")
+    >>> A.shape
+    (500, 2, 65, 256, 512)
+    >>> A[10, 0].shape  # only reads the chunks of a single stack
+    (65, 256, 512)
+
+Requires the optional ``zarr`` package (version 2).
+"""
+
+import logging
+import threading
+
+from .tiffio import ChunkedWriter
+
+logger = logging.getLogger(__name__)
+
+#: default chunk shape (T, C, Z, Y, X), None is the full extent
+CHUNKS = (1, 1, None, 256, 256)
+
+
+def _import_zarr():
+    try:
+        import zarr
+    except ImportError as e:
+        raise ImportError(
+            "The zarr output format requires zarr: pip install 'zarr<3'"
+        ) from e
+    return zarr
+
+
+def default_compressor():
+    """Blosc/zstd, bit-shuffled, which suits noisy 16 bit microscopy data"""
+    from numcodecs import Blosc
+
+    return Blosc(cname="zstd", clevel=5, shuffle=Blosc.BITSHUFFLE)
+
+
+def downsample(stack, factor=2):
+    """Mean of factor x factor blocks in Y and X of a ZYX stack."""
+    nz, ny, nx = stack.shape
+    ny, nx = ny // factor, nx // factor
+    blocks = stack[:, : ny * factor, : nx * factor]
+    blocks = blocks.reshape(nz, ny, factor, nx, factor)
+    return blocks.mean((2, 4)).astype(stack.dtype)
+
+
+def multiscales(name, levels, dx=1, dz=1, dt=1):
+    """OME-Zarr v0.4 multiscales metadata of a TCZYX image"""
+    axes = [
+        {"name": "t", "type": "time", "unit": "second"},
+        {"name": "c", "type": "channel"},
+        *({"name": a, "type": "space", "unit": "micrometer"} for a in "zyx"),
+    ]
+    datasets = [
+        {
+            "path": str(i),
+            "coordinateTransformations": [
+                {"type": "scale", "scale": [dt, 1, dz, dx * 2**i, dx * 2**i]}
+            ],
+        }
+        for i in range(levels)
+    ]
+    return [{"version": "0.4", "name": name, "axes": axes, "datasets": datasets}]
+
+
+class ZarrWriter(ChunkedWriter):
+    """Write processed stacks to the TCZYX images of an OME-Zarr store.
+
+    Args:
+        path (str): store directory, created if necessary (existing images
+            are added to)
+        dt (float): time interval, for the metadata
+        levels (int): number of resolution levels, including full resolution
+        chunks (tuple): (T, C, Z, Y, X) chunk shape of every level
+        compressor: numcodecs compressor, :func:`default_compressor` if None
+        **kwargs: timepoints, channels and fpattern of
+            :class:`~llspy.tiffio.ChunkedWriter`, and the AsyncTiffWriter
+            options
+    """
+
+    def __init__(self, path, dt=1, levels=3, chunks=CHUNKS, compressor=None, **kwargs):
+        zarr = _import_zarr()
+        self.path = str(path)
+        self.root = zarr.open_group(self.path, mode="a")
+        self.dt = dt
+        self.levels = levels
+        self.chunks = tuple(chunks)
+        self.compressor = compressor or default_compressor()
+        self._images = {}  # image name: arrays of its levels
+        self._image_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    def _arrays(self, image, shape, dtype, dx, dz):
+        """the arrays of all levels of image, created or grown to fit shape"""
+        with self._image_lock:
+            if image not in self.root:
+                group = self.root.create_group(image)
+                arrays = []
+                for level in range(self.levels):
+                    lshape = (*shape[:3], shape[3] >> level, shape[4] >> level)
+                    if min(lshape[3:]) < 1:
+                        break
+                    arrays.append(
+                        group.create_dataset(
+                            str(level),
+                            shape=lshape,
+                            chunks=tuple(
+                                n if c is None else min(c, n)
+                                for c, n in zip(self.chunks, lshape)
+                            ),
+                            dtype=dtype,
+                            compressor=self.compressor,
+                            fill_value=0,
+                            dimension_separator="/",
+                        )
+                    )
+                group.attrs["multiscales"] = multiscales(
+                    image, len(arrays), dx, dz, self.dt
+                )
+                self._images[image] = arrays
+            if image not in self._images:
+                group = self.root[image]
+                self._images[image] = [group[str(i)] for i in range(len(group))]
+            arrays = self._images[image]
+            if arrays[0].shape[2:] != shape[2:]:
+                raise ValueError(
+                    f"Cannot write a stack of shape {shape[2:]} to {image} "
+                    f"of shape {arrays[0].shape[2:]}"
+                )
+            if any(n > m for n, m in zip(shape[:2], arrays[0].shape[:2])):
+                grown = tuple(max(n, m) for n, m in zip(shape[:2], arrays[0].shape))
+                for arr in arrays:
+                    arr.resize(*grown, *arr.shape[2:])
+            return arrays
+
+    def write_stack(self, image, stack, t, c, dx=1, dz=1):
+        """Write the ZYX stack of timepoint t and channel c to image (and its
+        downsampled levels)."""
+        stack, ti, ci, shape = self.locate(stack, t, c)
+        arrays = self._arrays(image, shape, stack.dtype, dx, dz)
+        for level, arr in enumerate(arrays):
+            if level:
+                stack = downsample(stack)
+            arr[ti, ci] = stack
+
+
+def open_image(path, image="GPUdecon", level=0):
+    """Lazy TCZYX array of an image in a store written by :class:`ZarrWriter`.
+
+    Indexing it reads (and decompresses) only the chunks that are needed.
+    """
+    zarr = _import_zarr()
+    root = zarr.open_group(str(path), mode="r")
+    if image not in root:
+        raise KeyError(f"No {image} image in {path}, found: {list(root)}")
+    return root[image][str(level)]
@@ -1,5 +1,34 @@
+import shutil
+from pathlib import Path
+
+import numpy as np
 import pytest
+import tifffile
 
 from llspy.libcudawrapper import cudaLib
 
 requires_cuda = pytest.mark.skipif(not cudaLib, reason="Cannot test without CUDA")
+
+TESTDATA = Path(__file__).parent / "testdata"
+
+
+def make_lls_folder(path, nt=3, waves=(488, 642), shape=(6, 16, 20), seed=0):
+    """write a small fake LLS experiment (settings file + raw tiffs) to path."""
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    shutil.copy(TESTDATA / "sample" / "sample_Settings.txt", path)
+    rng = np.random.default_rng(seed)
+    for t in range(nt):
+        for c, wave in enumerate(waves):
+            data = rng.poisson(100, size=shape).astype(np.uint16)
+            fname = (
+                f"sample_ch{c}_stack{t:04d}_{wave}nm_{t * 1000:07d}msec_"
+                f"{1000000 + t * 1000:010d}msecAbs.tif"
+            )
+            tifffile.imwrite(str(path / fname), data)
+    return path
+
+
+@pytest.fixture
+def lls_folder(tmp_path):
+    return make_lls_folder(tmp_path / "sample")
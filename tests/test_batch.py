@@ -0,0 +1,115 @@
+import threading
+import time
+from multiprocessing import cpu_count
+
+import pytest
+
+from llspy import batch, config, llsdir
+
+LOG = []
+STARTED = {}
+
+
+class FakeJob:
+    def __init__(self, exp, binary=None, processes=None, **kwargs):
+        self.name = exp
+        self.processes = processes
+        self.ready = True
+        self.needs_correction = True
+        self.needs_decon = True
+        self.P = None
+        self.exp = None
+        STARTED.setdefault(exp, threading.Event())
+
+    def correct(self):
+        LOG.append(("correct", self.name))
+        STARTED[self.name].set()
+
+    def deconvolve(self):
+        if self.name == "exp0":
+            # only finishes if exp1 can be corrected in the meantime
+            assert STARTED["exp1"].wait(5)
+        LOG.append(("deconvolve", self.name))
+
+    def finish(self):
+        if self.name == "exp2":
+            raise ValueError("finish failed")
+        LOG.append(("finish", self.name))
+
+    def abort(self):
+        pass
+
+
+@pytest.fixture
+def fake_jobs(monkeypatch):
+    LOG.clear()
+    STARTED.clear()
+    # exp0 may be deconvolving before exp1 has been prepared
+    STARTED["exp1"] = threading.Event()
+    monkeypatch.setattr(batch, "ProcessJob", FakeJob)
+    monkeypatch.setattr(batch, "_timepoint_bytes", lambda job: 0)
+    return LOG
+
+
+def test_batch_overlaps_stages(fake_jobs):
+    with batch.BatchScheduler(jobs=2, cpu_workers=1, decon_workers=1) as scheduler:
+        for i in range(3):
+            scheduler.submit(f"exp{i}")
+    assert list(scheduler.errors) == ["exp2"]
+    assert ("correct", "exp1") in fake_jobs
+    assert fake_jobs.index(("correct", "exp1")) < fake_jobs.index(
+        ("deconvolve", "exp0")
+    )
+    for i in range(2):
+        stages = [s for s, name in fake_jobs if name == f"exp{i}"]
+        assert stages == ["correct", "deconvolve", "finish"]
+
+
+def test_cpu_share(fake_jobs):
+    with batch.BatchScheduler(jobs=2, cpu_workers=2) as scheduler:
+        job = scheduler.submit("exp1").result()
+    assert job.processes == max(1, cpu_count() // 2)
+
+
+def test_cpu_pool_in_thread():
+    result = {}
+
+    def run():
+        with llsdir.cpu_pool(1) as pool:
+            result["method"] = pool._ctx.get_start_method()
+            result["value"] = pool.apply(abs, (-2,))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(60)
+    assert result == {"method": "spawn", "value": 2}
+
+
+def test_memory_budget():
+    budget = batch.MemoryBudget(100)
+    budget.acquire(60)
+    acquired = threading.Event()
+
+    def take():
+        budget.acquire(60)
+        acquired.set()
+
+    thread = threading.Thread(target=take, daemon=True)
+    thread.start()
+    time.sleep(0.1)
+    assert not acquired.is_set()
+    budget.release(60)
+    assert acquired.wait(5)
+    # larger than the whole budget: runs alone instead of blocking forever
+    budget.release(60)
+    with budget.reserve(500):
+        assert budget.used == 100
+
+
+def test_batch_real_experiment(lls_folder):
+    with batch.BatchScheduler(jobs=2) as scheduler:
+        future = scheduler.submit(str(lls_folder), nIters=0, trimZ=(1, 0))
+    assert not scheduler.errors
+    job = future.result()
+    assert isinstance(job, llsdir.ProcessJob) and job.ready
+    assert any(f.name.endswith(config.__OUTPUTLOG__) for f in lls_folder.iterdir())
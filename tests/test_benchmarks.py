@@ -0,0 +1,47 @@
+"""Run every benchmark of the asv suite once, on the quick preset."""
+
+import importlib
+import inspect
+import itertools
+import pkgutil
+
+import benchmarks
+import pytest
+from benchmarks import common
+
+PREFIXES = ("time_", "track_", "peakmem_", "mem_")
+
+
+def _benchmarks():
+    for info in pkgutil.iter_modules(benchmarks.__path__):
+        if not info.name.startswith("bench_"):
+            continue
+        module = importlib.import_module(f"benchmarks.{info.name}")
+        for _, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != module.__name__:
+                continue
+            for name in dir(cls):
+                if name.startswith(PREFIXES):
+                    yield pytest.param(cls, name, id=f"{cls.__name__}.{name}")
+
+
+@pytest.mark.parametrize("cls, name", _benchmarks())
+def test_benchmark(cls, name, tmp_path, monkeypatch):
+    monkeypatch.setattr(common, "SIZE", common.PRESETS["quick"])
+    monkeypatch.chdir(tmp_path)
+    suite = cls()
+    cache = (suite.setup_cache(),) if hasattr(suite, "setup_cache") else ()
+    params = getattr(cls, "params", [])
+    if params and not isinstance(params[0], (list, tuple)):
+        params = [params]
+    for args in itertools.product(*params):
+        args = cache + args
+        if hasattr(suite, "setup"):
+            suite.setup(*args)
+        try:
+            result = getattr(suite, name)(*args)
+            if name.startswith("track_"):
+                assert result > 0
+        finally:
+            if hasattr(suite, "teardown"):
+                suite.teardown(*args)
@@ -0,0 +1,67 @@
+import os
+
+from click.testing import CliRunner
+
+from llspy import catalog, llsdir
+from llspy.bin.llspy_cli import cli
+
+from .conftest import make_lls_folder
+
+
+def test_catalog_update_and_query(tmp_path, monkeypatch):
+    a = make_lls_folder(tmp_path / "data" / "cellA", nt=1)
+    b = make_lls_folder(tmp_path / "data" / "cellB", nt=1)
+    cat = catalog.Catalog(str(tmp_path / "catalog.db"))
+    assert cat.update(str(tmp_path / "data")) == {
+        "added": 2,
+        "updated": 0,
+        "unchanged": 0,
+        "failed": 0,
+        "removed": 0,
+    }
+    row = cat.get(str(a))
+    assert (row["nc"], row["nt"], row["nz"]) == (2, 10, 6)
+    assert row["size"] > 0
+    assert not row["compressed"]
+
+    # unchanged folders are not parsed again
+    parsed = []
+    monkeypatch.setattr(
+        catalog.Catalog, "record", lambda self, E, **kw: parsed.append(E)
+    )
+    (b / "extra.txt").write_text("x")
+    os.utime(b, (0, 0))
+    counts = cat.update(str(tmp_path / "data"))
+    assert counts["unchanged"] == 1
+    assert parsed == [str(b)]
+    monkeypatch.undo()
+
+    # the sample Settings.txt dates from 2017
+    assert len(cat.query(str(tmp_path), min_age=30, compressed=False)) == 2
+    assert cat.query(str(tmp_path), min_size=10**12) == []
+    assert [r["path"] for r in cat.query(str(a))] == [str(a)]
+    assert cat.query(str(tmp_path / "data" / "cell")) == []
+
+    os.rename(a, tmp_path / "data" / "moved")
+    assert cat.update(str(tmp_path / "data"))["removed"] == 1
+    assert len(cat) == 2
+    cat.close()
+
+
+def test_index_and_info_cli(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLSPY_CATALOG", str(tmp_path / "catalog.db"))
+    make_lls_folder(tmp_path / "data" / "cellA", nt=1)
+    runner = CliRunner()
+    result = runner.invoke(cli, ["index", str(tmp_path / "data")])
+    assert result.exit_code == 0, result.output
+    assert "1 added" in result.output
+
+    def fail(*args, **kwargs):
+        raise AssertionError("info --catalog must not read the folder")
+
+    monkeypatch.setattr(llsdir, "LLSdir", fail)
+    result = runner.invoke(cli, ["info", "--catalog", "--older", "30", str(tmp_path)])
+    assert result.exit_code == 0, result.output
+    assert "cellA" in result.output
+    result = runner.invoke(cli, ["info", "--older", "30", str(tmp_path)])
+    assert result.exit_code != 0
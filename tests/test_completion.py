@@ -0,0 +1,101 @@
+import time
+
+from qtpy import QtCore
+
+from llspy.completion import CompletionTracker
+
+
+def _tracker(**kwargs):
+    done = []
+    kwargs.setdefault("settle", 0.1)
+    kwargs.setdefault("interval", 0.01)
+    return CompletionTracker(done.append, **kwargs), done
+
+
+def test_expected_size(tmp_path):
+    path = tmp_path / "stack.tif"
+    path.write_bytes(b"x" * 50)
+    tracker, done = _tracker(expected_size=100)
+    tracker.watch(str(path))
+    tracker.closed(str(path))  # closed but not complete yet (e.g. reopened)
+    tracker.poll()
+    assert not done
+    with open(path, "ab") as f:
+        f.write(b"x" * 50)
+    tracker.poll()
+    tracker.poll()
+    assert done == [str(path)]
+    assert not len(tracker)
+
+
+def test_close_event_and_settle(tmp_path):
+    closed, stable = tmp_path / "a.tif", tmp_path / "b.tif"
+    closed.write_bytes(b"x")
+    stable.write_bytes(b"x")
+    tracker, done = _tracker()
+    tracker.watch(str(closed))
+    tracker.watch(str(stable))
+    tracker.closed(str(closed))
+    tracker.closed(str(closed))
+    tracker.closed(str(tmp_path / "untracked.tif"))
+    assert done == [str(closed)]
+
+    tracker.start()
+    try:
+        end = time.time() + 5
+        while len(done) < 2 and time.time() < end:
+            time.sleep(0.01)
+    finally:
+        tracker.stop()
+    assert done == [str(closed), str(stable)]
+
+
+def test_partial_file(tmp_path):
+    path = tmp_path / "stack.tif"
+    path.write_bytes(b"x" * 10)
+    tracker, done = _tracker(expected_size=lambda p: 100, partial_timeout=0.1)
+    tracker.watch(str(path))
+    tracker.poll()
+    time.sleep(0.2)
+    tracker.poll()
+    assert done == [str(path)]
+
+
+def test_main_handler_waits_for_folder(tmp_path, qapp):
+    from watchdog import events
+
+    from llspy.gui.watcher import MainHandler
+
+    handler = MainHandler(settle=0.2)
+    handler.tracker.settle = 0.3
+    handler.tracker.interval = 0.01
+    found, finished = [], []
+    handler.foundLLSdir.connect(found.append, QtCore.Qt.DirectConnection)
+    handler.finishedLLSdir.connect(finished.append, QtCore.Qt.DirectConnection)
+    try:
+        exp = tmp_path / "exp"
+        exp.mkdir()
+        settings = exp / "sample_Settings.txt"
+        settings.write_text("settings")
+        handler.on_created(events.FileCreatedEvent(str(settings)))
+        handler.on_closed(events.FileClosedEvent(str(settings)))
+        assert found == [str(exp)]
+
+        # a raw file is still being written
+        stack = exp / "stack.tif"
+        stack.write_bytes(b"x")
+        handler.on_created(events.FileCreatedEvent(str(stack)))
+        for _ in range(10):
+            with open(stack, "ab") as f:
+                f.write(b"x")
+            time.sleep(0.05)
+        assert not finished
+
+        handler.on_closed(events.FileClosedEvent(str(stack)))
+        end = time.time() + 5
+        while not finished and time.time() < end:
+            time.sleep(0.01)
+        assert finished == [str(exp)]
+        assert not handler.pending
+    finally:
+        handler.stop()
@@ -0,0 +1,61 @@
+import os
+import stat
+
+import pytest
+
+from llspy import cudabinwrapper
+
+STUB = """#!/bin/sh
+echo "$1" >> "{log}"
+if [ "$1" = "-v" ]; then echo "cudaDeconv 1.0"; exit 0; fi
+echo "Allowed options:"
+echo "  -i [ --input-dir ] arg   input directory"
+echo "  -p [ --filename-pattern ] arg   file pattern"
+echo "  --RL arg   number of iterations"
+"""
+
+
+@pytest.fixture
+def stub_binary(tmp_path, monkeypatch):
+    monkeypatch.setattr(cudabinwrapper, "PROBE_CACHE", str(tmp_path / "probe.json"))
+    monkeypatch.setattr(cudabinwrapper, "_instances", {})
+    log = tmp_path / "calls.txt"
+    binary = tmp_path / "cudaDeconv"
+    binary.write_text(STUB.format(log=log))
+    binary.chmod(binary.stat().st_mode | stat.S_IEXEC)
+    return str(binary), log
+
+
+def _calls(log):
+    return log.read_text().split() if log.exists() else []
+
+
+def test_probe_is_cached(stub_binary):
+    binary, log = stub_binary
+    first = cudabinwrapper.CUDAbin(binary)
+    assert _calls(log) == ["-h"]
+    assert first.has_option_longname("RL")
+    assert first.get_version().strip() == "cudaDeconv 1.0"
+    assert first.get_version().strip() == "cudaDeconv 1.0"
+    assert _calls(log) == ["-h", "-v"]
+
+    # new instances (e.g. in another process) read the cache from disk
+    second = cudabinwrapper.CUDAbin(binary)
+    assert second.options == first.options
+    assert second.get_version().strip() == "cudaDeconv 1.0"
+    assert _calls(log) == ["-h", "-v"]
+
+
+def test_shared_instance(stub_binary):
+    binary, log = stub_binary
+    instances = {id(cudabinwrapper.get_cudabin(binary)) for _ in range(200)}
+    assert len(instances) == 1
+    assert _calls(log) == ["-h"]
+
+    # a changed binary is probed again
+    with open(binary, "a") as f:
+        f.write("# rebuilt\n")
+    st = os.stat(binary)
+    os.utime(binary, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert id(cudabinwrapper.get_cudabin(binary)) not in instances
+    assert _calls(log) == ["-h", "-h"]
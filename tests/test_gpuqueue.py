@@ -0,0 +1,75 @@
+import stat
+import time
+
+from qtpy import QtCore
+
+from llspy import llsdir
+from llspy.gui import workers
+from llspy.gui.workers import DeviceWorkQueue, divide_arg_queue
+
+STUB = """#!/bin/sh
+if [ "$CUDA_VISIBLE_DEVICES" = "0" ]; then sleep 0.3; else sleep 0.02; fi
+echo "$CUDA_VISIBLE_DEVICES $1" >> "{log}"
+echo ">>>file_finished"
+"""
+
+
+def test_device_work_queue():
+    queue = DeviceWorkQueue(range(5), devices=[0, 1])
+    assert queue.start() == [(0, 0), (1, 1)]
+    assert queue.start() == []  # every device is busy
+    assert queue.task_done(1) == 2
+    assert queue.task_done(1) == 3
+    assert queue.task_done(0) == 4
+    assert queue.task_done(0) is None
+    assert not queue.all_done
+    assert queue.task_done(1) is None
+    assert queue.all_done
+
+
+def test_work_stealing_with_stub_binary(tmp_path, lls_folder, qapp, monkeypatch):
+    log = tmp_path / "calls.txt"
+    binary = tmp_path / "cudaDeconv"
+    binary.write_text(STUB.format(log=log))
+    binary.chmod(binary.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(workers, "_CUDABIN", str(binary))
+    monkeypatch.setattr(qapp, "gpuset", [0, 1], raising=False)
+
+    # drive the real LLSitemWorker dispatch, with fake cudaDeconv chunks
+    worker = workers.LLSitemWorker(str(lls_folder), 0, {})
+    worker._LLSitemWorker__argQueue = DeviceWorkQueue(
+        [[f"chunk{i}"] for i in range(12)], devices=qapp.gpuset
+    )
+    worker.nFiles, worker.nFiles_done = 12, 0
+    worker.timer = QtCore.QTime()
+    worker.timer.start()
+    done = []
+    worker.post_process = lambda: done.append(True)
+
+    worker.startCUDAWorkers()
+    end = time.time() + 30
+    while not done and time.time() < end:
+        qapp.processEvents()
+        time.sleep(0.01)
+    assert done == [True]
+
+    calls = [line.split() for line in log.read_text().splitlines()]
+    assert sorted(c[1] for c in calls) == sorted(f"chunk{i}" for i in range(12))
+    per_device = {d: sum(c[0] == d for c in calls) for d in ("0", "1")}
+    # the fast device takes over the work of the slow one
+    assert per_device["1"] > per_device["0"]
+
+
+class FakeBinary:
+    def assemble_args(self, **opts):
+        return dict(opts)
+
+
+def test_divide_arg_queue_chunks(lls_folder):
+    E = llsdir.LLSdir(str(lls_folder))
+    E.localParams(nIters=0).otfs = ["otf488", "otf642"]
+    one_gpu = divide_arg_queue(E, 1, FakeBinary())
+    assert len(one_gpu) == 2  # one call per channel
+    two_gpus = divide_arg_queue(E, 2, FakeBinary(), chunks_per_gpu=4)
+    assert len(two_gpus) == 6  # one call per timepoint and channel
+    assert [a["otf-file"] for a in two_gpus] == ["otf488"] * 3 + ["otf642"] * 3
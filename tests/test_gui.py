@@ -7,6 +7,8 @@ from llspy.exceptions import CUDAbinException
 from llspy.gui.exceptions import MissingBinaryError
 from llspy.gui.mainwindow import main_GUI
 
+from .conftest import make_lls_folder
+
 TEST_DATA = Path(__file__).parent / "testdata"
 SAMPLE = TEST_DATA / "sample"
 
@@ -17,6 +19,8 @@ def main_window(qtbot):
     with contextlib.suppress(MissingBinaryError, CUDAbinException):
         win = main_GUI()
     qtbot.addWidget(win)
+    # don't block teardown on the "Unprocessed items" dialog
+    win.confirmOnQuitCheckBox.setChecked(False)
     yield win
 
 
@@ -26,4 +30,77 @@ def test_main_window(main_window):
 
 def test_add_path(main_window: main_GUI):
     main_window.listbox.addPath(str(SAMPLE))
+    # scanned in the background: duplicate requests are ignored
+    main_window.listbox.addPath(str(SAMPLE))
+    main_window.listbox.finishScans()
     assert main_window.listbox.rowCount() == 1
+    assert not main_window.listbox.scans
+
+
+def test_add_parent_folder(main_window: main_GUI, tmp_path):
+    for i in range(3):
+        make_lls_folder(tmp_path / f"exp{i}")
+    main_window.listbox.addPath(str(tmp_path))
+    main_window.listbox.finishScans()
+    assert main_window.listbox.rowCount() == 3
+    paths = {main_window.listbox.getPathByIndex(i) for i in range(3)}
+    assert paths == {str(tmp_path / f"exp{i}") for i in range(3)}
+
+
+def test_prepare_item(lls_folder):
+    from llspy import llsdir
+    from llspy.gui import workers
+
+    E = llsdir.LLSdir(str(lls_folder))
+    item = workers.prepare_item(E, {"nIters": 0, "trimZ": (1, 0)})
+    assert item.ready and item.staged is None and item.corrected
+    assert item.E.path.name == "Corrected"
+    assert len(list(item.E.path.glob("*.tif"))) == 6
+    # the LLSdir in the queue still points at the experiment
+    assert E.path == lls_folder
+
+    # a GPU flash correction is left to the worker
+    opts = {"nIters": 0, "correctFlash": True, "flashCorrectTarget": "cuda"}
+    item = workers.prepare_item(E, opts, use_gpu=False)
+    assert item.ready and not item.corrected
+    assert item.E.path == lls_folder
+
+
+def test_lookahead(main_window: main_GUI, tmp_path):
+    for i in range(4):
+        main_window.listbox.addPath(
+            str(make_lls_folder(tmp_path / f"exp{i}")), wait=True
+        )
+    main_window.optionsOnProcessClick = {
+        "reprocess": False,
+        "nIters": 0,
+        "trimZ": (1, 0),
+    }
+    # row 0 is being processed: the next two rows are prepared
+    main_window.prepare_upcoming_items(1)
+    prepared = main_window.preparedItems
+    assert sorted(prepared) == [str(tmp_path / f"exp{i}") for i in (1, 2)]
+    for future in prepared.values():
+        assert future.result().ready
+    main_window.discard_prepared_items()
+    assert not main_window.preparedItems
+
+
+def test_running_discarded_item(main_window: main_GUI, tmp_path):
+    from concurrent.futures import Future
+
+    from llspy.gui import workers
+
+    path = str(make_lls_folder(tmp_path / "exp0"))
+    main_window.listbox.addPath(path, wait=True)
+    main_window.optionsOnProcessClick = {"reprocess": False, "nIters": 0}
+    running = Future()
+    running.set_running_or_notify_cancel()
+    main_window.preparedItems = {path: running}
+    main_window.discard_prepared_items()
+    # not prepared again while the discarded preparation is still running
+    assert main_window.running_discarded_item(path) is running
+    main_window.prepare_upcoming_items(0)
+    assert not main_window.preparedItems
+    running.set_result(workers.PreparedItem(None))
+    assert main_window.running_discarded_item(path) is None
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from llspy import libcudawrapper, llsdir, pipeline, util
+
+h5py = pytest.importorskip("h5py")
+hdf5io = pytest.importorskip("llspy.hdf5io")
+
+
+def test_write_hdf5(tmp_path):
+    path = str(tmp_path / "data.h5")
+    data = np.random.randint(0, 1000, (3, 4, 5)).astype(np.uint16)
+    util.writeHDF5(path, data, compression="gzip")
+    util.writeHDF5(path, data[:2], append=True)
+    with h5py.File(path, "r") as f:
+        assert f["data"].chunks == (1, 4, 5)
+        assert f["data"].compression == "gzip"
+    out = util.readHDF5(path)
+    np.testing.assert_array_equal(out, np.concatenate([data, data[:2]]))
+    np.testing.assert_array_equal(util.readHDF5Frame(path, 4), data[1])
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_hdf5_writer(tmp_path, compression):
+    path = tmp_path / "cell1_processed.h5"
+    stacks = np.random.randint(0, 1000, (3, 2, 4, 10, 12)).astype(np.uint16)
+    name = "cell1_ch{}_stack{:04d}_488nm_0000000msec_0001000000msecAbs_decon.tif"
+    # T grows as stacks are appended
+    with hdf5io.HDF5Writer(path, compression=compression, workers=3) as writer:
+        for t in range(3):
+            for c in range(2):
+                outpath = tmp_path / "GPUdecon" / name.format(c, t)
+                writer.submit(stacks[t, c], outpath, dx=0.1, dz=0.25)
+    assert not (tmp_path / "GPUdecon").exists()
+
+    A = hdf5io.open_image(path, "GPUdecon")
+    assert A.shape == (3, 2, 4, 10, 12)
+    assert A.chunks == (1, 1, 4, 10, 12)
+    assert A.compression == compression
+    assert tuple(A.attrs["element_size_um"]) == (0.25, 0.1, 0.1)
+    np.testing.assert_array_equal(A[()], stacks)
+    frame = util.readHDF5Frame(str(path), (2, 1), "GPUdecon")
+    np.testing.assert_array_equal(frame, stacks[2, 1])
+    with pytest.raises(KeyError):
+        hdf5io.open_image(path, "Deskewed")
+
+
+def test_stream_process_hdf5(lls_folder, monkeypatch):
+    def quickDecon(im, otf, savedeskew=False, **kwargs):
+        result = im.astype(np.float32)
+        return (result, result.copy()) if savedeskew else result
+
+    monkeypatch.setattr(libcudawrapper, "quickDecon", quickDecon)
+    E = llsdir.LLSdir(str(lls_folder))
+    P = E.localParams(nIters=0, outputFormat="hdf5", saveDeskewedRaw=True)
+    P.nIters = 5
+    P.otfs = ["otf488", "otf642"]
+    pipeline.stream_process(E, P)
+
+    assert pipeline.output_store(E, P).name == "sample_processed.h5"
+    decon = E.output_array("GPUdecon")
+    assert decon.shape == (3, 2, 6, 16, 20)
+    assert decon.dtype == np.uint16
+    assert E.output_array("Deskewed").shape == (3, 2, 6, 16, 20)
+    with pytest.raises(ValueError):
+        E.output_array("GPUdecon", level=1)
+    decon.file.close()
+
+    E.reduce_to_raw(verbose=False)
+    assert not pipeline.output_store(E, P).exists()
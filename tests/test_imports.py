@@ -0,0 +1,66 @@
+import json
+import subprocess
+import sys
+
+import pytest
+
+# modules that take most of a second to import (or load native libraries) and
+# must only be imported when they are used
+HEAVY = ("numba", "scipy", "matplotlib", "fiducialreg")
+
+SCRIPT = """
+import json, sys
+{code}
+import llspy.libcudawrapper, llspy.otf, llspy.compress
+print(json.dumps({{
+    "modules": sorted(sys.modules),
+    "cudaLib": llspy.libcudawrapper._loaded,
+    "otflib": llspy.otf._loaded,
+    "which": llspy.compress.available_compression.cache_info().currsize,
+}}))
+"""
+
+
+def _imported(code):
+    proc = subprocess.run(
+        [sys.executable, "-c", SCRIPT.format(code=code)],
+        capture_output=True,
+        text=True,
+    )
+    assert proc.returncode == 0, proc.stderr
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def _heavy(modules):
+    return [m for m in modules if m.split(".")[0] in HEAVY]
+
+
+@pytest.mark.parametrize(
+    "code",
+    [
+        "import llspy",
+        "import llspy.llsdir",
+        "from click.testing import CliRunner\n"
+        "from llspy.bin.llspy_cli import cli\n"
+        "assert CliRunner().invoke(cli, ['--help']).exit_code == 0",
+    ],
+)
+def test_lazy_imports(code):
+    result = _imported(code)
+    assert not _heavy(result["modules"])
+    assert not result["cudaLib"]
+    assert not result["otflib"]
+    assert not result["which"]
+
+
+def test_info_imports(lls_folder):
+    code = (
+        "from click.testing import CliRunner\n"
+        "from llspy.bin.llspy_cli import cli\n"
+        f"result = CliRunner().invoke(cli, ['info', {str(lls_folder)!r}])\n"
+        "assert result.exit_code == 0 and 'sample' in result.output, result.output"
+    )
+    result = _imported(code)
+    assert "llspy.llsdir" in result["modules"]
+    assert not _heavy(result["modules"])
+    assert not result["cudaLib"]
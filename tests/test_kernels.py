@@ -0,0 +1,86 @@
+import pickle
+import threading
+
+import numpy as np
+
+from llspy import kernels, llsdir
+from llspy.camera import calc_correction
+
+
+def _reference(stack, a, b, offset):
+    stack = stack.astype(float)
+    res = np.clip(stack - offset, 0, None)
+    cor = a * (1 - np.exp(-b * (stack[:-1] - offset)))
+    res[1:] = np.clip(stack[1:] - offset - 0.88 * cor, 0, None)
+    return res
+
+
+def test_warm_up():
+    assert kernels.warm_up() == []
+    assert {
+        "llspy.camera.calc_correction",
+        "llspy.camcalib.fun",
+        "fiducialreg.imwarp.transformPoints",
+    } <= set(kernels.REGISTRY)
+    assert all(k.compiled for k in kernels.REGISTRY.values())
+
+
+def test_calc_correction():
+    rng = np.random.default_rng(0)
+    stack = rng.integers(90, 200, size=(4, 5, 6), dtype=np.uint16)
+    a = rng.uniform(0, 50, size=(5, 6)).astype(np.float32)
+    b = rng.uniform(0, 0.01, size=(5, 6)).astype(np.float32)
+    offset = np.full((5, 6), 100, dtype=np.float32)
+    out = calc_correction(stack, a, b, offset)
+    assert out.dtype == np.uint16
+    np.testing.assert_allclose(out, _reference(stack, a, b, offset), atol=1)
+
+    dispatcher = calc_correction.compile()
+    # the declared signatures cover the types used by the pipeline
+    nsigs = len(getattr(dispatcher, "signatures", ()))
+    calc_correction(stack, a.astype(float), b.astype(float), offset.astype(float))
+    assert len(getattr(dispatcher, "signatures", ())) == nsigs
+
+
+def test_transform_points():
+    from fiducialreg.imwarp import transformPoints
+
+    x, y, z = np.meshgrid([0.0, 1.0], [0.0, 2.0], [0.0, 3.0])
+    M = np.eye(4)
+    M[:3, 3] = (1, 2, 3)
+    xt, yt, zt = transformPoints(M, x, y, z)
+    np.testing.assert_allclose(xt, x + 1)
+    np.testing.assert_allclose(zt, z + 3)
+    xi, _, _ = transformPoints(M, xt, yt, zt, inverse=True)
+    np.testing.assert_allclose(xi, x)
+
+
+def test_kernel_pickles_by_name():
+    assert pickle.loads(pickle.dumps(calc_correction)) is calc_correction
+
+
+def test_start_warm_up(monkeypatch):
+    monkeypatch.setenv("LLSPY_JIT_WARMUP", "0")
+    assert kernels.start_warm_up() is None
+    monkeypatch.setenv("LLSPY_JIT_WARMUP", "1")
+    thread = kernels.start_warm_up(["llspy.camera.calc_correction"])
+    thread.join()
+    assert calc_correction.compiled
+
+
+def _worker_compiled():
+    return calc_correction.compiled
+
+
+def test_cpu_pool_warms_up_workers():
+    result = []
+
+    def run():
+        # a pool created outside the main thread spawns fresh interpreters
+        with llsdir.cpu_pool(1, jit=[calc_correction.name]) as pool:
+            result.append(pool.apply(_worker_compiled))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    assert result == [True]
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from llspy import util
+from llspy.llsdir import LLSdir
+
+
+@pytest.fixture
+def arr(lls_folder):
+    return LLSdir(lls_folder).as_array(cache_size=2)
+
+
+@pytest.fixture
+def eager(lls_folder):
+    E = LLSdir(lls_folder)
+    return np.stack(
+        [np.stack([util.imread(f) for f in E.get_files(t=t)]) for t in range(3)]
+    )
+
+
+def test_shape_and_indexing(arr, eager):
+    assert arr.shape == eager.shape == (3, 2, 6, 16, 20)
+    assert arr.dtype == np.uint16
+    np.testing.assert_array_equal(arr[1, 0], eager[1, 0])
+    np.testing.assert_array_equal(arr[-1, :, 2:4, ::2], eager[-1, :, 2:4, ::2])
+    np.testing.assert_array_equal(arr[[0, 2], 1, ..., 5], eager[[0, 2], 1, ..., 5])
+    np.testing.assert_array_equal(np.asarray(arr), eager)
+    assert len(arr._cache) <= 2
+
+
+@pytest.mark.parametrize("func", [np.max, np.min, np.sum, np.mean])
+@pytest.mark.parametrize("axis", [None, 0, 2, (0, 1), (2, 3, 4), -1])
+def test_chunked_reductions(arr, eager, func, axis):
+    np.testing.assert_allclose(func(arr, axis=axis), func(eager, axis=axis))
+
+
+def test_memmap_used(arr):
+    assert isinstance(arr.get_stack(0, 0), np.memmap)
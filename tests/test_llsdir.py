@@ -1,6 +1,10 @@
 import hashlib
 import os
 
+import numpy as np
+
+from llspy import llsdir, synthetic, util
+
 
 def sha1OfFile(filepath):
     sha = hashlib.sha1()
@@ -25,3 +29,33 @@ def hash_dir(dir_path):
             hashes.append(hash_dir(os.path.join(path, _dir)))
         break  # we only need one iteration - to get files and dirs in current directory
     return str(hash("".join(hashes)))
+
+
+def test_mergemips(tmp_path):
+    path = synthetic.make_experiment(
+        tmp_path / "exp", nz=8, ny=32, nx=24, nt=3, name="cell1", mips=True
+    )
+    folder = path / "MIPs"
+    mips = llsdir.list_mips(folder)
+    assert sorted(mips) == ["x", "y", "z"] and sorted(mips["y"]) == [0, 1]
+
+    stack = llsdir.mergemips(folder, "y", write=False, delete=False, mips=mips)
+    assert stack.shape == (3, 1, 2, 8, 24)
+    for t in range(3):
+        for c in range(2):
+            (mip,) = folder.glob(f"*ch{c}_stack{t:04d}_*MIP_y.tif")
+            np.testing.assert_array_equal(stack[t, 0, c], util.imread(str(mip)))
+
+    # channels with different numbers of timepoints can't be merged
+    next(folder.glob("*ch1_stack0002_*MIP_x.tif")).unlink()
+    assert llsdir.mergemips(folder, "x", delete=False) is None
+
+    llsdir.LLSdir(str(path)).mergemips()
+    assert sorted(f.name for f in folder.glob("*MIP_[yz].tif")) == [
+        "cell1_comboMIP_y.tif",
+        "cell1_comboMIP_z.tif",
+    ]
+    assert len(list(folder.glob("*ch*MIP_x.tif"))) == 5
+    np.testing.assert_array_equal(
+        util.imread(str(folder / "cell1_comboMIP_y.tif")), stack[:, 0]
+    )
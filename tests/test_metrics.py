@@ -0,0 +1,80 @@
+import json
+import threading
+
+import pytest
+
+from llspy import config, llsdir, metrics
+
+
+def test_recorder(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    recorder = metrics.Recorder(experiment="exp")
+    with recorder.span("read"):
+        (tmp_path / "data").write_bytes(b"x" * 100000)
+    # spans recorded before the path is set are written when it is set
+    recorder.set_path(path)
+    with pytest.raises(ValueError):
+        with recorder.span("correct", files=2):
+            raise ValueError("boom")
+    span = recorder.span("read")
+    span.stop()
+
+    events = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [e["stage"] for e in events] == ["read", "correct", "read"]
+    assert all(e["experiment"] == "exp" for e in events)
+    assert events[1]["files"] == 2 and "boom" in events[1]["error"]
+    assert events[0]["peak_rss"] > 0
+    if events[0]["write_bytes"] is not None:
+        assert events[0]["write_bytes"] >= 100000
+
+    summary = recorder.summary()
+    assert list(summary) == ["read", "correct", "total"]
+    assert summary["read"]["count"] == 2
+    assert summary["total"]["count"] == 3
+    assert "correct" in recorder.format_summary()
+
+
+def test_recorder_iterate():
+    recorder = metrics.Recorder()
+    assert list(recorder.iterate("read", range(3))) == [0, 1, 2]
+    assert recorder.summary()["read"]["count"] == 3
+
+
+def test_current_stage():
+    recorder = metrics.Recorder()
+    assert recorder.current_stage() is None
+    with recorder.span("correct"):
+        with recorder.span("read"):
+            assert recorder.current_stage(threading.get_ident()) == "read"
+        # helper threads are attributed to the innermost stage of any thread
+        assert recorder.current_stage(-1) == "correct"
+    for _ in recorder.iterate("read", range(2)):
+        assert recorder.current_stage() is None
+    assert recorder.current_stage() is None
+
+
+def test_process_metrics(lls_folder):
+    llsdir.process(str(lls_folder), nIters=0, trimZ=(1, 0), mergeMIPs=False)
+    E = llsdir.LLSdir(str(lls_folder))
+    with open(lls_folder / f"{E.basename}_{config.__OUTPUTLOG__}") as f:
+        log = json.load(f)
+    assert log["nIters"] == 0
+    assert log["metrics"]["correct"]["count"] == 1
+    events = llsdir.metrics_path(E).read_text().splitlines()
+    assert json.loads(events[0])["stage"] == "correct"
+
+    E.reduce_to_raw()
+    assert not llsdir.metrics_path(E).exists()
+
+
+def test_preview_metrics(lls_folder, monkeypatch):
+    monkeypatch.setattr(llsdir, "deskewGPU", lambda im, *args: im)
+    recorder = metrics.Recorder()
+    out = llsdir.preview(str(lls_folder), tR=[0, 1], nIters=0, recorder=recorder)
+    assert out.shape[:2] == (2, 2)
+    summary = recorder.summary()
+    assert [summary[s]["count"] for s in ("read", "preprocess", "deconvolve")] == [
+        2,
+        2,
+        2,
+    ]
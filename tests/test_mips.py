@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from llspy import llsdir
+from llspy.mips import MIPAccumulator, combo_name
+
+
+def test_accumulator(tmp_path):
+    mips = MIPAccumulator((1, 0, 1))
+    stacks = {}
+    # added out of order, as the threads of a pipeline finish them
+    for t, c in [(1, 0), (0, 1), (0, 0), (1, 1)]:
+        stacks[(t, c)] = np.random.randint(0, 1000, (4, 6, 8)).astype(np.uint16)
+        mips.add(stacks[(t, c)], t, c)
+    assert len(mips) == 4
+    assert mips.get("y") is None
+    z = mips.get("z")
+    assert z.shape == (2, 1, 2, 6, 8)
+    np.testing.assert_array_equal(z[1, 0, 0], stacks[(1, 0)].max(0))
+    np.testing.assert_array_equal(mips.get("x")[0, 0, 1], stacks[(0, 1)].max(2))
+
+    folder = tmp_path / "GPUdecon" / "MIPs"
+    paths = mips.write(folder, "cell1", dx=0.1)
+    assert sorted(paths) == [
+        str(folder / "cell1_decon_comboMIP_x.tif"),
+        str(folder / "cell1_decon_comboMIP_z.tif"),
+    ]
+    restored = MIPAccumulator((1, 0, 1))
+    restored.read(folder, "cell1", [0, 1], [0, 1])
+    np.testing.assert_array_equal(restored.get("z"), z)
+
+    mips.add_projection("z", np.zeros((3, 3)), 2, 0)
+    with pytest.raises(ValueError):
+        mips.get("z")
+
+
+def test_combo_name():
+    assert combo_name("exp/Deskewed/MIPs", "cell1", "z") == (
+        "cell1_deskewed_comboMIP_z.tif"
+    )
+    assert combo_name("exp/MIPs", "cell1", "x") == "cell1_comboMIP_x.tif"
+
+
+def test_preview_mips(lls_folder, monkeypatch):
+    monkeypatch.setattr(llsdir, "deskewGPU", lambda im, *args: im)
+    mips = MIPAccumulator((0, 0, 1))
+    out = llsdir.preview(str(lls_folder), tR=[0, 2], nIters=0, mips=mips)
+    assert mips.get("z").shape == (2, 1, 2, 16, 20)
+    np.testing.assert_array_equal(mips.get("z")[1, 0, 1], out[1, 1].max(0))
+    assert not (lls_folder / "Deskewed").exists()
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+from llspy import libcudawrapper, llsdir, pipeline, util
+
+
+@pytest.fixture
+def fake_decon(monkeypatch):
+    calls = []
+
+    def quickDecon(im, otf, savedeskew=False, **kwargs):
+        calls.append((otf, im.shape))
+        result = im.astype(np.float32)
+        return (result, result.copy()) if savedeskew else result
+
+    monkeypatch.setattr(libcudawrapper, "quickDecon", quickDecon)
+    return calls
+
+
+def _params(E, **kwargs):
+    P = E.localParams(nIters=0, **kwargs)
+    # don't go looking for real OTFs
+    P.nIters = 5
+    P.otfs = ["otf488", "otf642"]
+    return P
+
+
+@pytest.mark.parametrize("keepCorrected", [False, True])
+def test_stream_process(lls_folder, fake_decon, keepCorrected):
+    E = llsdir.LLSdir(str(lls_folder))
+    P = _params(E, trimZ=(1, 0), keepCorrected=keepCorrected, mergeMIPs=False)
+    processed = []
+    pipeline.stream_process(E, P, callback=processed.append)
+
+    assert len(processed) == 6
+    assert [c[0] for c in fake_decon] == ["otf488", "otf642"] * 3
+    assert all(c[1] == (5, 16, 20) for c in fake_decon)
+
+    decon = sorted(os.listdir(lls_folder / "GPUdecon"))
+    decon = [f for f in decon if f.endswith("_decon.tif")]
+    assert len(decon) == 6
+    assert util.imread(str(lls_folder / "GPUdecon" / decon[0])).dtype == np.uint16
+    mips = os.listdir(lls_folder / "GPUdecon" / "MIPs")
+    assert len(mips) == 6
+    assert all(f.endswith("_MIP_z.tif") for f in mips)
+
+    corrected = lls_folder / "Corrected"
+    if keepCorrected:
+        assert len(os.listdir(corrected)) == 6
+    else:
+        assert not corrected.exists()
+
+
+def test_stream_process_merged_mips(lls_folder, fake_decon):
+    E = llsdir.LLSdir(str(lls_folder))
+    P = _params(E, trimZ=(1, 0), mergeMIPs=True)
+    pipeline.stream_process(E, P)
+
+    # projections are merged in memory, no per-stack MIP files are written
+    mips = os.listdir(lls_folder / "GPUdecon" / "MIPs")
+    assert mips == [f"{E.basename}_decon_comboMIP_z.tif"]
+    combo = util.imread(str(lls_folder / "GPUdecon" / "MIPs" / mips[0]))
+    assert combo.shape == (3, 2, 16, 20)
+
+
+def test_process_dispatch(lls_folder, monkeypatch):
+    streamed = []
+    monkeypatch.setattr(pipeline, "stream_process", lambda E, P: streamed.append(P))
+    opts = {"nIters": 0, "mergeMIPs": False, "writeLog": False}
+    llsdir.process(str(lls_folder), streamPipeline=True, **opts)
+    assert len(streamed) == 1
+    # bleach correction is only done by cudaDeconv
+    job = llsdir.ProcessJob(
+        str(lls_folder), streamPipeline=True, bleachCorrection=True, **opts
+    )
+    assert job.ready and not job.stream
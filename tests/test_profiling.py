@@ -0,0 +1,80 @@
+import json
+import zipfile
+
+import pytest
+from click.testing import CliRunner
+
+from llspy import llsdir, profiling
+from llspy.bin.llspy_cli import cli
+
+
+def test_profile_bundle(lls_folder, tmp_path, monkeypatch):
+    monkeypatch.setattr(llsdir, "deskewGPU", lambda im, *args: im)
+    bundle = profiling.profile(
+        str(lls_folder), tmp_path / "sampled", tRange=[0, 1], nIters=0, interval=0.001
+    )
+    assert sorted(p.name for p in bundle.iterdir()) == [
+        "context.json",
+        "functions.json",
+        "functions.txt",
+        "metrics.jsonl",
+        "stacks.folded",
+        "stages.json",
+    ]
+    data = profiling.load_bundle(bundle)
+    assert data["stages"]["read"]["count"] == 2
+    assert data["context"]["params"]["nIters"] == 0
+    assert data["context"]["command"]["tRange"] == [0, 1]
+    assert "numpy" in data["context"]["machine"]["packages"]
+    for line in (bundle / "stacks.folded").read_text().splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+        # stages are root frames, frames above the profiled call are left out
+        assert not stack.startswith("llspy/profiling.py")
+
+    exact = profiling.profile(
+        str(lls_folder),
+        tmp_path / "exact.zip",
+        tRange=[0, 1],
+        sampling=False,
+        nIters=0,
+    )
+    with zipfile.ZipFile(str(exact)) as zf:
+        assert "profile.prof" in zf.namelist()
+    functions = profiling.load_bundle(exact)["functions"]
+    preview = next(f for f in functions if f["function"] == "llspy/llsdir.py:preview")
+    assert preview["calls"] == 1
+    assert "read" in profiling.compare(bundle, exact)
+
+
+def test_profile_cli(lls_folder, tmp_path, monkeypatch):
+    monkeypatch.setattr(llsdir, "deskewGPU", lambda im, *args: im)
+    config = tmp_path / "config.ini"
+    config.write_text("[General]\nnIters = 0\n")
+    runner = CliRunner()
+    baseline = tmp_path / "baseline"
+    args = ["profile", str(lls_folder), "-c", str(config), "-t", "0-1", "-o"]
+    result = runner.invoke(cli, [*args, str(baseline)])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(
+        cli, [*args, str(tmp_path / "new.zip"), "--baseline", str(baseline)]
+    )
+    assert result.exit_code == 0, result.output
+    assert "old (s)" in result.output
+    context = profiling.load_bundle(tmp_path / "new.zip")["context"]
+    assert context["params"]["tRange"] == [0, 1]
+    assert context["error"] is None
+
+    result = runner.invoke(cli, ["profile", str(lls_folder), "-t", "a-b"])
+    assert result.exit_code != 0
+
+
+def test_profile_error(lls_folder, tmp_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(llsdir, "preprocess_stacks", fail)
+    with pytest.raises(RuntimeError):
+        profiling.profile(str(lls_folder), tmp_path / "failed", nIters=0)
+    with open(tmp_path / "failed" / "context.json") as f:
+        assert "boom" in json.load(f)["error"]
@@ -0,0 +1,68 @@
+import os
+
+import numpy as np
+import pytest
+
+from llspy import llsdir, util
+from llspy.mips import MIPAccumulator
+
+
+class FakeRegObj:
+    def __init__(self):
+        self.calls = []
+
+    def get_tform(self, movingWave, refWave=488, mode="2step"):
+        self.calls.append(movingWave)
+        return np.eye(4)
+
+
+@pytest.fixture
+def fake_affine(monkeypatch):
+    monkeypatch.setattr(llsdir, "affineGPU", lambda im, tmat, dzyx=None: im + 1)
+
+
+def test_register_folder(lls_folder, fake_affine):
+    regobj = FakeRegObj()
+    registered = []
+    llsdir.register_folder(
+        lls_folder, 488, "2step", regobj, workers=2, callback=registered.append
+    )
+    # transforms are only looked up once per wavelength
+    assert regobj.calls == [642]
+    files = sorted(f for f in os.listdir(lls_folder) if "_REG488" in f)
+    assert len(files) == 6
+    assert len(registered) == 6
+    # originals of the moving channel are kept unless discard=True
+    assert len([f for f in os.listdir(lls_folder) if f.endswith(".tif")]) == 9
+    moved = next(f for f in files if "642nm" in f)
+    assert util.imread(str(lls_folder / moved)).min() >= 1
+
+
+def test_register_folder_mips(lls_folder, fake_affine):
+    mipdir = lls_folder / "MIPs"
+    mipdir.mkdir()
+    for f in lls_folder.glob("*_488nm_*.tif"):
+        util.imsave(
+            util.imread(str(f)).max(0),
+            str(mipdir / f.name.replace(".tif", "_MIP_z.tif")),
+        )
+    mips = MIPAccumulator((0, 0, 1))
+    llsdir.register_folder(lls_folder, 488, "2step", FakeRegObj(), mips=mips)
+    z = mips.get("z")
+    assert z.shape == (3, 1, 2, 16, 20)
+    # the moving channel is projected after registration
+    moved = next(lls_folder.glob("*ch1_stack0001_*_REG488.tif"))
+    np.testing.assert_array_equal(z[1, 0, 1], util.imread(str(moved)).max(0))
+    ref = next(mipdir.glob("*ch0_stack0002_*"))
+    np.testing.assert_array_equal(z[2, 0, 0], util.imread(str(ref)))
+
+
+def test_register_folder_discard_and_errors(lls_folder, monkeypatch):
+    def boom(im, tmat, dzyx=None):
+        raise RuntimeError("warp failed")
+
+    monkeypatch.setattr(llsdir, "affineGPU", boom)
+    with pytest.raises(RuntimeError):
+        llsdir.register_folder(lls_folder, 488, "2step", FakeRegObj(), discard=True)
+    # nothing was renamed or deleted when the pipeline failed
+    assert not any("_REG" in f for f in os.listdir(lls_folder))
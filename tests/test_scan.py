@@ -0,0 +1,43 @@
+import os
+
+from llspy import scan, util
+
+from .conftest import make_lls_folder
+
+
+def _tree(root):
+    a = make_lls_folder(root / "day1" / "cellA", nt=1)
+    b = make_lls_folder(root / "day2" / "deep" / "cellB", nt=1)
+    # outputs are sized but never searched for experiments
+    make_lls_folder(a / "GPUdecon" / "copy", nt=1)
+    make_lls_folder(root / "Corrected" / "cellC", nt=1)
+    return a, b
+
+
+def test_find_experiments(tmp_path):
+    a, b = _tree(tmp_path)
+    found = scan.find_experiments(str(tmp_path), level=1000)
+    assert [e.path for e in found] == [str(a), str(b)]
+    assert all(e.size is None for e in found)
+    assert found[0].mtime == os.stat(a).st_mtime
+
+    # depth is limited like util.walklevel
+    assert [e.path for e in scan.find_experiments(str(tmp_path), level=2)] == [str(a)]
+    assert sorted(
+        util.get_subfolders_containing_filepattern(str(tmp_path), level=2)
+    ) == [str(a)]
+
+
+def test_find_experiment_sizes(tmp_path):
+    a, b = _tree(tmp_path)
+    found = scan.find_experiments(str(tmp_path), level=1000, sizes=True, workers=3)
+    assert [e.size for e in found] == [
+        util.getfoldersize(str(a), recurse=True),
+        util.getfoldersize(str(b), recurse=True),
+    ]
+
+
+def test_expand_paths(tmp_path):
+    a, b = _tree(tmp_path)
+    found = scan.expand_paths([str(a), str(tmp_path / "day2"), str(a)], level=2)
+    assert list(found) == [str(a), str(b)]
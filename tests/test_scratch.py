@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from llspy import llsdir, scratch
+from llspy.exceptions import ScratchError
+
+
+def test_scratch_stage(lls_folder, tmp_path_factory):
+    root = tmp_path_factory.mktemp("scratch")
+    E = llsdir.LLSdir(str(lls_folder))
+    stage = scratch.ScratchStage(E, str(root))
+    assert os.path.dirname(stage.path) == str(root)
+    assert len(stage.exp.tiff.raw) == len(E.tiff.raw)
+    assert all(os.path.islink(f) for f in stage.exp.tiff.raw)
+
+    # outputs of an earlier run (e.g. other timepoints) are kept
+    os.makedirs(lls_folder / "GPUdecon")
+    (lls_folder / "GPUdecon" / "earlier.tif").write_text("x")
+    for d in ("GPUdecon", "Corrected"):
+        os.makedirs(os.path.join(stage.path, d))
+        with open(os.path.join(stage.path, d, "out.tif"), "w") as f:
+            f.write("x")
+    stage.finish(wait=True)
+
+    assert (lls_folder / "GPUdecon" / "out.tif").exists()
+    assert (lls_folder / "GPUdecon" / "earlier.tif").exists()
+    assert not (lls_folder / "Corrected").exists()
+    assert not os.path.exists(stage.path)
+    # raw data are untouched
+    assert len(llsdir.LLSdir(str(lls_folder)).tiff.raw) == len(E.tiff.raw)
+
+
+def test_scratch_capacity(lls_folder, tmp_path_factory):
+    root = tmp_path_factory.mktemp("scratch")
+    E = llsdir.LLSdir(str(lls_folder))
+    with pytest.raises(ScratchError):
+        scratch.ScratchStage(E, str(root), nbytes=2**62)
+    assert not os.listdir(root)
+
+    P = E.localParams(nIters=0, scratchDir=str(root))
+    assert scratch.estimate_bytes(E, P) == 0
+    P = E.localParams(nIters=0, scratchDir=str(root), trimZ=(1, 0))
+    assert scratch.estimate_bytes(E, P) == sum(E.tiff.bytes)
+
+
+def test_process_with_scratch(lls_folder, tmp_path_factory):
+    root = tmp_path_factory.mktemp("scratch")
+    llsdir.process(
+        str(lls_folder),
+        nIters=0,
+        trimZ=(1, 0),
+        keepCorrected=True,
+        streamPipeline=True,
+        scratchDir=str(root),
+        mergeMIPs=False,
+    )
+    scratch.wait_for_copies()
+    assert len(os.listdir(lls_folder / "Corrected")) == 6
+    assert not os.listdir(root)
@@ -0,0 +1,47 @@
+import numpy as np
+
+from llspy import camera, llsdir, synthetic, util
+
+
+def test_make_experiment(tmp_path):
+    path = synthetic.make_experiment(
+        tmp_path / "exp", nz=8, ny=32, nx=24, nt=3, waves=(488, 560, 642), mips=True
+    )
+    E = llsdir.LLSdir(str(path))
+    P = E.parameters
+    assert (P.nc, P.nt, P.nz, P.ny, P.nx) == (3, 3, 8, 32, 24)
+    assert P.samplescan and P.dz == 0.4 and P.dx == 0.104
+    assert len(E.get_t(2)) == 3
+    assert len(list((path / "MIPs").glob("*MIP_z.tif"))) == 9
+    stack = util.imread(E.get_t(0)[0])
+    assert stack.dtype == np.uint16 and stack.min() >= 100
+
+
+def test_make_camparams(tmp_path):
+    path = synthetic.make_experiment(tmp_path / "exp", nz=4, ny=32, nx=24, nt=1)
+    fname = synthetic.make_camparams(tmp_path, 32, 24)
+    assert camera.seemsValidCamParams(fname)
+    E = llsdir.LLSdir(str(path))
+    params = camera.CameraParameters(fname).get_subroi(E.settings.camera.roi)
+    assert params.shape == (3, 32, 24)
+    stacks = [util.imread(f) for f in E.get_t(0)]
+    corrected = params.correct_stacks(stacks, flashCorrectTarget="numpy")
+    assert corrected[0].shape == stacks[0].shape
+
+
+def test_registration_beads():
+    from fiducialreg.fiducialreg import CloudSet
+
+    shape = (32, 128, 64)
+    shift = np.array([0, 0.8, -0.6])
+    rng = np.random.default_rng(0)
+    positions = synthetic.bead_positions(shape, 30)
+    volumes = [
+        rng.poisson(synthetic.render_beads(shape, positions + c * shift) + 5) + 100.0
+        for c in range(2)
+    ]
+    cloudset = CloudSet(volumes, dx=0.104, dz=0.4, filtertype="log")
+    assert cloudset.count == [30, 30]
+    tform = cloudset.tform(mode="translation", inworld=False)
+    # the transform maps channel 1 (xyz) back onto channel 0
+    np.testing.assert_allclose(tform[:3, 3], -shift[::-1], atol=0.05)
@@ -0,0 +1,111 @@
+import threading
+
+import numpy as np
+import pytest
+
+from llspy import util
+from llspy.tiffio import AsyncTiffWriter, StackPrefetcher, read_into
+
+
+def test_async_writer_roundtrip(tmp_path):
+    written = []
+    stacks = [np.full((4, 8, 8), i, np.uint16) for i in range(10)]
+    with AsyncTiffWriter(workers=2, maxqueue=2) as writer:
+        for i, stack in enumerate(stacks):
+            writer.submit(stack, tmp_path / f"out{i}.tif", callback=written.append)
+    assert writer.nwritten == 10
+    assert len(written) == 10
+    for i, stack in enumerate(stacks):
+        np.testing.assert_array_equal(util.imread(str(tmp_path / f"out{i}.tif")), stack)
+
+
+def test_async_writer_backpressure(tmp_path, monkeypatch):
+    release = threading.Event()
+    orig = util.imsave
+
+    def slow_imsave(*args, **kwargs):
+        release.wait(5)
+        orig(*args, **kwargs)
+
+    monkeypatch.setattr(util, "imsave", slow_imsave)
+    writer = AsyncTiffWriter(workers=1, maxqueue=1)
+    arr = np.zeros((2, 4, 4), np.uint16)
+    writer.submit(arr, tmp_path / "a.tif")
+    writer.submit(arr, tmp_path / "b.tif")
+
+    blocked = threading.Thread(target=writer.submit, args=(arr, tmp_path / "c.tif"))
+    blocked.start()
+    blocked.join(0.2)
+    assert blocked.is_alive()  # queue is full, submit must wait
+    release.set()
+    blocked.join(5)
+    assert not blocked.is_alive()
+    writer.close()
+    assert writer.nwritten == 3
+
+
+def test_async_writer_error(tmp_path):
+    writer = AsyncTiffWriter()
+    arr = np.zeros((2, 4, 4), np.uint16)
+    writer.submit(arr, tmp_path / "missing_dir" / "out.tif")
+    with pytest.raises(Exception):
+        writer.flush()
+    writer.close()
+
+
+def _write_groups(path, ngroups=5, nfiles=2):
+    groups = []
+    for t in range(ngroups):
+        group = []
+        for c in range(nfiles):
+            fname = str(path / f"t{t}_c{c}.tif")
+            util.imsave(np.full((3, 8, 8), t * 10 + c, np.uint16), fname)
+            group.append(fname)
+        groups.append(group)
+    return groups
+
+
+@pytest.mark.parametrize("depth", [0, 1, 3])
+def test_prefetcher_order(tmp_path, depth):
+    groups = _write_groups(tmp_path)
+    prefetch = StackPrefetcher(groups, depth=depth)
+    for t, (paths, stacks) in enumerate(prefetch):
+        assert paths == groups[t]
+        assert [s[0, 0, 0] for s in stacks] == [t * 10, t * 10 + 1]
+    assert t == len(groups) - 1
+
+
+def test_prefetcher_recycles_buffers(tmp_path):
+    groups = _write_groups(tmp_path)
+    seen = []
+    for t, (_, stacks) in enumerate(StackPrefetcher(groups, depth=1, recycle=True)):
+        assert stacks[1][0, 0, 0] == t * 10 + 1
+        seen.extend(stacks)
+    # later groups are read into the arrays of earlier ones
+    assert len({id(s) for s in seen}) < len(seen)
+
+
+def test_prefetcher_memory_budget(tmp_path):
+    groups = _write_groups(tmp_path, ngroups=10)
+    assert StackPrefetcher(groups, memory_budget=100, group_bytes=100).depth == 0
+    assert StackPrefetcher(groups, memory_budget=300, group_bytes=100).depth == 2
+    assert StackPrefetcher(groups, memory_budget=10**9, maxdepth=4).depth == 4
+
+
+def test_prefetcher_planes_and_break(tmp_path):
+    groups = _write_groups(tmp_path)
+    prefetch = StackPrefetcher(groups, depth=2, planes=slice(1, 3), recycle=True)
+    assert not prefetch.recycle
+    for _, stacks in prefetch:
+        assert stacks[0].shape == (2, 8, 8)
+        break
+
+
+def test_read_into(tmp_path):
+    groups = _write_groups(tmp_path, ngroups=3)
+    paths = [p for group in groups for p in group]
+    out = np.zeros((3, 2, 3, 8, 8), np.uint16)
+    read_into(paths, [out[t, c] for t in range(3) for c in range(2)])
+    assert out[:, :, 0, 0, 0].tolist() == [[0, 1], [10, 11], [20, 21]]
+    with pytest.raises(ValueError):
+        read_into(paths[:1], [np.zeros((3, 8, 9), np.uint16)])
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+import tifffile
+
+from llspy import util
+from llspy.llsdir import LLSdir, filter_stack
+
+
+@pytest.fixture
+def stack_file(tmp_path):
+    data = np.arange(5 * 8 * 9, dtype=np.uint16).reshape(5, 8, 9)
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, data)
+    return path, data
+
+
+def test_imread_memmap(stack_file):
+    path, data = stack_file
+    mm = util.imread(path, memmap=True)
+    assert isinstance(mm, np.memmap)
+    np.testing.assert_array_equal(mm, data)
+    np.testing.assert_array_equal(util.imread(path, memmap=True, planes=2), data[2])
+
+
+def test_imread_memmap_fallback(tmp_path):
+    data = np.ones((3, 8, 9), np.uint16)
+    path = str(tmp_path / "compressed.tif")
+    tifffile.imwrite(path, data, compression="zlib", photometric="minisblack")
+    out = util.imread(path, memmap=True)
+    assert not isinstance(out, np.memmap)
+    np.testing.assert_array_equal(out, data)
+
+
+@pytest.mark.parametrize("planes", [1, slice(1, 4), [0, 4]])
+def test_imread_planes(stack_file, planes):
+    path, data = stack_file
+    np.testing.assert_array_equal(util.imread(path, planes=planes), data[planes])
+
+
+def test_imread_header_only(stack_file):
+    path, data = stack_file
+    assert util.imread(path, header_only=True) == (data.shape, data.dtype)
+
+
+def test_llsdir_header_and_background(lls_folder):
+    E = LLSdir(lls_folder)
+    assert E.parameters.shape == (6, 16, 20)
+    assert E.tiff.bit_depth == 16
+    assert all(90 < b < 110 for b in E.get_background())
+
+
+def test_filter_stack_reads_trimmed_planes(stack_file, tmp_path):
+    path, data = stack_file
+    outname = str(tmp_path / "out.tif")
+    filter_stack(path, outname, 0.1, 100, ((1, 2), (0, 0), (1, 1)), False)
+    np.testing.assert_array_equal(util.imread(outname), data[1:3, :, 1:8])
@@ -0,0 +1,138 @@
+import json
+import shutil
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from llspy import llsdir, util, watch
+
+from .conftest import make_lls_folder
+
+
+@pytest.fixture
+def fake_deskew(monkeypatch):
+    def deskewGPU(im, *args, **kwargs):
+        return im.astype(np.float32)
+
+    monkeypatch.setattr(llsdir, "deskewGPU", deskewGPU)
+
+
+def _run_until(daemon, condition, timeout=10):
+    thread = threading.Thread(target=daemon.run, daemon=True)
+    thread.start()
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.02)
+    daemon.stop()
+    thread.join()
+    return condition()
+
+
+def _acquire(source, dest, timepoints):
+    """copy the raw files of some timepoints, as if they were being acquired"""
+    dest.mkdir(exist_ok=True)
+    shutil.copy(next(source.glob("*Settings.txt")), dest)
+    for t in timepoints:
+        for f in sorted(source.glob(f"*_stack{t:04d}_*.tif")):
+            shutil.copy(f, dest)
+
+
+def test_watch_daemon(tmp_path, fake_deskew):
+    source = make_lls_folder(tmp_path / "source", nt=4)
+    root = tmp_path / "root"
+    root.mkdir()
+    exp = root / "cell1"
+    opts = {"nIters": 0}
+
+    daemon = watch.WatchDaemon(root, opts, workers=2, settle=0.05, poll_interval=0.02)
+    with daemon:
+        daemon.start()
+        _acquire(source, exp, range(3))
+        assert _run_until(daemon, lambda: daemon.nprocessed == 3)
+    deskewed = sorted(p.name for p in (exp / "Deskewed").iterdir())
+    assert len(deskewed) == 6
+    assert all(f.endswith("_deskewed.tif") for f in deskewed)
+    state = json.loads((root / watch.STATE_FILE).read_text())
+    assert state == {"cell1": [0, 1, 2]}
+
+    # a restarted daemon only processes the new timepoint
+    daemon = watch.WatchDaemon(root, opts, workers=2, settle=0.05, poll_interval=0.02)
+    with daemon:
+        daemon.start()
+        _acquire(source, exp, [3])
+        # wait until the already processed files have been seen as well
+        assert _run_until(daemon, lambda: daemon.nprocessed and not len(daemon.tracker))
+    assert daemon.nprocessed == 1
+    assert len(list((exp / "Deskewed").iterdir())) == 8
+    state = json.loads((root / watch.STATE_FILE).read_text())
+    assert state == {"cell1": [0, 1, 2, 3]}
+
+
+def test_watch_merged_mips(tmp_path, fake_deskew):
+    source = make_lls_folder(tmp_path / "source", nt=3)
+    root = tmp_path / "root"
+    root.mkdir()
+    exp = root / "cell1"
+    opts = {"nIters": 0, "rMIP": (0, 0, 1), "mergeMIPs": True}
+    combo = exp / "Deskewed" / "MIPs" / "sample_deskewed_comboMIP_z.tif"
+
+    for timepoints, total in ((range(2), 2), ([2], 3)):
+        daemon = watch.WatchDaemon(root, opts, settle=0.05, poll_interval=0.02)
+        with daemon:
+            daemon.start()
+            _acquire(source, exp, timepoints)
+            assert _run_until(daemon, lambda: daemon.nprocessed == len(timepoints))
+        # written on close, continued after a restart
+        assert util.imread(str(combo)).shape == (total, 2, 16, 20)
+    assert list((exp / "Deskewed" / "MIPs").iterdir()) == [combo]
+
+
+def test_is_raw_stack():
+    name = "cell1_ch0_stack0000_488nm_{}msec_0001000000msecAbs.tif"
+    assert watch.is_raw_stack(name.format("0000000"))
+    # more than 9,999,999 ms into the acquisition
+    assert watch.is_raw_stack(name.format("12345678"))
+    assert not watch.is_raw_stack("cell1_Settings.txt")
+    assert not watch.is_raw_stack("notes.tif")
+
+
+def test_one_gpu_thread_and_failed_writes(tmp_path, monkeypatch):
+    source = make_lls_folder(tmp_path / "source", nt=4)
+    root = tmp_path / "root"
+    root.mkdir()
+    exp = root / "cell1"
+    lock = threading.Lock()
+    running = []
+
+    def deskewGPU(im, *args, **kwargs):
+        with lock:
+            running.append(threading.current_thread().name)
+        time.sleep(0.05)
+        return im.astype(np.float32)
+
+    imsave = watch.util.imsave
+
+    def flaky_imsave(arr, outpath, **kwargs):
+        if "_stack0001_" in outpath and "_ch1_" in outpath:
+            raise OSError("disk full")
+        imsave(arr, outpath, **kwargs)
+
+    monkeypatch.setattr(llsdir, "deskewGPU", deskewGPU)
+    monkeypatch.setattr(watch.util, "imsave", flaky_imsave)
+    daemon = watch.WatchDaemon(root, {"nIters": 0}, workers=4, settle=0.05)
+    with daemon:
+        daemon.start()
+        _acquire(source, exp, range(4))
+        assert _run_until(
+            daemon,
+            lambda: (
+                sum(len(e.done | e.failed) for e in daemon.experiments.values()) == 4
+            ),
+        )
+    assert set(running) == {"lls-watch-gpu_0"}
+    assert daemon.experiments[str(exp)].failed == {1}
+    state = json.loads((root / watch.STATE_FILE).read_text())
+    # the timepoint that couldn't be written is retried after a restart
+    assert state == {"cell1": [0, 2, 3]}
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+
+from llspy import arrayfun, libcudawrapper, llsdir, pipeline, util
+
+zarr = pytest.importorskip("zarr")
+zarrio = pytest.importorskip("llspy.zarrio")
+
+
+def test_zarr_writer(tmp_path):
+    store = tmp_path / "cell1.ome.zarr"
+    stacks = np.random.randint(0, 1000, (2, 2, 4, 40, 30)).astype(np.uint16)
+    name = "cell1_ch{}_stack{:04d}_488nm_0000000msec_0001000000msecAbs_decon.tif"
+    with zarrio.ZarrWriter(store, timepoints=[3, 5], channels=[0, 1]) as writer:
+        for t, stack in zip([3, 5], stacks):
+            for c in range(2):
+                path = tmp_path / "GPUdecon" / name.format(c, t)
+                writer.submit(stack[c], path, dx=0.1, dz=0.2)
+        # not a stack of an output folder: written to a tiff file
+        (tmp_path / "MIPs").mkdir()
+        writer.submit(stacks[0, 0].max(0), tmp_path / "MIPs" / "mip.tif")
+
+    A = zarrio.open_image(store, "GPUdecon")
+    assert A.shape == (2, 2, 4, 40, 30)
+    np.testing.assert_array_equal(A[1, 0], stacks[1, 0])
+    assert zarrio.open_image(store, "GPUdecon", 2).shape == (2, 2, 4, 10, 7)
+    scale = zarr.open_group(str(store))["GPUdecon"].attrs["multiscales"][0]
+    transforms = [d["coordinateTransformations"][0]["scale"] for d in scale["datasets"]]
+    assert transforms[1] == [1, 1, 0.2, 0.2, 0.2]
+    assert util.imread(str(tmp_path / "MIPs" / "mip.tif")).shape == (40, 30)
+    assert not (tmp_path / "GPUdecon").exists()
+    with pytest.raises(KeyError):
+        zarrio.open_image(store, "Deskewed")
+
+
+def test_zarr_writer_grows(tmp_path):
+    writer = zarrio.ZarrWriter(tmp_path / "live.ome.zarr", levels=1)
+    for t in (0, 2):
+        writer.write_stack("Deskewed", np.full((2, 4, 4), t + 1, np.float32), t, 1)
+    A = zarrio.open_image(tmp_path / "live.ome.zarr", "Deskewed")
+    assert A.shape == (3, 2, 2, 4, 4)
+    assert A[2, 1].max() == 3 and A[1].max() == 0
+    with pytest.raises(ValueError):
+        writer.write_stack("Deskewed", np.zeros((3, 4, 4)), 0, 0)
+
+
+def test_stream_process_zarr(lls_folder, monkeypatch):
+    def quickDecon(im, otf, savedeskew=False, **kwargs):
+        result = im.astype(np.float32)
+        return (result, result.copy()) if savedeskew else result
+
+    monkeypatch.setattr(libcudawrapper, "quickDecon", quickDecon)
+    E = llsdir.LLSdir(str(lls_folder))
+    P = E.localParams(nIters=0, outputFormat="zarr", trimZ=(1, 0), MIP=(0, 0, 1))
+    P.nIters = 5
+    P.otfs = ["otf488", "otf642"]
+    assert pipeline.should_stream(P)
+    pipeline.stream_process(E, P)
+
+    assert os.listdir(lls_folder / "GPUdecon") == ["MIPs"]
+    A = E.output_array("GPUdecon")
+    assert A.shape == (3, 2, 5, 16, 20)
+    raw = util.imread(str(E.get_files(t=2, c=1)[0]))[1:]
+    expected = arrayfun.sub_background(raw, P.background[1])
+    np.testing.assert_array_equal(A[2, 1], pipeline._to_uint16(expected))
+    assert pipeline.output_store(E, P).name == "sample.ome.zarr"
+
+    E.reduce_to_raw(verbose=False)
+    with pytest.raises(FileNotFoundError):
+        E.output_array()